@@ -23,7 +23,9 @@ def _database_url():
 
 def _include_object(object, name, type_, reflected, compare_to):
     """Only manage objects in the accounts schema — the database also holds
-    legacy public tables, telemetry and umami, which alembic must never touch."""
+    legacy public tables, telemetry and umami, which autogenerate must never
+    touch. (Hand-written migrations may: 0002 partitions telemetry.events,
+    0007 adds the COPY staging table, 0008 the rollup tables.)"""
     if type_ == "table":
         return object.schema == "accounts"
     return True
@@ -0,0 +1,140 @@
+"""telemetry.events partitioned by month
+
+Revision ID: 0002_telemetry_partitions
+Revises: 0001_accounts
+Create Date: 2026-10-17 10:12:44.318520
+
+Hand-written: autogenerate never looks at the telemetry schema (see env.py).
+
+The existing table cannot be turned into a partitioned one in place, so it is
+renamed to telemetry.events_legacy and attached, as it is, as the partition of
+everything before the first day of next month: no rows are copied. (ATTACH
+checks every row against the bound, and rows stamped by the created_at default
+below carry the migration's own time, so the bound must lie past it.) Events
+of the rest of this month also land in events_legacy. Monthly partitions from
+next month on follow, plus a DEFAULT partition that catches anything past the
+last of them (the partition-ahead job in telemetry_jobs.py keeps that from
+happening). The event_id sequence moves to the new table.
+
+Assumes an event_id serial or identity column; created_at is added first if
+the table predates the rollups. A sequence cannot be shared with an identity
+column, so an identity event_id becomes a plain sequence default; its comment
+records the identity kind for the downgrade. The foreign keys to sessions and
+designs move to the parent as <name>_p.
+
+The downgrade copies the rows back into one plain table and restores the
+foreign keys under their original names and the identity column, if there
+was one. created_at stays.
+"""
+import datetime
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '0002_telemetry_partitions'
+down_revision: Union[str, None] = '0001_accounts'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+
+
+def _month(day: datetime.date, offset: int) -> datetime.date:
+    index = day.year * 12 + day.month - 1 + offset
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    # Bounds are UTC midnights; NOW() is before the next one in UTC.
+    legacy_until = _month(datetime.datetime.now(datetime.timezone.utc).date(), 1)
+    op.execute("ALTER TABLE telemetry.events ADD COLUMN IF NOT EXISTS created_at "
+               "TIMESTAMPTZ NOT NULL DEFAULT NOW()")
+    op.execute("ALTER TABLE telemetry.events RENAME TO events_legacy")
+    op.execute("CREATE TABLE telemetry.events (LIKE telemetry.events_legacy INCLUDING DEFAULTS) "
+               "PARTITION BY RANGE (created_at)")
+    op.execute("ALTER TABLE telemetry.events ADD PRIMARY KEY (event_id, created_at)")
+    op.execute("""
+        DO $$
+        DECLARE
+            seq TEXT := pg_get_serial_sequence('telemetry.events_legacy', 'event_id');
+            identity_kind "char";
+            next_id BIGINT;
+            constraint_row RECORD;
+        BEGIN
+            SELECT attidentity INTO identity_kind FROM pg_attribute
+            WHERE attrelid = 'telemetry.events_legacy'::regclass AND attname = 'event_id';
+            IF identity_kind <> '' THEN
+                -- An identity sequence cannot be shared: replace it by a plain one.
+                SELECT COALESCE(max(event_id), 0) + 1 INTO next_id FROM telemetry.events_legacy;
+                ALTER TABLE telemetry.events_legacy ALTER COLUMN event_id DROP IDENTITY;
+                EXECUTE format('CREATE SEQUENCE telemetry.events_event_id_seq START %s', next_id);
+                EXECUTE format('COMMENT ON SEQUENCE telemetry.events_event_id_seq IS %L',
+                               CASE identity_kind WHEN 'a' THEN 'identity: ALWAYS' ELSE 'identity: BY DEFAULT' END);
+                seq := 'telemetry.events_event_id_seq';
+            END IF;
+            EXECUTE format('ALTER TABLE telemetry.events ALTER COLUMN event_id SET DEFAULT nextval(%L)', seq);
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY telemetry.events.event_id', seq);
+            ALTER TABLE telemetry.events_legacy ALTER COLUMN event_id DROP DEFAULT;
+
+            -- Foreign keys to sessions/designs belong on the parent now.
+            FOR constraint_row IN
+                SELECT conname, pg_get_constraintdef(oid) AS definition FROM pg_constraint
+                WHERE conrelid = 'telemetry.events_legacy'::regclass AND contype = 'f'
+            LOOP
+                EXECUTE format('ALTER TABLE telemetry.events ADD CONSTRAINT %I %s',
+                               constraint_row.conname || '_p', constraint_row.definition);
+            END LOOP;
+        END $$
+    """)
+    op.execute("CREATE INDEX ON telemetry.events (session_id)")
+    op.execute("CREATE INDEX ON telemetry.events (design_id)")
+
+    op.execute("ALTER TABLE telemetry.events ATTACH PARTITION telemetry.events_legacy "
+               f"FOR VALUES FROM (MINVALUE) TO ('{legacy_until.isoformat()} 00:00:00+00')")
+    for offset in range(MONTHS_AHEAD):
+        start, end = _month(legacy_until, offset), _month(legacy_until, offset + 1)
+        op.execute(f"CREATE TABLE telemetry.events_y{start.year}m{start.month:02d} "
+                   f"PARTITION OF telemetry.events FOR VALUES FROM ('{start.isoformat()} 00:00:00+00') "
+                   f"TO ('{end.isoformat()} 00:00:00+00')")
+    op.execute("CREATE TABLE telemetry.events_default PARTITION OF telemetry.events DEFAULT")
+
+
+def downgrade() -> None:
+    # Back to one plain table; this copies every row that retention kept.
+    op.execute("ALTER TABLE telemetry.events RENAME TO events_partitioned")
+    op.execute("CREATE TABLE telemetry.events (LIKE telemetry.events_partitioned INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO telemetry.events SELECT * FROM telemetry.events_partitioned")
+    op.execute("ALTER TABLE telemetry.events ADD PRIMARY KEY (event_id)")
+    op.execute("""
+        DO $$
+        DECLARE
+            seq TEXT := pg_get_serial_sequence('telemetry.events_partitioned', 'event_id');
+            identity_kind TEXT;
+            next_id BIGINT;
+            constraint_row RECORD;
+        BEGIN
+            identity_kind := substring(obj_description(seq::regclass, 'pg_class') FROM '^identity: (.+)$');
+            FOR constraint_row IN
+                SELECT conname, pg_get_constraintdef(oid) AS definition FROM pg_constraint
+                WHERE conrelid = 'telemetry.events_partitioned'::regclass AND contype = 'f'
+                  AND conparentid = 0
+            LOOP
+                EXECUTE format('ALTER TABLE telemetry.events ADD CONSTRAINT %I %s',
+                               regexp_replace(constraint_row.conname, '_p$', ''), constraint_row.definition);
+            END LOOP;
+            IF identity_kind IS NULL THEN
+                EXECUTE format('ALTER SEQUENCE %s OWNED BY telemetry.events.event_id', seq);
+                DROP TABLE telemetry.events_partitioned CASCADE;
+            ELSE
+                -- The stand-in sequence goes with the partitioned table.
+                SELECT COALESCE(max(event_id), 0) + 1 INTO next_id FROM telemetry.events;
+                ALTER TABLE telemetry.events ALTER COLUMN event_id DROP DEFAULT;
+                DROP TABLE telemetry.events_partitioned CASCADE;
+                EXECUTE format('ALTER TABLE telemetry.events ALTER COLUMN event_id '
+                               'ADD GENERATED %s AS IDENTITY (START WITH %s)', identity_kind, next_id);
+            END IF;
+        END $$
+    """)
+    op.execute("CREATE INDEX ON telemetry.events (session_id)")
+    op.execute("CREATE INDEX ON telemetry.events (design_id)")
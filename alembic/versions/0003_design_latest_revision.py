@@ -0,0 +1,44 @@
+"""designs carry their latest revision, revision count and schema flag
+
+Revision ID: 0003_design_latest_revision
+Revises: 0002_telemetry_partitions
+Create Date: 2026-10-17 15:02:51.904113
+
+Backfilled here from design_revisions; from then on the designs router
+updates them in the transaction that writes each revision.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0003_design_latest_revision'
+down_revision: Union[str, None] = '0002_telemetry_partitions'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('designs', sa.Column('latest_revision', sa.Integer(), server_default=sa.text('1'),
+                                       nullable=False), schema='accounts')
+    op.add_column('designs', sa.Column('revision_count', sa.Integer(), server_default=sa.text('1'),
+                                       nullable=False), schema='accounts')
+    op.add_column('designs', sa.Column('schema_valid', sa.Boolean(), server_default=sa.text('false'),
+                                       nullable=False), schema='accounts')
+    op.execute("""
+        UPDATE accounts.designs d
+        SET latest_revision = latest.revision, revision_count = counts.revisions,
+            schema_valid = latest.schema_valid
+        FROM (SELECT DISTINCT ON (design_id) design_id, revision, schema_valid
+              FROM accounts.design_revisions ORDER BY design_id, revision DESC) latest,
+             (SELECT design_id, count(*) AS revisions
+              FROM accounts.design_revisions GROUP BY design_id) counts
+        WHERE latest.design_id = d.id AND counts.design_id = d.id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('designs', 'schema_valid', schema='accounts')
+    op.drop_column('designs', 'revision_count', schema='accounts')
+    op.drop_column('designs', 'latest_revision', schema='accounts')
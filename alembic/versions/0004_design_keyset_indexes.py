@@ -0,0 +1,33 @@
+"""indexes for keyset pagination of the design listings
+
+Revision ID: 0004_design_keyset_indexes
+Revises: 0003_design_latest_revision
+Create Date: 2026-10-17 16:20:07.511842
+
+The inventory listing pages on (owner, part_type, name), which the existing
+inv_user_name / inv_org_name unique indexes already cover.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0004_design_keyset_indexes'
+down_revision: Union[str, None] = '0003_design_latest_revision'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('designs_owner_user_updated', 'designs', ['owner_user_id', 'updated_at', 'id'], unique=False,
+                    schema='accounts', postgresql_where=sa.text('deleted_at IS NULL'))
+    op.create_index('designs_owner_org_updated', 'designs', ['owner_org_id', 'updated_at', 'id'], unique=False,
+                    schema='accounts', postgresql_where=sa.text('deleted_at IS NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('designs_owner_org_updated', table_name='designs', schema='accounts',
+                  postgresql_where=sa.text('deleted_at IS NULL'))
+    op.drop_index('designs_owner_user_updated', table_name='designs', schema='accounts',
+                  postgresql_where=sa.text('deleted_at IS NULL'))
@@ -0,0 +1,76 @@
+"""design revisions stored as reverse JSON Patch deltas
+
+Revision ID: 0005_design_revision_deltas
+Revises: 0004_design_keyset_indexes
+Create Date: 2026-10-17 17:41:36.270958
+
+See app/backend/accounts/revisions.py for the layout. Existing revisions are
+converted here, one design at a time: the latest and every 10th stay full,
+the others become deltas from the revision after them.
+"""
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from app.backend.accounts.revisions import MAX_DELTA_RATIO, SNAPSHOT_EVERY, apply_patch, diff
+from app.backend.canonical import canonical_json
+
+# revision identifiers, used by Alembic.
+revision: str = '0005_design_revision_deltas'
+down_revision: Union[str, None] = '0004_design_keyset_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _design_ids(conn):
+    return conn.execute(sa.text("SELECT DISTINCT design_id FROM accounts.design_revisions")).scalars().all()
+
+
+def _revisions(conn, design_id):
+    return conn.execute(sa.text("SELECT revision, mas, mas_delta FROM accounts.design_revisions "
+                                "WHERE design_id = :id ORDER BY revision DESC"), {"id": design_id}).all()
+
+
+def upgrade() -> None:
+    op.add_column('design_revisions', sa.Column('mas_delta', postgresql.JSONB(astext_type=sa.Text()),
+                                                nullable=True), schema='accounts')
+    op.alter_column('design_revisions', 'mas', existing_type=postgresql.JSONB(astext_type=sa.Text()),
+                    nullable=True, schema='accounts')
+    op.create_check_constraint('design_revisions_mas_or_delta', 'design_revisions',
+                               '(mas IS NULL) <> (mas_delta IS NULL)', schema='accounts')
+
+    conn = op.get_bind()
+    for design_id in _design_ids(conn):
+        rows = _revisions(conn, design_id)
+        for newer, row in zip(rows, rows[1:]):
+            if row.revision % SNAPSHOT_EVERY == 0:
+                continue
+            delta = diff(newer.mas, row.mas)
+            if len(canonical_json(delta)) <= MAX_DELTA_RATIO * len(canonical_json(row.mas)):
+                conn.execute(sa.text("UPDATE accounts.design_revisions "
+                                     "SET mas = NULL, mas_delta = CAST(:delta AS JSONB) "
+                                     "WHERE design_id = :id AND revision = :revision"),
+                             {"delta": json.dumps(delta), "id": design_id, "revision": row.revision})
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    for design_id in _design_ids(conn):
+        document = None
+        for row in _revisions(conn, design_id):
+            if row.mas is not None:
+                document = row.mas
+                continue
+            document = apply_patch(document, row.mas_delta)
+            conn.execute(sa.text("UPDATE accounts.design_revisions "
+                                 "SET mas = CAST(:mas AS JSONB), mas_delta = NULL "
+                                 "WHERE design_id = :id AND revision = :revision"),
+                         {"mas": json.dumps(document), "id": design_id, "revision": row.revision})
+
+    op.drop_constraint('design_revisions_mas_or_delta', 'design_revisions', type_='check', schema='accounts')
+    op.alter_column('design_revisions', 'mas', existing_type=postgresql.JSONB(astext_type=sa.Text()),
+                    nullable=False, schema='accounts')
+    op.drop_column('design_revisions', 'mas_delta', schema='accounts')
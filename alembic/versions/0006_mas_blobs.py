@@ -0,0 +1,115 @@
+"""content-addressed mas_blobs shared by design revisions and inventory parts
+
+Revision ID: 0006_mas_blobs
+Revises: 0005_design_revision_deltas
+Create Date: 2026-10-17 19:08:12.663904
+
+Moves every full MAS document out of design_revisions.mas and
+inventory_parts.mas into accounts.mas_blobs (one row per canonical sha256),
+referenced by a blob_hash column. Row triggers on both tables keep
+mas_blobs.refcount up to date from then on; see app/backend/accounts/blobs.py.
+"""
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from app.backend.canonical import canonical_hash
+
+# revision identifiers, used by Alembic.
+revision: str = '0006_mas_blobs'
+down_revision: Union[str, None] = '0005_design_revision_deltas'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+REFERENCING_TABLES = ('design_revisions', 'inventory_parts')
+
+REFCOUNT_FUNCTION = """
+CREATE FUNCTION accounts.mas_blob_refcount() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.blob_hash IS NOT NULL THEN
+        UPDATE accounts.mas_blobs SET refcount = refcount - 1, last_used_at = now()
+        WHERE mas_hash = OLD.blob_hash;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.blob_hash IS NOT NULL THEN
+        UPDATE accounts.mas_blobs SET refcount = refcount + 1
+        WHERE mas_hash = NEW.blob_hash;
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+
+def upgrade() -> None:
+    op.create_table('mas_blobs',
+    sa.Column('mas_hash', sa.Text(), nullable=False),
+    sa.Column('mas', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('refcount', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.Column('last_used_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('mas_hash'),
+    schema='accounts'
+    )
+    for table in REFERENCING_TABLES:
+        op.add_column(table, sa.Column('blob_hash', sa.Text(), nullable=True), schema='accounts')
+        op.create_foreign_key(f'{table}_blob_hash_fkey', table, 'mas_blobs', ['blob_hash'], ['mas_hash'],
+                              source_schema='accounts', referent_schema='accounts')
+
+    # Revisions already carry the canonical hash of their document.
+    op.execute("""
+        INSERT INTO accounts.mas_blobs (mas_hash, mas)
+        SELECT DISTINCT ON (mas_hash) mas_hash, mas FROM accounts.design_revisions
+        WHERE mas IS NOT NULL ORDER BY mas_hash
+        ON CONFLICT (mas_hash) DO NOTHING
+    """)
+    op.execute("UPDATE accounts.design_revisions SET blob_hash = mas_hash WHERE mas IS NOT NULL")
+    # Inventory parts do not: hash them here, the same way the API does.
+    conn = op.get_bind()
+    for part_id, mas in conn.execute(sa.text(
+            "SELECT id, mas FROM accounts.inventory_parts WHERE mas IS NOT NULL")).all():
+        mas_hash = canonical_hash(mas)
+        conn.execute(sa.text("INSERT INTO accounts.mas_blobs (mas_hash, mas) VALUES (:hash, CAST(:mas AS JSONB)) "
+                             "ON CONFLICT (mas_hash) DO NOTHING"), {"hash": mas_hash, "mas": json.dumps(mas)})
+        conn.execute(sa.text("UPDATE accounts.inventory_parts SET blob_hash = :hash WHERE id = :id"),
+                     {"hash": mas_hash, "id": part_id})
+    op.execute("""
+        UPDATE accounts.mas_blobs b SET refcount = refs.n
+        FROM (SELECT blob_hash, count(*) AS n FROM (
+                  SELECT blob_hash FROM accounts.design_revisions WHERE blob_hash IS NOT NULL
+                  UNION ALL
+                  SELECT blob_hash FROM accounts.inventory_parts WHERE blob_hash IS NOT NULL) r
+              GROUP BY blob_hash) refs
+        WHERE refs.blob_hash = b.mas_hash
+    """)
+
+    op.drop_constraint('design_revisions_mas_or_delta', 'design_revisions', type_='check', schema='accounts')
+    op.create_check_constraint('design_revisions_blob_or_delta', 'design_revisions',
+                               '(blob_hash IS NULL) <> (mas_delta IS NULL)', schema='accounts')
+    for table in REFERENCING_TABLES:
+        op.drop_column(table, 'mas', schema='accounts')
+
+    op.execute(REFCOUNT_FUNCTION)
+    for table in REFERENCING_TABLES:
+        op.execute(f"CREATE TRIGGER {table}_mas_blob_refcount "
+                   f"AFTER INSERT OR DELETE OR UPDATE OF blob_hash ON accounts.{table} "
+                   "FOR EACH ROW EXECUTE FUNCTION accounts.mas_blob_refcount()")
+
+
+def downgrade() -> None:
+    for table in REFERENCING_TABLES:
+        op.execute(f"DROP TRIGGER {table}_mas_blob_refcount ON accounts.{table}")
+        op.add_column(table, sa.Column('mas', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+                      schema='accounts')
+        op.execute(f"UPDATE accounts.{table} t SET mas = b.mas FROM accounts.mas_blobs b "
+                   "WHERE b.mas_hash = t.blob_hash")
+    op.execute("DROP FUNCTION accounts.mas_blob_refcount()")
+
+    op.drop_constraint('design_revisions_blob_or_delta', 'design_revisions', type_='check', schema='accounts')
+    op.create_check_constraint('design_revisions_mas_or_delta', 'design_revisions',
+                               '(mas IS NULL) <> (mas_delta IS NULL)', schema='accounts')
+    for table in REFERENCING_TABLES:
+        op.drop_constraint(f'{table}_blob_hash_fkey', table, type_='foreignkey', schema='accounts')
+        op.drop_column(table, 'blob_hash', schema='accounts')
+    op.drop_table('mas_blobs', schema='accounts')
@@ -0,0 +1,48 @@
+"""telemetry.events_staging for the COPY loader
+
+Revision ID: 0007_telemetry_staging
+Revises: 0006_mas_blobs
+Create Date: 2026-10-17 21:04:37.512088
+
+Hand-written: autogenerate never looks at the telemetry schema (see env.py).
+TelemetryTable.load_many COPYs each batch into this table and merges it into
+sessions, designs and events from there. UNLOGGED: rows live for one
+transaction, so WAL-logging them buys nothing. batch_id keeps concurrent
+loaders (one per uvicorn worker) apart.
+
+Earlier builds created the table on first use, hence IF NOT EXISTS.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '0007_telemetry_staging'
+down_revision: Union[str, None] = '0006_mas_blobs'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE UNLOGGED TABLE IF NOT EXISTS telemetry.events_staging (
+            batch_id      UUID NOT NULL,
+            ord           INTEGER NOT NULL,
+            session_id    TEXT NOT NULL,
+            environment   TEXT,
+            app_version   TEXT,
+            event_type    TEXT,
+            source        TEXT,
+            stage         TEXT,
+            mas_hash      TEXT,
+            topology      TEXT,
+            mas_version   TEXT,
+            mas_data      JSONB,
+            result_count  INTEGER,
+            error_message TEXT
+        )
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS telemetry.events_staging")
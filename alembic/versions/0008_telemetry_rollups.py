@@ -0,0 +1,56 @@
+"""telemetry rollup tables and their watermark
+
+Revision ID: 0008_telemetry_rollups
+Revises: 0007_telemetry_staging
+Create Date: 2026-10-17 21:26:03.174410
+
+Hand-written: autogenerate never looks at the telemetry schema (see env.py).
+The hourly and daily rollups maintained by app/backend/telemetry_jobs.py,
+and the event_id watermark recording how far they got. They bucket by
+events.created_at, which 0002 added.
+
+Earlier builds created these tables on first use, hence IF NOT EXISTS.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '0008_telemetry_rollups'
+down_revision: Union[str, None] = '0007_telemetry_staging'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+GRANULARITIES = ('hourly', 'daily')
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS telemetry.rollup_watermarks (
+            name          TEXT PRIMARY KEY,
+            last_event_id BIGINT NOT NULL,
+            updated_at    TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """)
+    # Missing dimensions roll up under '' (primary key columns cannot be NULL).
+    for granularity in GRANULARITIES:
+        op.execute(f"""
+            CREATE TABLE IF NOT EXISTS telemetry.events_{granularity} (
+                bucket      TIMESTAMPTZ NOT NULL,
+                event_type  TEXT NOT NULL,
+                source      TEXT NOT NULL,
+                stage       TEXT NOT NULL,
+                topology    TEXT NOT NULL,
+                environment TEXT NOT NULL,
+                app_version TEXT NOT NULL,
+                events      BIGINT NOT NULL,
+                errors      BIGINT NOT NULL,
+                PRIMARY KEY (bucket, event_type, source, stage, topology, environment, app_version)
+            )
+        """)
+
+
+def downgrade() -> None:
+    for granularity in GRANULARITIES:
+        op.execute(f"DROP TABLE IF EXISTS telemetry.events_{granularity}")
+    op.execute("DROP TABLE IF EXISTS telemetry.rollup_watermarks")
@@ -1,22 +1,28 @@
 from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
 from app.backend.models import BugReportsTable, TelemetryTable
+from app.backend.canonical import canonical_json_and_hash
+from app.backend import telemetry_jobs
 from app.backend.models import BugReport
 from app.backend.mas_models import CoreShape
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import Response
+from typing import Optional
+import asyncio
+import datetime
+import hmac
 import os
-import kombu
-import celery
+import re
 import PyOpenMagnetics
-from OpenMagneticsVirtualBuilder.builder import Builder as ShapeBuilder  # noqa: E402
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), 'app/backend')))
-from plotter import purge_queue
-from plotter import task_generate_core_3d_model
-from plotter import task_generate_core_technical_drawing, task_generate_gapping_technical_drawing
-import ast
+from jobs import cached_plot, check_result_backend, compute
+from jobs import router as jobs_router
+import plot_cache
+import telemetry_buffer
 import httpx
 import base64
+import hashlib
 import shutil
 import subprocess
 import tempfile
@@ -30,12 +36,11 @@ from pylatex.utils import NoEscape
 os.environ.setdefault("openin_any", "p")
 os.environ.setdefault("openout_any", "p")
 
-temp_folder = "/opt/openmagnetics/temp"
 high_performance_backend_url = "http://86.127.248.99:8001"
-use_celery = ast.literal_eval(os.getenv('USE_CELERY', "True"))
 use_db = "OM_DB_ADDRESS" in os.environ
 
 
+from app.backend.accounts import security
 from app.backend.accounts.routers import auth_router, designs_router, inventory_router, me_router, orgs_router, shares_router
 
 app = FastAPI()
@@ -60,6 +65,7 @@ app.include_router(inventory_router)
 app.include_router(me_router)
 app.include_router(orgs_router)
 app.include_router(shares_router)
+app.include_router(jobs_router)
 
 origins = [
     "https://openmagnetics.com",
@@ -83,6 +89,30 @@ def read_root():
     return {"Hello": "World"}
 
 
+@app.on_event("startup")
+def open_catalog_pack():
+    # Opened here so a missing or broken pack shows up in the startup log,
+    # not as a silent miss on the first catalog request.
+    pack = plot_cache.load_pack()
+    if pack is not None:
+        print(f"Catalog plot pack: {pack}")
+
+
+@app.on_event("startup")
+def check_job_results():
+    check_result_backend()
+
+
+@app.get("/plot_cache/stats", include_in_schema=False)
+def plot_cache_stats():
+    return plot_cache.stats()
+
+
+@app.get("/accounts/password_pool/stats", include_in_schema=False)
+def password_pool_stats():
+    return security.password_pool_stats()
+
+
 @app.post("/report_bug", include_in_schema=False)
 def report_bug(data: BugReport):
     data = data.dict()
@@ -92,63 +122,67 @@ def report_bug(data: BugReport):
     return {"status": "reported", "bug_report_id": bug_report_id}
 
 
+# Shape builds run on the Celery workers like every other plot; this only
+# caps how many requests may wait on them at once, so a burst of STL requests
+# queues here instead of piling onto the workers and the threadpool.
+shape_slots = asyncio.Semaphore(int(os.getenv("OM_SHAPE_MAX_CONCURRENCY", 4)))
+
+
+async def compute_shape(request: Request, coreShape: CoreShape, kind: str, extension: str):
+    data = coreShape.dict()
+    cached = await run_in_threadpool(cached_plot, kind, data)
+    if cached is not None:
+        return binary_response(request, cached.body, cached.content_type)
+    async with shape_slots:
+        model_data = await compute(kind, data)
+    if model_data is None:
+        raise HTTPException(status_code=418, detail="Wrong dimensions")
+    return binary_response(request, base64.b64decode(model_data), plot_cache.CONTENT_TYPES[extension])
+
+
 @app.post("/core_compute_shape_stl", include_in_schema=False)
 @app.post("/core_compute_shape", include_in_schema=False)
-def core_compute_shape(coreShape: CoreShape):
-    coreShape = coreShape.dict()
-    core_builder = ShapeBuilder("FreeCAD").factory(coreShape)
-    core_builder.set_output_path(temp_folder)
-    step_path, stl_path = core_builder.get_piece(coreShape)
-    if step_path is None:
-        purge_queue()
-        raise HTTPException(status_code=418, detail="Wrong dimensions")
-    else:
-        return FileResponse(stl_path)
+async def core_compute_shape(coreShape: CoreShape, request: Request):
+    return await compute_shape(request, coreShape, "core_shape", "stl")
 
 
 @app.post("/core_compute_shape_stp", include_in_schema=False)
-def core_compute_shape_stp(coreShape: CoreShape):
-    coreShape = coreShape.dict()
-    core_builder = ShapeBuilder("FreeCAD").factory(coreShape)
-    core_builder.set_output_path(temp_folder)
-    step_path, stl_path = core_builder.get_piece(coreShape)
-    if step_path is None:
-        purge_queue()
-        raise HTTPException(status_code=418, detail="Wrong dimensions")
-    else:
-        return FileResponse(step_path)
+async def core_compute_shape_stp(coreShape: CoreShape, request: Request):
+    return await compute_shape(request, coreShape, "core_shape_stp", "step")
+
+
+def wants_binary(request: Request):
+    # The 3D endpoints historically answer with a base64 JSON string; clients
+    # that ask for the model itself get raw bytes (about 25% smaller).
+    accept = request.headers.get("accept", "")
+    return "application/octet-stream" in accept or "model/" in accept
+
+
+def binary_response(request: Request, body: bytes, media_type: str):
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type=media_type, headers={"ETag": etag})
+
+
+def model_response(request: Request, body: bytes, media_type: str):
+    if wants_binary(request):
+        return binary_response(request, body, media_type)
+    return base64.b64encode(body).decode('utf-8')
 
 
 @app.post("/core_compute_core_3d_model_stl", include_in_schema=False)
 @app.post("/core_compute_core_3d_model", include_in_schema=False)
 async def core_compute_core_3d_model(request: Request):
     core = await request.json()
-    number_retries = 5
-    stl_data = None
-
-    if not use_celery:
-        print("not use_celery")
-        stl_data = task_generate_core_3d_model(core, temp_folder)
-    else:
-        try:
-            for retry in range(number_retries):
-                result = task_generate_core_3d_model.delay(core, temp_folder)
-                try:
-                    stl_data = result.get(timeout=10)
-                except celery.exceptions.TimeoutError:
-                    continue
-                except ConnectionResetError:
-                    continue
-                if stl_data is not None:
-                    break
-                print("Retrying task_generate_core_3d_model")
-            if stl_data is None:
-                purge_queue()
-        except kombu.exceptions.OperationalError:
-            stl_data = task_generate_core_3d_model(core, temp_folder)
-
+    cached = await run_in_threadpool(cached_plot, "core_3d_model", core)
+    if cached is not None:
+        return model_response(request, cached.body, cached.content_type)
+    stl_data = await compute("core_3d_model", core)
     if stl_data is None:
         raise HTTPException(status_code=418, detail="Wrong dimensions")
+    elif wants_binary(request):
+        return binary_response(request, base64.b64decode(stl_data), plot_cache.CONTENT_TYPES["stl"])
     else:
         return stl_data
 
@@ -156,31 +190,14 @@ async def core_compute_core_3d_model(request: Request):
 @app.post("/core_compute_core_3d_model_stp", include_in_schema=False)
 async def core_compute_core_3d_model_stp(request: Request):
     core = await request.json()
-    number_retries = 5
-    stp_data = None
-
-    if not use_celery:
-        stp_data = task_generate_core_3d_model(core, temp_folder, False)
-    else:
-        try:
-            for retry in range(number_retries):
-                result = task_generate_core_3d_model.delay(core, temp_folder, False)
-                try:
-                    stp_data = result.get(timeout=10)
-                except celery.exceptions.TimeoutError:
-                    continue
-                except ConnectionResetError:
-                    continue
-                if stp_data is not None:
-                    break
-                print("Retrying task_generate_core_3d_model")
-            if stp_data is None:
-                purge_queue()
-        except kombu.exceptions.OperationalError:
-            stp_data = task_generate_core_3d_model(core, temp_folder, False)
-
+    cached = await run_in_threadpool(cached_plot, "core_3d_model_stp", core)
+    if cached is not None:
+        return model_response(request, cached.body, cached.content_type)
+    stp_data = await compute("core_3d_model_stp", core)
     if stp_data is None:
         raise HTTPException(status_code=418, detail="Wrong dimensions")
+    elif wants_binary(request):
+        return binary_response(request, base64.b64decode(stp_data), plot_cache.CONTENT_TYPES["step"])
     else:
         return stp_data
 
@@ -188,29 +205,10 @@ async def core_compute_core_3d_model_stp(request: Request):
 @app.post("/core_compute_technical_drawing", include_in_schema=False)
 async def core_compute_technical_drawing(request: Request):
     data = await request.json()
-    number_retries = 5
-    views = None
-
-    if not use_celery:
-        views = task_generate_core_technical_drawing(data, temp_folder)
-    else:
-        try:
-            for retry in range(number_retries):
-                result = task_generate_core_technical_drawing.delay(data, temp_folder)
-                try:
-                    views = result.get(timeout=10)
-                except celery.exceptions.TimeoutError:
-                    continue
-                except ConnectionResetError:
-                    continue
-                if views is not None:
-                    break
-                print("Retrying task_generate_core_technical_drawing")
-            if views is None:
-                purge_queue()
-        except kombu.exceptions.OperationalError:
-            views = task_generate_core_technical_drawing(data, temp_folder)
-
+    cached = await run_in_threadpool(cached_plot, "core_technical_drawing", data)
+    if cached is not None:
+        return Response(content=cached.body, media_type=cached.content_type)
+    views = await compute("core_technical_drawing", data)
     if views is None:
         raise HTTPException(status_code=418, detail="Wrong dimensions")
     else:
@@ -220,56 +218,90 @@ async def core_compute_technical_drawing(request: Request):
 @app.post("/core_compute_gapping_technical_drawing", include_in_schema=False)
 async def core_compute_gapping_technical_drawing(request: Request):
     data = await request.json()
-    number_retries = 5
-    views = None
-
-    if not use_celery:
-        views = task_generate_core_technical_drawing(data, temp_folder)
-    else:
-        try:
-            for retry in range(number_retries):
-                result = task_generate_gapping_technical_drawing.delay(data, temp_folder)
-                try:
-                    views = result.get(timeout=10)
-                except celery.exceptions.TimeoutError:
-                    continue
-                except ConnectionResetError:
-                    continue
-                if views is not None:
-                    break
-                print("Retrying task_generate_gapping_technical_drawing")
-            if views is None:
-                purge_queue()
-        except kombu.exceptions.OperationalError:
-            views = task_generate_core_technical_drawing(data, temp_folder)
-
+    cached = await run_in_threadpool(cached_plot, "gapping_technical_drawing", data)
+    if cached is not None:
+        return Response(content=cached.body, media_type=cached.content_type)
+    views = await compute("gapping_technical_drawing", data)
     if views is None:
         raise HTTPException(status_code=418, detail="Wrong dimensions")
     else:
         return views
 
 
-def insert_telemetry_background(data, environment):
-    table = TelemetryTable()
-    table.record(
-        session_id=data.get('session_id', 'unknown'),
-        event_type=data.get('event_type', ''),
-        source=data.get('source', ''),
-        stage=data.get('stage'),
-        environment=environment,
-        app_version=data.get('app_version'),
-        mas_data=data.get('mas_data'),
-        topology=data.get('topology'),
-        mas_version=data.get('mas_version'),
-        result_count=data.get('result_count'),
-        error_message=data.get('error_message'),
-    )
+known_designs = telemetry_buffer.KnownHashes(int(os.getenv("OM_TELEMETRY_KNOWN_HASHES",
+                                                             telemetry_buffer.DEFAULT_KNOWN_HASHES)))
+
+
+def remember_designs(batch):
+    # Runs once the batch has committed: its documents are stored now.
+    for event in batch:
+        if event.get("mas_data") is not None and event.get("mas_hash") is not None:
+            known_designs.add(event["mas_hash"])
+
+
+telemetry_events = telemetry_buffer.from_env(TelemetryTable().load_many, on_written=remember_designs)
+
+
+telemetry_rollups = None
+
+
+@app.on_event("startup")
+def start_telemetry_rollups():
+    global telemetry_rollups
+    if use_db:
+        telemetry_rollups = telemetry_jobs.start_rollups()
+
+
+@app.on_event("shutdown")
+def flush_telemetry():
+    telemetry_events.close()
+    if telemetry_rollups is not None:
+        telemetry_rollups.stop()
+
+
+TELEMETRY_TEXT_FIELDS = ("session_id", "event_type", "source", "stage", "topology", "mas_version",
+                         "app_version", "error_message")
+TELEMETRY_TEXT_DEFAULTS = {"session_id": "unknown", "event_type": "", "source": ""}
+INT4_MIN, INT4_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+def telemetry_event(data, environment):
+    """The event to queue for a POST /telemetry body. Fields of the wrong type
+    are a 422 here, so they never reach (and fail) a batch shared with other
+    clients; NUL bytes, which Postgres text cannot hold, are dropped."""
+    event = {"environment": environment, "mas_data": data.get('mas_data')}
+    for field in TELEMETRY_TEXT_FIELDS:
+        value = data.get(field, TELEMETRY_TEXT_DEFAULTS.get(field))
+        if value is not None and not isinstance(value, str):
+            raise HTTPException(status_code=422, detail=f"{field} must be a string")
+        event[field] = value.replace("\x00", "") if value is not None else None
+    result_count = data.get('result_count')
+    if result_count is not None and (isinstance(result_count, bool) or not isinstance(result_count, int)
+                                     or not INT4_MIN <= result_count <= INT4_MAX):
+        raise HTTPException(status_code=422, detail="result_count must be an integer")
+    event["result_count"] = result_count
+    return event
+
+
+@app.get("/telemetry/stats", include_in_schema=False)
+def telemetry_stats():
+    return {"buffer": telemetry_events.stats(), "known_designs": known_designs.stats()}
+
+
+MAS_HASH = re.compile(r"[0-9a-f]{64}")
 
 
 @app.post("/telemetry", include_in_schema=False)
-async def telemetry(request: Request, background_tasks: BackgroundTasks):
+async def telemetry(request: Request):
+    """Records one event. A MAS design may be sent inline (mas_data) or by
+    reference (mas_hash, the canonical_hash of the document): clients that
+    send mas_hash get {"mas_needed": bool} back, and on true must send the
+    event again with mas_data. The event is not recorded in that case, nor
+    when the buffer is full (503)."""
     if use_db:
         data = await request.json()
+        if not isinstance(data, dict):
+            raise HTTPException(status_code=422, detail="Telemetry event must be a JSON object")
         # The frontend build declares its environment (VITE_ENV). Trust it when
         # valid; otherwise fall back to the backend's own OM_ENV. Defaults to
         # production only as a last resort so untagged rows never masquerade as
@@ -277,12 +309,49 @@ async def telemetry(request: Request, background_tasks: BackgroundTasks):
         env = data.get('environment')
         if env not in ('development', 'production'):
             env = "development" if os.getenv("OM_ENV", "production") == "development" else "production"
-        background_tasks.add_task(insert_telemetry_background, data, env)
+        event = telemetry_event(data, env)
+        if event["mas_data"] is not None:
+            # Never trust a client hash for a document we store: hash it here.
+            event["mas_document"], event["mas_hash"] = await run_in_threadpool(canonical_json_and_hash,
+                                                                               event["mas_data"])
+            if "\\u0000" in event["mas_document"]:
+                raise HTTPException(status_code=422, detail="mas_data must not contain NUL characters")
+        elif data.get('mas_hash') is not None:
+            # Hash handshake: the client names its design first and uploads
+            # the document only when we do not have it yet.
+            mas_hash = str(data['mas_hash'])
+            if not MAS_HASH.fullmatch(mas_hash):
+                raise HTTPException(status_code=422, detail="mas_hash must be a lowercase hex sha256")
+            if mas_hash not in known_designs:
+                if not await run_in_threadpool(TelemetryTable().design_exists, mas_hash):
+                    return {"mas_needed": True}
+                known_designs.add(mas_hash)
+            event["mas_hash"] = mas_hash
+        if not telemetry_events.put(event):
+            raise HTTPException(status_code=503, detail="Telemetry queue full, retry shortly",
+                                headers={"Retry-After": "1"})
+        if 'mas_hash' in data:
+            return {"mas_needed": False}
         return "Inserting in the background"
     else:
         return "DB not available"
 
 
+@app.get("/telemetry/rollups/{granularity}", include_in_schema=False)
+def telemetry_rollups_read(granularity: str, request: Request, since: Optional[datetime.datetime] = None,
+                           until: Optional[datetime.datetime] = None, environment: Optional[str] = None):
+    """Hourly or daily event counts for dashboards. Readers present
+    OM_TELEMETRY_READ_TOKEN as a bearer token; without one configured the
+    endpoint stays closed."""
+    token = os.getenv("OM_TELEMETRY_READ_TOKEN")
+    offered = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    if not token or not hmac.compare_digest(offered.encode(), token.encode()):
+        raise HTTPException(status_code=403, detail="Telemetry read token required")
+    if granularity not in telemetry_jobs.GRANULARITIES:
+        raise HTTPException(status_code=404, detail=f"Unknown granularity {granularity!r}")
+    return telemetry_jobs.read_rollup(granularity, since, until, environment)
+
+
 @app.post("/load_external_core_materials", include_in_schema=False)
 async def load_external_core_materials(request: Request, background_tasks: BackgroundTasks):
     data = await request.json()
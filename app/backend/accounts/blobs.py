@@ -0,0 +1,72 @@
+"""Content-addressed storage of MAS documents.
+
+Every full MAS document of a design revision or private inventory part lives
+once in `accounts.mas_blobs`, keyed by the sha256 of its canonical JSON (the
+mas_hash the designs router already computes); the envelope rows reference it
+by blob_hash. Saving a document that is already stored, by anyone, writes only
+the envelope row.
+
+Triggers on the referencing tables keep mas_blobs.refcount exact within each
+transaction. Blobs whose count dropped to zero are removed by
+collect_garbage(), run periodically:
+
+    venv/bin/python -m app.backend.accounts.blobs
+
+A blob is only collected once it has been unreferenced and unused for
+GC_GRACE; store() refreshes last_used_at (and row-locks the blob) whenever it
+finds the document already stored, so a save racing the collector never
+references a deleted blob.
+
+Telemetry keeps its own dedup table (telemetry.designs, also keyed by the
+canonical hash): it lives in another schema with its own retention.
+"""
+import datetime
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session as OrmSession
+
+from ..canonical import canonical_hash
+from .models import MasBlob
+
+GC_GRACE = datetime.timedelta(days=1)
+GC_BATCH = 500
+# Refresh last_used_at at most this often per blob: a re-save inside the
+# window writes nothing to mas_blobs (the upsert still locks the row).
+TOUCH_INTERVAL = datetime.timedelta(hours=1)
+
+
+def store(db: OrmSession, document: dict, mas_hash: str | None = None) -> str:
+    """Make sure document is stored; returns its hash for blob_hash. Pass
+    mas_hash when the caller already computed it (canonical sha256)."""
+    mas_hash = mas_hash or canonical_hash(document)
+    statement = insert(MasBlob).values(mas_hash=mas_hash, mas=document)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[MasBlob.mas_hash],
+        set_={"last_used_at": func.now()},
+        where=MasBlob.last_used_at < func.now() - TOUCH_INTERVAL))
+    return mas_hash
+
+
+def collect_garbage(db: OrmSession, grace: datetime.timedelta = GC_GRACE) -> int:
+    """Delete unreferenced blobs older than grace, in small committed
+    batches. Returns how many were deleted."""
+    deleted = 0
+    while True:
+        count = db.execute(text(
+            "DELETE FROM accounts.mas_blobs WHERE mas_hash IN ("
+            " SELECT mas_hash FROM accounts.mas_blobs"
+            " WHERE refcount = 0 AND last_used_at < now() - :grace"
+            " LIMIT :batch FOR UPDATE SKIP LOCKED)"),
+            {"grace": grace, "batch": GC_BATCH}).rowcount
+        db.commit()
+        deleted += count
+        if count < GC_BATCH:
+            return deleted
+
+
+if __name__ == "__main__":
+    from .db import get_session_factory
+
+    with get_session_factory()() as session:
+        print(f"Deleted {collect_garbage(session)} unreferenced MAS blobs")
@@ -5,35 +5,52 @@ accounts feature uses one process-wide pooled engine. Credentials come from the
 same OM_DB_* environment variables the rest of the backend uses. If they are
 missing, the first use raises loudly — the accounts endpoints must never run
 against a half-configured database.
+
+Pool sizes are per process (so per uvicorn worker): OM_DB_POOL_SIZE and
+OM_DB_MAX_OVERFLOW, 5 and 5 by default.
+
+Handlers that never block can opt into the asyncio layer instead: `async def`
+endpoints depending on `get_async_db()` get an AsyncSession on an asyncpg
+engine, and wait for the database on the event loop rather than holding one
+of the threadpool's threads. The async engine has its own pool of the same
+size; its connections belong to the event loop that opened them, so there is
+one engine per loop (one per worker in production).
 """
+import asyncio
 import os
+import weakref
 
 import sqlalchemy
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 _engine = None
 _SessionLocal = None
+_async_engines = weakref.WeakKeyDictionary()  # event loop -> (AsyncEngine, async_sessionmaker)
+
 
+def _pool_options():
+    return {
+        "pool_size": int(os.getenv("OM_DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv("OM_DB_MAX_OVERFLOW", 5)),
+        "pool_pre_ping": True,
+        "pool_recycle": 1800,
+    }
 
-def _database_url():
+
+def _database_url(driver="psycopg2"):
     missing = [v for v in ("OM_DB_ADDRESS", "OM_DB_PORT", "OM_DB_NAME", "OM_DB_USER", "OM_DB_PASSWORD")
                if os.getenv(v) is None]
     if missing:
         raise RuntimeError(f"Accounts database is not configured: missing environment variables {missing}")
-    return (f"postgresql+psycopg2://{os.getenv('OM_DB_USER')}:{os.getenv('OM_DB_PASSWORD')}"
+    return (f"postgresql+{driver}://{os.getenv('OM_DB_USER')}:{os.getenv('OM_DB_PASSWORD')}"
             f"@{os.getenv('OM_DB_ADDRESS')}:{os.getenv('OM_DB_PORT')}/{os.getenv('OM_DB_NAME')}")
 
 
 def get_engine():
     global _engine
     if _engine is None:
-        _engine = sqlalchemy.create_engine(
-            _database_url(),
-            pool_size=5,
-            max_overflow=5,
-            pool_pre_ping=True,
-            pool_recycle=1800,
-        )
+        _engine = sqlalchemy.create_engine(_database_url(), **_pool_options())
     return _engine
 
 
@@ -51,3 +68,17 @@ def get_db():
         yield session
     finally:
         session.close()
+
+
+def get_async_session_factory():
+    loop = asyncio.get_running_loop()
+    if loop not in _async_engines:
+        engine = create_async_engine(_database_url("asyncpg"), **_pool_options())
+        _async_engines[loop] = (engine, async_sessionmaker(bind=engine, expire_on_commit=False))
+    return _async_engines[loop][1]
+
+
+async def get_async_db():
+    """FastAPI dependency for async handlers: one AsyncSession per request."""
+    async with get_async_session_factory()() as session:
+        yield session
@@ -0,0 +1,28 @@
+"""Strong ETags for the document endpoints.
+
+An ETag is derived from envelope columns that change whenever the response
+body does (design version and updated_at, the mas_hash of a revision), so it
+is computed before, and instead of, loading the MAS document: a matching
+If-None-Match gets an empty 304.
+"""
+import hashlib
+
+from fastapi import Response
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def not_modified(if_none_match: str | None, etag: str) -> bool:
+    """RFC 9110 If-None-Match: '*' or a list of (possibly weak) tags."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def not_modified_response(etag: str, cache_control: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
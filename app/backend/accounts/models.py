@@ -2,9 +2,10 @@
 
 Two account types: individual `users` and company `organizations` — every owned
 resource has exactly one of (owner_user_id, owner_org_id), enforced by CHECK
-constraints. MAS documents (designs, private parts) are stored verbatim in JSONB
-columns; all ownership/versioning metadata lives in envelope columns, never
-inside the MAS object (the MAS root schema is closed).
+constraints. MAS documents (designs, private parts) are stored verbatim in JSONB,
+once per distinct document, in `mas_blobs` (see blobs.py); all ownership/
+versioning metadata lives in envelope columns, never inside the MAS object (the
+MAS root schema is closed).
 
 Phase 1 exposes users/sessions/email_tokens/designs/design_revisions/
 user_settings through the API; the remaining tables are created now so later
@@ -17,7 +18,7 @@ from sqlalchemy import (
     Integer, Numeric, Text, text,
 )
 from sqlalchemy.dialects.postgresql import JSONB, UUID
-from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
 SCHEMA = "accounts"
@@ -106,6 +107,11 @@ class Design(Base):
         CheckConstraint("(owner_user_id IS NULL) <> (owner_org_id IS NULL)", name="designs_one_owner"),
         Index("designs_owner_user", "owner_user_id"),
         Index("designs_owner_org", "owner_org_id"),
+        # Keyset pagination of the listings (newest first).
+        Index("designs_owner_user_updated", "owner_user_id", "updated_at", "id",
+              postgresql_where=text("deleted_at IS NULL")),
+        Index("designs_owner_org_updated", "owner_org_id", "updated_at", "id",
+              postgresql_where=text("deleted_at IS NULL")),
         {"schema": SCHEMA},
     )
 
@@ -118,15 +124,36 @@ class Design(Base):
     created_at = Column(DateTime(timezone=True), nullable=False, server_default=text("now()"))
     updated_at = Column(DateTime(timezone=True), nullable=False, server_default=text("now()"))
     deleted_at = Column(DateTime(timezone=True))
+    # Denormalized from design_revisions, written in the same transaction as
+    # every new revision: listing and opening a design need no aggregate.
+    latest_revision = Column(Integer, nullable=False, server_default=text("1"))
+    revision_count = Column(Integer, nullable=False, server_default=text("1"))
+    schema_valid = Column(Boolean, nullable=False, server_default=text("false"))
+
+
+class MasBlob(Base):
+    """One MAS document, keyed by the sha256 of its canonical JSON. refcount
+    is maintained by triggers on the referencing tables (migration 0006)."""
+    __tablename__ = "mas_blobs"
+    __table_args__ = ({"schema": SCHEMA},)
+
+    mas_hash = Column(Text, primary_key=True)
+    mas = Column(JSONB, nullable=False)
+    refcount = Column(Integer, nullable=False, server_default=text("0"))
+    last_used_at = Column(DateTime(timezone=True), nullable=False, server_default=text("now()"))
 
 
 class DesignRevision(Base):
     __tablename__ = "design_revisions"
-    __table_args__ = ({"schema": SCHEMA},)
+    __table_args__ = (
+        CheckConstraint("(blob_hash IS NULL) <> (mas_delta IS NULL)", name="design_revisions_blob_or_delta"),
+        {"schema": SCHEMA},
+    )
 
     design_id = Column(UUID(as_uuid=True), ForeignKey(f"{SCHEMA}.designs.id", ondelete="CASCADE"), primary_key=True)
     revision = Column(Integer, primary_key=True)
-    mas = Column(JSONB, nullable=False)              # the MAS document, untouched
+    blob_hash = Column(Text, ForeignKey(f"{SCHEMA}.mas_blobs.mas_hash"))  # the MAS document (see revisions.py)
+    mas_delta = Column(JSONB(none_as_null=True))     # or: JSON Patch from the next revision to this one
     mas_hash = Column(Text, nullable=False)          # sha256 of canonical JSON (dedup no-op saves)
     mas_version = Column(Text, nullable=False)       # MAS spec version validated against
     engine_version = Column(Text)
@@ -134,6 +161,14 @@ class DesignRevision(Base):
     saved_by = Column(UUID(as_uuid=True), ForeignKey(f"{SCHEMA}.users.id", ondelete="SET NULL"))
     saved_at = Column(DateTime(timezone=True), nullable=False, server_default=text("now()"))
 
+    # Loaded when .mas is first read; readers of many rows joinedload it.
+    blob = relationship(MasBlob)
+
+    @property
+    def mas(self) -> dict | None:
+        """The stored full document; None for delta-encoded revisions."""
+        return self.blob.mas if self.blob is not None else None
+
 
 class InventoryPart(Base):
     __tablename__ = "inventory_parts"
@@ -156,7 +191,7 @@ class InventoryPart(Base):
     name = Column(Text, nullable=False)              # MAS name (WASM upsert key)
     source = Column(Text, nullable=False)
     catalog_ref = Column(Text)                       # public part name when source='catalog'
-    mas = Column(JSONB)                              # full MAS record when source='private'
+    blob_hash = Column(Text, ForeignKey(f"{SCHEMA}.mas_blobs.mas_hash"))  # full MAS record when source='private'
     mas_version = Column(Text)
     lifecycle = Column(Text, nullable=False, server_default=text("'approved'"))
     stock_qty = Column(Numeric)
@@ -167,6 +202,12 @@ class InventoryPart(Base):
     updated_at = Column(DateTime(timezone=True), nullable=False, server_default=text("now()"))
     deleted_at = Column(DateTime(timezone=True))
 
+    blob = relationship(MasBlob)
+
+    @property
+    def mas(self) -> dict | None:
+        return self.blob.mas if self.blob is not None else None
+
 
 class ShareLink(Base):
     __tablename__ = "share_links"
@@ -6,16 +6,73 @@ Roles (proposal v2 §4): owner > admin > librarian > member > viewer.
 - librarian: approve/deprecate inventory parts.
 - member: create/edit designs, author draft parts.
 - viewer: read-only.
+
+Permission checks go through roles_of(): one query for every live org role of
+a user, memoized on the DB session for the rest of the request and cached per
+process for OM_ROLE_CACHE_TTL seconds. The organizations router calls
+forget_roles() whenever it changes who holds which role; other uvicorn workers
+may act on a cached role until its TTL runs out, which is why the TTL is short.
+The *_async variants do the same on an AsyncSession, sharing both caches.
 """
+import collections
+import os
+import threading
+import time
 import uuid
 
 from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session as OrmSession
 
 from .models import Membership, Organization
 
 ROLE_RANK = {"viewer": 0, "member": 1, "librarian": 2, "admin": 3, "owner": 4}
 
+ROLE_CACHE_TTL = float(os.getenv("OM_ROLE_CACHE_TTL", 30))
+ROLE_CACHE_MAX_ENTRIES = 10000
+
+
+class _RoleCache:
+    """user_id -> ({org_id: role}, cached until), LRU-bounded."""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if time.monotonic() >= entry[1]:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[0]
+
+    def put(self, user_id, roles: dict):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (roles, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_role_cache = _RoleCache(ROLE_CACHE_TTL, ROLE_CACHE_MAX_ENTRIES)
+
 
 def parse_uuid(value: str, what: str) -> uuid.UUID:
     try:
@@ -31,6 +88,66 @@ def get_org(db: OrmSession, org_id) -> Organization:
     return org
 
 
+def _roles_query(user_id):
+    return (select(Membership.org_id, Membership.role)
+            .join(Organization, Organization.id == Membership.org_id)
+            .where(Membership.user_id == user_id,
+                   Membership.accepted_at.isnot(None),
+                   Membership.revoked_at.is_(None),
+                   Organization.deleted_at.is_(None)))
+
+
+def _known_roles(db, user_id) -> dict | None:
+    roles = db.info.setdefault("org_roles", {}).get(user_id)
+    if roles is None:
+        roles = _role_cache.get(user_id)
+        if roles is not None:
+            db.info["org_roles"][user_id] = roles
+    return roles
+
+
+def _remember_roles(db, user_id, rows) -> dict:
+    roles = {org_id: role for org_id, role in rows}
+    _role_cache.put(user_id, roles)
+    db.info.setdefault("org_roles", {})[user_id] = roles
+    return roles
+
+
+def roles_of(db: OrmSession, user_id) -> dict:
+    """{org_id: role} of every accepted, unrevoked membership of user_id in a
+    live organization. Treat the result as read-only: it is shared."""
+    roles = _known_roles(db, user_id)
+    if roles is None:
+        roles = _remember_roles(db, user_id, db.execute(_roles_query(user_id)).all())
+    return roles
+
+
+async def roles_of_async(db: AsyncSession, user_id) -> dict:
+    roles = _known_roles(db, user_id)
+    if roles is None:
+        roles = _remember_roles(db, user_id, (await db.execute(_roles_query(user_id))).all())
+    return roles
+
+
+def role_in(db: OrmSession, user_id, org_id) -> str | None:
+    return roles_of(db, user_id).get(org_id)
+
+
+async def role_in_async(db: AsyncSession, user_id, org_id) -> str | None:
+    return (await roles_of_async(db, user_id)).get(org_id)
+
+
+def forget_roles(db: OrmSession, user_id=None):
+    """Drop the memoized and cached roles of user_id (of everyone when None):
+    call after any change to memberships or organizations."""
+    if user_id is None:
+        db.info.pop("org_roles", None)
+        _role_cache.clear()
+    else:
+        db.info.get("org_roles", {}).pop(user_id, None)
+        _role_cache.forget(user_id)
+
+
 def membership_of(db: OrmSession, user_id, org_id) -> Membership | None:
     return (db.query(Membership)
             .filter(Membership.org_id == org_id,
@@ -40,13 +157,22 @@ def membership_of(db: OrmSession, user_id, org_id) -> Membership | None:
             .one_or_none())
 
 
-def require_role(db: OrmSession, user_id, org_id, minimum: str) -> Membership:
-    membership = membership_of(db, user_id, org_id)
-    if membership is None:
+def _checked_role(role: str | None, minimum: str) -> str:
+    if role is None:
         raise HTTPException(status_code=404, detail="Organization not found")
-    if ROLE_RANK[membership.role] < ROLE_RANK[minimum]:
+    if ROLE_RANK[role] < ROLE_RANK[minimum]:
         raise HTTPException(status_code=403, detail=f"This action needs the '{minimum}' role or higher")
-    return membership
+    return role
+
+
+def require_role(db: OrmSession, user_id, org_id, minimum: str) -> str:
+    """The user's role in a live org; 404 for non-members (and deleted orgs),
+    403 below minimum."""
+    return _checked_role(role_in(db, user_id, org_id), minimum)
+
+
+async def require_role_async(db: AsyncSession, user_id, org_id, minimum: str) -> str:
+    return _checked_role(await role_in_async(db, user_id, org_id), minimum)
 
 
 def resolve_owner(db: OrmSession, user, org_param: str | None, minimum: str = "member"):
@@ -56,6 +182,11 @@ def resolve_owner(db: OrmSession, user, org_param: str | None, minimum: str = "m
     if org_param is None or org_param == "":
         return user.id, None, None
     org_id = parse_uuid(org_param, "Organization")
-    get_org(db, org_id)
-    membership = require_role(db, user.id, org_id, minimum)
-    return None, org_id, membership.role
+    return None, org_id, require_role(db, user.id, org_id, minimum)
+
+
+async def resolve_owner_async(db: AsyncSession, user, org_param: str | None, minimum: str = "member"):
+    if org_param is None or org_param == "":
+        return user.id, None, None
+    org_id = parse_uuid(org_param, "Organization")
+    return None, org_id, await require_role_async(db, user.id, org_id, minimum)
@@ -0,0 +1,58 @@
+"""Keyset pagination and field projection for the list endpoints.
+
+A cursor is the sort key of the last row of a page, JSON-encoded and
+base64url'd; clients treat it as opaque and pass it back as ?cursor= to get
+the next page. Unlike OFFSET, the next page costs one index range scan however
+deep the client pages, and rows inserted meanwhile never shift it.
+"""
+import base64
+import binascii
+import json
+
+from fastapi import HTTPException
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def page_size(limit: int | None) -> int:
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=422, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+
+def encode_cursor(key: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str | None, length: int) -> list | None:
+    """The sort key of a cursor (None for the first page); 422 when it is not
+    one this endpoint issued."""
+    if cursor is None or cursor == "":
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (UnicodeEncodeError, binascii.Error, ValueError):
+        key = None
+    if not isinstance(key, list) or len(key) != length or not all(isinstance(part, str) for part in key):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+    return key
+
+
+def parse_fields(fields: str | None, allowed: tuple, default: tuple) -> tuple:
+    """The comma-separated ?fields= selection, or default. Unknown names are
+    rejected so that typos do not silently return less."""
+    if fields is None or fields.strip() == "":
+        return default
+    selected = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in selected if name not in allowed]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown fields {unknown}; choose from {list(allowed)}")
+    return selected
+
+
+def project(payload: dict, fields: tuple) -> dict:
+    """payload restricted to fields; id is always kept."""
+    return {key: value for key, value in payload.items() if key == "id" or key in fields}
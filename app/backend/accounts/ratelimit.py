@@ -1,50 +1,207 @@
-"""Minimal in-process rate limiting for the sensitive auth endpoints.
+"""Rate limiting for the sensitive auth endpoints.
+
+Sliding-window counters per (client IP, route tag): each key keeps the count
+of the current fixed window and of the previous one, and a request is allowed
+while previous * (unelapsed share of the window) + current stays under the
+limit. That is O(1) state per key, without the burst a fixed window allows at
+its boundary. Rejected requests are not counted.
 
-Fixed-window counters per (client IP, route tag), no external dependencies.
 The API is served by uvicorn directly (no nginx in front), so request.client
-is the real peer address. Limits reset on process restart — acceptable for
-abuse damping (this is not billing-grade accounting).
+is the real peer address. Where the counters live is pluggable, chosen by
+OM_RATELIMIT_BACKEND:
+
+- `memory` (default): a dict in this process. Keys expire individually
+  through a one-second time wheel, so the map never needs a wholesale reset.
+  With several uvicorn workers each enforces its own share.
+- `sqlite:////path/to/ratelimit.db`: one SQLite file shared by every worker
+  on the host, so the limits hold across workers. Expired rows are swept a
+  few at a time as requests come in.
+
+Limits reset on restart with the memory backend — acceptable for abuse
+damping (this is not billing-grade accounting).
 """
+import collections
+import math
+import os
+import sqlite3
 import threading
 import time
 
 from fastapi import HTTPException, Request
 
-_lock = threading.Lock()
-_windows = {}  # (ip, tag) -> [window_start, count]
+
+def _sliding_estimate(previous: int, current: int, elapsed: float, per_seconds: int) -> float:
+    return previous * (1 - elapsed / per_seconds) + current
+
+
+def _retry_after(previous: int, current: int, elapsed: float, per_seconds: int, max_requests: int) -> int:
+    """Seconds until the estimate drops below max_requests again."""
+    remaining = per_seconds - elapsed
+    if current >= max_requests or previous == 0:
+        # Only the next window helps (and its previous is then this one).
+        return int(remaining) + 1
+    excess = _sliding_estimate(previous, current, elapsed, per_seconds) - max_requests + 1
+    return min(int(remaining), math.ceil(excess * per_seconds / previous)) + 1
+
+
+class MemoryBackend:
+    """Per-process counters; keys expire through a time wheel of one-second
+    slots, each holding the keys due to expire in that second."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # key -> [window_index, current, previous, expires_at]
+        self._wheel = collections.defaultdict(set)  # whole second -> keys
+        self._cursor = None  # first second not yet expired
+
+    @staticmethod
+    def now() -> float:
+        return time.monotonic()
+
+    def _expire(self, now: float):
+        second = int(now)
+        if self._cursor is None:
+            self._cursor = second
+        if second <= self._cursor:
+            return
+        if second - self._cursor <= len(self._wheel):
+            due = [slot for slot in range(self._cursor, second) if slot in self._wheel]
+        else:  # idle for long: walking the occupied slots is cheaper
+            due = [slot for slot in self._wheel if slot < second]
+        for slot in due:
+            for key in self._wheel.pop(slot):
+                counter = self._counters.get(key)
+                if counter is not None and counter[3] <= now:
+                    del self._counters[key]
+        self._cursor = second
+
+    def hit(self, key, max_requests: int, per_seconds: int, now: float | None = None):
+        """(allowed, retry_after seconds)."""
+        now = self.now() if now is None else now
+        window_index, elapsed = divmod(now, per_seconds)
+        with self._lock:
+            self._expire(now)
+            counter = self._counters.get(key)
+            if counter is None or counter[0] < window_index - 1:
+                counter = [window_index, 0, 0, 0]
+            elif counter[0] == window_index - 1:
+                counter = [window_index, 0, counter[1], counter[3]]
+            if _sliding_estimate(counter[2], counter[1], elapsed, per_seconds) >= max_requests:
+                return False, _retry_after(counter[2], counter[1], elapsed, per_seconds, max_requests)
+            counter[1] += 1
+            # Forgotten once it can no longer count as the previous window.
+            expires_at = (window_index + 2) * per_seconds
+            if counter[3] != expires_at:
+                counter[3] = expires_at
+                self._wheel[int(expires_at)].add(key)
+            self._counters[key] = counter
+            return True, 0
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._wheel.clear()
+
+    def __len__(self):
+        return len(self._counters)
+
+
+class SQLiteBackend:
+    """Counters in a SQLite file shared by the processes of one host. Wall
+    clock time, so every process agrees on the windows."""
+
+    SWEEP_EVERY = 100
+    SWEEP_ROWS = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._hits = 0
+
+    @staticmethod
+    def now() -> float:
+        return time.time()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS ratelimit ("
+                               "key TEXT PRIMARY KEY, window_index INTEGER NOT NULL, "
+                               "current INTEGER NOT NULL, previous INTEGER NOT NULL, expires_at REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS ratelimit_expires_at ON ratelimit (expires_at)")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def hit(self, key, max_requests: int, per_seconds: int, now: float | None = None):
+        now = self.now() if now is None else now
+        window_index, elapsed = divmod(now, per_seconds)
+        window_index = int(window_index)
+        key = "|".join(str(part) for part in key) if isinstance(key, tuple) else str(key)
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT window_index, current, previous FROM ratelimit WHERE key = ?",
+                                     (key,)).fetchone()
+            current = previous = 0
+            if row is not None and row[0] == window_index:
+                current, previous = row[1], row[2]
+            elif row is not None and row[0] == window_index - 1:
+                previous = row[1]
+            if _sliding_estimate(previous, current, elapsed, per_seconds) >= max_requests:
+                connection.execute("COMMIT")
+                return False, _retry_after(previous, current, elapsed, per_seconds, max_requests)
+            connection.execute("INSERT INTO ratelimit (key, window_index, current, previous, expires_at) "
+                               "VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                               "window_index = excluded.window_index, current = excluded.current, "
+                               "previous = excluded.previous, expires_at = excluded.expires_at",
+                               (key, window_index, current + 1, previous, (window_index + 2) * per_seconds))
+            self._hits += 1
+            if self._hits % self.SWEEP_EVERY == 0:
+                connection.execute("DELETE FROM ratelimit WHERE key IN (SELECT key FROM ratelimit "
+                                   "WHERE expires_at <= ? LIMIT ?)", (now, self.SWEEP_ROWS))
+            connection.execute("COMMIT")
+            return True, 0
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def reset(self):
+        self._connection().execute("DELETE FROM ratelimit")
+
+
+def _backend_from_env():
+    setting = os.getenv("OM_RATELIMIT_BACKEND", "memory")
+    if setting.startswith("sqlite:///"):
+        return SQLiteBackend(setting[len("sqlite:///"):])
+    if setting != "memory":
+        raise RuntimeError(f"Unknown OM_RATELIMIT_BACKEND {setting!r}")
+    return MemoryBackend()
+
+
+_backend = _backend_from_env()
 
 
 def reset():
     """Drop all counters. For tests (the suite registers many accounts from
     one 'IP' in seconds); never called in production code paths."""
-    with _lock:
-        _windows.clear()
+    _backend.reset()
 
 
 def limit(tag: str, max_requests: int, per_seconds: int):
     """FastAPI dependency factory: 429 when the caller exceeds
-    max_requests within per_seconds."""
+    max_requests within a sliding per_seconds window."""
 
     def dependency(request: Request):
         ip = request.client.host if request.client else "unknown"
-        now = time.monotonic()
-        key = (ip, tag)
-        with _lock:
-            window = _windows.get(key)
-            if window is None or now - window[0] >= per_seconds:
-                _windows[key] = [now, 1]
-                # Opportunistic cleanup so the map cannot grow unbounded.
-                if len(_windows) > 50000:
-                    _windows.clear()
-                    _windows[key] = [now, 1]
-                return
-            window[1] += 1
-            if window[1] > max_requests:
-                retry_after = int(per_seconds - (now - window[0])) + 1
-                raise HTTPException(
-                    status_code=429,
-                    detail="Too many requests — try again shortly",
-                    headers={"Retry-After": str(retry_after)},
-                )
+        allowed, retry_after = _backend.hit((ip, tag), max_requests, per_seconds)
+        if not allowed:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests — try again shortly",
+                headers={"Retry-After": str(retry_after)},
+            )
 
     return dependency
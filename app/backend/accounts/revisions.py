@@ -0,0 +1,146 @@
+"""Delta-encoded storage of design revisions.
+
+Consecutive revisions of a design are near-identical MAS documents, so only
+some are stored in full (design_revisions.blob_hash, see blobs.py):
+- the latest revision, which is what opening a design reads;
+- every SNAPSHOT_EVERY-th revision, which bounds reconstruction chains.
+Every other revision stores, in mas_delta, an RFC 6902 JSON Patch that turns
+the NEXT revision into it. Saving a new revision writes it in full and turns
+the previous latest into such a reverse delta (unless it is a snapshot, or the
+delta would not be much smaller than the document).
+
+Because deltas point forward in time, nothing depends on the oldest revision:
+the rolling window of MAX_REVISIONS_PER_DESIGN drops it without rewriting any
+other row. Reading revision r applies at most SNAPSHOT_EVERY - 1 patches to
+the nearest full revision after it.
+
+Only the add/remove/replace operations are generated; apply_patch accepts the
+same subset.
+"""
+import copy
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
+
+from ..canonical import canonical_json
+from .models import DesignRevision
+
+SNAPSHOT_EVERY = 10
+# Keep the full document unless the delta is at most this share of its size.
+MAX_DELTA_RATIO = 0.5
+
+
+def _escape(token) -> str:
+    return str(token).replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def _same(source, target) -> bool:
+    # 1 == 1.0 == True in Python, not in JSON.
+    return type(source) is type(target) and source == target
+
+
+def diff(source, target, path: str = "") -> list[dict]:
+    """JSON Patch operations turning source into target."""
+    if isinstance(source, dict) and isinstance(target, dict):
+        operations = [{"op": "remove", "path": f"{path}/{_escape(key)}"} for key in source if key not in target]
+        for key, value in target.items():
+            if key in source:
+                operations += diff(source[key], value, f"{path}/{_escape(key)}")
+            else:
+                operations.append({"op": "add", "path": f"{path}/{_escape(key)}", "value": value})
+        return operations
+    if isinstance(source, list) and isinstance(target, list):
+        common = min(len(source), len(target))
+        operations = []
+        for index in range(common):
+            operations += diff(source[index], target[index], f"{path}/{index}")
+        for index in range(len(source) - 1, common - 1, -1):
+            operations.append({"op": "remove", "path": f"{path}/{index}"})
+        for index in range(common, len(target)):
+            operations.append({"op": "add", "path": f"{path}/{index}", "value": target[index]})
+        return operations
+    if _same(source, target):
+        return []
+    return [{"op": "replace", "path": path, "value": target}]
+
+
+def apply_patch(document, operations: list[dict]):
+    """A patched deep copy of document; the input is left untouched."""
+    return _apply_in_place(copy.deepcopy(document), operations)
+
+
+def _apply_in_place(document, operations: list[dict]):
+    for operation in operations:
+        path = operation["path"]
+        if path == "":
+            document = copy.deepcopy(operation["value"])
+            continue
+        *parents, last = [_unescape(token) for token in path.split("/")[1:]]
+        container = document
+        for token in parents:
+            container = container[int(token)] if isinstance(container, list) else container[token]
+        if isinstance(container, list):
+            index = len(container) if last == "-" else int(last)
+            if operation["op"] == "add":
+                container.insert(index, copy.deepcopy(operation["value"]))
+            elif operation["op"] == "remove":
+                del container[index]
+            else:
+                container[index] = copy.deepcopy(operation["value"])
+        elif operation["op"] == "remove":
+            del container[last]
+        else:
+            container[last] = copy.deepcopy(operation["value"])
+    return document
+
+
+def compress_previous(previous: DesignRevision, latest_mas: dict):
+    """Called when a revision is added after previous (until now the latest,
+    hence full): store previous as a reverse delta from latest_mas when that
+    pays off."""
+    if previous.mas is None or previous.revision % SNAPSHOT_EVERY == 0:
+        return
+    delta = diff(latest_mas, previous.mas)
+    if len(canonical_json(delta)) <= MAX_DELTA_RATIO * len(canonical_json(previous.mas)):
+        previous.mas_delta = delta
+        previous.blob = None
+        previous.blob_hash = None
+
+
+def chain_query(row: DesignRevision):
+    """The revisions after row up to the nearest full one, newest first; run
+    it with a sync or an async session and pass the rows to reconstruct()."""
+    nearest_full = (select(func.min(DesignRevision.revision))
+                    .where(DesignRevision.design_id == row.design_id,
+                           DesignRevision.revision > row.revision,
+                           DesignRevision.blob_hash.isnot(None))
+                    .scalar_subquery())
+    return (select(DesignRevision)
+            .where(DesignRevision.design_id == row.design_id,
+                   DesignRevision.revision > row.revision,
+                   DesignRevision.revision <= nearest_full)
+            .options(joinedload(DesignRevision.blob))
+            .order_by(DesignRevision.revision.desc()))
+
+
+def reconstruct(row: DesignRevision, newer: list[DesignRevision]) -> dict:
+    """The MAS document of row, given the result of chain_query(row)."""
+    if row.mas is not None:
+        return row.mas
+    if not newer or newer[0].mas is None:
+        raise ValueError(f"Revision {row.revision} of design {row.design_id} has no full revision after it")
+    document = copy.deepcopy(newer[0].mas)
+    for delta_row in newer[1:] + [row]:
+        document = _apply_in_place(document, delta_row.mas_delta)
+    return document
+
+
+def revision_mas(db, row: DesignRevision) -> dict:
+    """The MAS document of row, on a sync session."""
+    if row.mas is not None:
+        return row.mas
+    return reconstruct(row, db.execute(chain_query(row)).scalars().all())
@@ -20,7 +20,8 @@ from ..models import EmailToken, User
 from ..ratelimit import limit
 from ..security import (
     clear_session_cookie, create_session, current_user, destroy_other_sessions,
-    destroy_session, hash_password, set_session_cookie, verify_password,
+    destroy_session, forget_user_sessions, hash_password, set_session_cookie, verify_and_update_password,
+    verify_password,
 )
 
 router = APIRouter(prefix="/auth", tags=["auth"])
@@ -145,10 +146,19 @@ def register(data: RegisterIn, request: Request, response: Response,
 def login(data: LoginIn, request: Request, response: Response, db: OrmSession = Depends(get_db)):
     email = _normalize_email(data.email)
     user = _find_user(db, email)
-    if user is None or not verify_password(data.password, user.password_hash):
+    if user is None:
+        raise HTTPException(status_code=401, detail="Wrong email or password")
+    valid, new_hash = verify_and_update_password(data.password, user.password_hash)
+    if not valid:
         raise HTTPException(status_code=401, detail="Wrong email or password")
     if user.disabled_at is not None:
         raise HTTPException(status_code=403, detail="This account is disabled")
+    if new_hash is not None:
+        # Hashing parameters changed since this hash was made: upgrade it
+        # now, while we have the password.
+        user.password_hash = new_hash
+        db.commit()
+        forget_user_sessions(user)
     set_session_cookie(response, create_session(db, user, request.headers.get("user-agent")))
     return _user_payload(user)
 
@@ -199,6 +209,7 @@ def verify_email(data: VerifyIn, db: OrmSession = Depends(get_db)):
     user = _consume_email_token(db, data.token, "verify")
     user.email_verified_at = datetime.datetime.now(datetime.timezone.utc)
     db.commit()
+    forget_user_sessions(user)
     return {"status": "verified"}
 
 
@@ -223,4 +234,5 @@ def reset_password(data: ResetPasswordIn, db: OrmSession = Depends(get_db)):
     user = _consume_email_token(db, data.token, "reset")
     user.password_hash = hash_password(data.new_password)
     db.commit()
+    forget_user_sessions(user)
     return {"status": "password_reset"}
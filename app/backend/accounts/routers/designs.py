@@ -9,27 +9,43 @@
 - Optimistic concurrency: PUT requires If-Match: <version>; a stale version
   gets 409 with the current version so the client can offer reload/overwrite.
 - Saving a byte-identical document is a no-op (no new revision).
+- The listing is paginated newest first on (updated_at, id); see pagination.py.
+- Older revisions are stored as deltas and rebuilt on read; see revisions.py.
+- GET of a design or revision carries a strong ETag; If-None-Match gets a 304
+  without the MAS document being read (see etags.py).
+- The two reads every client makes on start-up, the listing and opening a
+  design, run on the async session layer (db.get_async_db); writes stay sync.
 """
+import datetime
 import hashlib
-import json
 import uuid
 
-from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
 from pydantic import BaseModel
-from sqlalchemy import func
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.orm import noload
 
-from ..db import get_db
+from ...canonical import canonical_json
+from ..blobs import store
+from ..db import get_async_db, get_db
+from ..etags import make_etag, not_modified, not_modified_response
 from ..mas_validation import mas_spec_version, validate_mas
-from ..models import Design, DesignRevision, User
-from ..orgs import membership_of, resolve_owner
-from ..security import current_user
+from ..models import Design, DesignRevision, MasBlob, User
+from ..orgs import resolve_owner, resolve_owner_async, role_in, role_in_async
+from ..pagination import decode_cursor, encode_cursor, page_size, parse_fields, project
+from ..revisions import compress_previous, revision_mas
+from ..security import current_user, current_user_async
 
 router = APIRouter(prefix="/designs", tags=["designs"])
 
 MAX_DESIGNS_PER_USER = 100
 MAX_REVISIONS_PER_DESIGN = 50
 MAX_DESIGN_BYTES = 2 * 1024 * 1024
+# Browsers may keep a copy but must revalidate it (cheap: see etags.py).
+CACHE_CONTROL = "private, no-cache"
+LIST_FIELDS = ("name", "version", "created_at", "updated_at", "revisions", "schema_valid")
 
 
 class DesignIn(BaseModel):
@@ -45,24 +61,12 @@ class DesignUpdateIn(BaseModel):
 
 
 def _canonical_hash(mas: dict) -> str:
-    canonical = json.dumps(mas, sort_keys=True, separators=(",", ":"))
+    canonical = canonical_json(mas)
     if len(canonical) > MAX_DESIGN_BYTES:
         raise HTTPException(status_code=413, detail=f"Design exceeds the {MAX_DESIGN_BYTES // (1024 * 1024)} MB limit")
     return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
 
 
-def _latest_flags(db: OrmSession, design_ids: list) -> dict:
-    """schema_valid of the latest revision, per design id."""
-    if not design_ids:
-        return {}
-    rows = (db.query(DesignRevision.design_id, DesignRevision.schema_valid)
-            .filter(DesignRevision.design_id.in_(design_ids))
-            .distinct(DesignRevision.design_id)
-            .order_by(DesignRevision.design_id, DesignRevision.revision.desc())
-            .all())
-    return {design_id: schema_valid for design_id, schema_valid in rows}
-
-
 def _envelope(design: Design, revisions: int | None = None) -> dict:
     payload = {
         "id": str(design.id),
@@ -76,58 +80,113 @@ def _envelope(design: Design, revisions: int | None = None) -> dict:
     return payload
 
 
-def _get_own_design(db: OrmSession, user: User, design_id: str, write: bool = True) -> Design:
-    """A design the user may access: their own, or one owned by an org they
-    belong to (viewer may read; member+ may write)."""
+def _design_key(design_id: str) -> uuid.UUID:
     try:
-        key = uuid.UUID(design_id)
+        return uuid.UUID(design_id)
     except ValueError:
         raise HTTPException(status_code=404, detail="Design not found")
-    design = (db.query(Design)
-              .filter(Design.id == key, Design.deleted_at.is_(None))
-              .one_or_none())
+
+
+def _needs_org_role(user: User, design: Design | None) -> bool:
+    return design is not None and design.owner_user_id != user.id and design.owner_org_id is not None
+
+
+def _require_access(user: User, design: Design | None, write: bool, org_role: str | None):
+    """A design the user may access: their own, or one owned by an org they
+    belong to (viewer may read; member+ may write). org_role is the user's
+    role in the owning org."""
     if design is None:
         raise HTTPException(status_code=404, detail="Design not found")
     if design.owner_user_id == user.id:
-        return design
+        return
     if design.owner_org_id is not None:
-        membership = membership_of(db, user.id, design.owner_org_id)
-        if membership is not None and (not write or membership.role != "viewer"):
-            return design
-        if membership is not None:
+        if org_role is not None and (not write or org_role != "viewer"):
+            return
+        if org_role is not None:
             raise HTTPException(status_code=403, detail="Viewers cannot modify organization designs")
     raise HTTPException(status_code=404, detail="Design not found")
 
 
-def _latest_revision(db: OrmSession, design: Design) -> DesignRevision:
-    revision = (db.query(DesignRevision)
-                .filter(DesignRevision.design_id == design.id)
-                .order_by(DesignRevision.revision.desc())
-                .first())
-    if revision is None:
+def _check_access(db: OrmSession, user: User, design: Design | None, write: bool):
+    org_role = role_in(db, user.id, design.owner_org_id) if _needs_org_role(user, design) else None
+    _require_access(user, design, write, org_role)
+
+
+async def _check_access_async(db: AsyncSession, user: User, design: Design | None, write: bool):
+    org_role = await role_in_async(db, user.id, design.owner_org_id) if _needs_org_role(user, design) else None
+    _require_access(user, design, write, org_role)
+
+
+def _get_own_design(db: OrmSession, user: User, design_id: str, write: bool = True) -> Design:
+    design = (db.query(Design)
+              .filter(Design.id == _design_key(design_id), Design.deleted_at.is_(None))
+              .one_or_none())
+    _check_access(db, user, design, write)
+    return design
+
+
+def _get_own_design_and_latest(db: OrmSession, user: User, design_id: str,
+                               write: bool = True) -> tuple[Design, DesignRevision]:
+    """The design and its latest revision in one query (through the
+    latest_revision pointer). For writes the design row stays locked until
+    commit, so concurrent saves cannot both append the same revision. The MAS
+    document itself is only loaded when revision.mas is read."""
+    query = _design_and_latest_query(design_id)
+    if write:
+        query = query.with_for_update(of=Design)
+    design, latest = db.execute(query).one_or_none() or (None, None)
+    _check_access(db, user, design, write)
+    return design, _present(design, latest)
+
+
+def _design_and_latest_query(design_id: str):
+    return (select(Design, DesignRevision)
+            .outerjoin(DesignRevision, (DesignRevision.design_id == Design.id)
+                       & (DesignRevision.revision == Design.latest_revision))
+            .where(Design.id == _design_key(design_id), Design.deleted_at.is_(None)))
+
+
+def _present(design: Design, latest: DesignRevision | None) -> DesignRevision:
+    if latest is None:
         raise HTTPException(status_code=500, detail=f"Design {design.id} has no revisions — data integrity error")
-    return revision
+    return latest
+
+
+def _after(cursor: str | None):
+    key = decode_cursor(cursor, 2)
+    if key is None:
+        return None
+    try:
+        return tuple_(Design.updated_at, Design.id) < tuple_(datetime.datetime.fromisoformat(key[0]), uuid.UUID(key[1]))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid cursor")
 
 
 @router.get("")
-def list_designs(org: str | None = None,
-                 user: User = Depends(current_user), db: OrmSession = Depends(get_db)):
-    owner_user_id, owner_org_id, _ = resolve_owner(db, user, org, minimum="viewer")
+async def list_designs(org: str | None = None, cursor: str | None = None, limit: int | None = None,
+                       fields: str | None = None,
+                       user: User = Depends(current_user_async), db: AsyncSession = Depends(get_async_db)):
+    """One page of designs, most recently updated first. next_cursor is null
+    on the last page."""
+    owner_user_id, owner_org_id, _ = await resolve_owner_async(db, user, org, minimum="viewer")
+    size = page_size(limit)
+    selected = parse_fields(fields, LIST_FIELDS, LIST_FIELDS)
     owner_filter = (Design.owner_user_id == owner_user_id) if owner_org_id is None \
         else (Design.owner_org_id == owner_org_id)
-    rows = (db.query(Design, func.count(DesignRevision.revision))
-            .outerjoin(DesignRevision, DesignRevision.design_id == Design.id)
-            .filter(owner_filter, Design.deleted_at.is_(None))
-            .group_by(Design.id)
-            .order_by(Design.updated_at.desc())
-            .all())
-    flags = _latest_flags(db, [design.id for design, _ in rows])
+    query = select(Design).where(owner_filter, Design.deleted_at.is_(None))
+    after = _after(cursor)
+    if after is not None:
+        query = query.where(after)
+    rows = (await db.execute(query.order_by(Design.updated_at.desc(), Design.id.desc())
+                             .limit(size + 1))).scalars().all()
     designs = []
-    for design, revisions in rows:
-        payload = _envelope(design, revisions)
-        payload["schema_valid"] = flags.get(design.id)
-        designs.append(payload)
-    return {"designs": designs}
+    for design in rows[:size]:
+        payload = _envelope(design, design.revision_count)
+        payload["schema_valid"] = design.schema_valid
+        designs.append(project(payload, selected))
+    last = rows[size - 1] if len(rows) > size else None
+    return {"designs": designs,
+            "next_cursor": encode_cursor([last.updated_at.isoformat(), str(last.id)]) if last else None}
 
 
 @router.post("")
@@ -148,13 +207,14 @@ def create_design(data: DesignIn, org: str | None = None,
     mas_hash = _canonical_hash(data.mas)
     schema_errors = validate_mas(data.mas)
 
-    design = Design(owner_user_id=owner_user_id, owner_org_id=owner_org_id, name=name, created_by=user.id, version=1)
+    design = Design(owner_user_id=owner_user_id, owner_org_id=owner_org_id, name=name, created_by=user.id, version=1,
+                    latest_revision=1, revision_count=1, schema_valid=not schema_errors)
     db.add(design)
     db.flush()
     db.add(DesignRevision(
         design_id=design.id,
         revision=1,
-        mas=data.mas,
+        blob_hash=store(db, data.mas, mas_hash),
         mas_hash=mas_hash,
         mas_version=mas_spec_version(),
         engine_version=data.engine_version,
@@ -170,12 +230,23 @@ def create_design(data: DesignIn, org: str | None = None,
 
 
 @router.get("/{design_id}")
-def get_design(design_id: str, user: User = Depends(current_user), db: OrmSession = Depends(get_db)):
-    design = _get_own_design(db, user, design_id, write=False)
-    revision = _latest_revision(db, design)
+async def get_design(design_id: str, response: Response,
+                     if_none_match: str | None = Header(default=None, alias="If-None-Match"),
+                     user: User = Depends(current_user_async), db: AsyncSession = Depends(get_async_db)):
+    query = _design_and_latest_query(design_id).options(noload(DesignRevision.blob))
+    design, revision = (await db.execute(query)).one_or_none() or (None, None)
+    await _check_access_async(db, user, design, write=False)
+    revision = _present(design, revision)
+    # version and mas_hash cover the document, updated_at a rename.
+    etag = make_etag(design.id, design.version, design.updated_at.isoformat(), revision.mas_hash)
+    if not_modified(if_none_match, etag):
+        return not_modified_response(etag, CACHE_CONTROL)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
     payload = _envelope(design)
     payload.update({
-        "mas": revision.mas,
+        # The latest revision is always stored in full.
+        "mas": (await db.get(MasBlob, revision.blob_hash)).mas,
         "revision": revision.revision,
         "mas_version": revision.mas_version,
         "engine_version": revision.engine_version,
@@ -188,7 +259,10 @@ def get_design(design_id: str, user: User = Depends(current_user), db: OrmSessio
 def update_design(design_id: str, data: DesignUpdateIn,
                   if_match: int | None = Header(default=None, alias="If-Match"),
                   user: User = Depends(current_user), db: OrmSession = Depends(get_db)):
-    design = _get_own_design(db, user, design_id)
+    if data.mas is None:
+        design = _get_own_design(db, user, design_id)
+    else:
+        design, latest = _get_own_design_and_latest(db, user, design_id)
 
     if data.name is not None:
         name = data.name.strip()
@@ -207,29 +281,33 @@ def update_design(design_id: str, data: DesignUpdateIn,
                 "current_version": design.version,
             })
         mas_hash = _canonical_hash(data.mas)
-        latest = _latest_revision(db, design)
         if latest.mas_hash == mas_hash:
             unchanged = True
         else:
             schema_errors = validate_mas(data.mas)
-            if latest.revision >= MAX_REVISIONS_PER_DESIGN:
+            if design.revision_count >= MAX_REVISIONS_PER_DESIGN:
                 # Revision history is a rolling window: drop the oldest.
                 oldest = (db.query(DesignRevision)
                           .filter(DesignRevision.design_id == design.id)
                           .order_by(DesignRevision.revision.asc())
                           .first())
                 db.delete(oldest)
+            else:
+                design.revision_count = design.revision_count + 1
             db.add(DesignRevision(
                 design_id=design.id,
                 revision=latest.revision + 1,
-                mas=data.mas,
+                blob_hash=store(db, data.mas, mas_hash),
                 mas_hash=mas_hash,
                 mas_version=mas_spec_version(),
                 engine_version=data.engine_version,
                 schema_valid=not schema_errors,
                 saved_by=user.id,
             ))
+            compress_previous(latest, data.mas)
             design.version = design.version + 1
+            design.latest_revision = latest.revision + 1
+            design.schema_valid = not schema_errors
 
     design.updated_at = func.now()
     db.commit()
@@ -264,16 +342,23 @@ def list_revisions(design_id: str, user: User = Depends(current_user), db: OrmSe
 
 
 @router.get("/{design_id}/revisions/{revision}")
-def get_revision(design_id: str, revision: int,
+def get_revision(design_id: str, revision: int, response: Response,
+                 if_none_match: str | None = Header(default=None, alias="If-None-Match"),
                  user: User = Depends(current_user), db: OrmSession = Depends(get_db)):
     design = _get_own_design(db, user, design_id, write=False)
     row = db.get(DesignRevision, (design.id, revision))
     if row is None:
         raise HTTPException(status_code=404, detail="Revision not found")
+    # Revisions never change.
+    etag = make_etag(design.id, row.revision, row.mas_hash)
+    if not_modified(if_none_match, etag):
+        return not_modified_response(etag, CACHE_CONTROL)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
     return {
         "revision": row.revision,
         "saved_at": row.saved_at.isoformat(),
         "mas_version": row.mas_version,
         "engine_version": row.engine_version,
-        "mas": row.mas,
+        "mas": revision_mas(db, row),
     }
@@ -9,6 +9,10 @@ Each row is one part owned by the user (org ownership arrives in Phase 4):
 Endpoints mirror the MAS ndjson data-file format for bulk import/export, and
 /inventory/context.json returns the LibraryContext payload the frontend feeds
 to library_context_load() / the load_* engine loaders.
+
+The listing is paginated on (part_type, name), the owner's unique key, and
+leaves out the MAS records unless asked for with ?fields=...,mas. Being read
+on every start-up, it runs on the async session layer (db.get_async_db).
 """
 import json
 import uuid
@@ -16,14 +20,18 @@ import uuid
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from sqlalchemy import func
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.orm import joinedload, raiseload
 
-from ..db import get_db
+from ..blobs import store
+from ..db import get_async_db, get_db
 from ..mas_validation import mas_spec_version, validate_mas_part
-from ..models import InventoryPart, Membership, User
-from ..orgs import ROLE_RANK, membership_of, resolve_owner
-from ..security import current_user
+from ..models import InventoryPart, User
+from ..orgs import ROLE_RANK, resolve_owner, resolve_owner_async, role_in, roles_of
+from ..pagination import decode_cursor, encode_cursor, page_size, parse_fields, project
+from ..security import current_user, current_user_async
 
 router = APIRouter(prefix="/inventory", tags=["inventory"])
 
@@ -38,6 +46,9 @@ CONTEXT_KEYS = {
 }
 MAX_PARTS_PER_OWNER = 1000
 MAX_IMPORT_BYTES = 10 * 1024 * 1024
+LIST_FIELDS = ("part_type", "name", "source", "catalog_ref", "mas", "stock_qty", "order_code", "notes",
+               "lifecycle", "created_at", "updated_at")
+DEFAULT_LIST_FIELDS = tuple(field for field in LIST_FIELDS if field != "mas")
 
 
 class PartIn(BaseModel):
@@ -59,14 +70,14 @@ class PartUpdateIn(BaseModel):
     lifecycle: str | None = None     # org parts: librarian+ transitions
 
 
-def _payload(part: InventoryPart) -> dict:
+def _payload(part: InventoryPart, with_mas: bool = True) -> dict:
     return {
         "id": str(part.id),
         "part_type": part.part_type,
         "name": part.name,
         "source": part.source,
         "catalog_ref": part.catalog_ref,
-        "mas": part.mas,
+        "mas": part.mas if with_mas else None,
         "stock_qty": float(part.stock_qty) if part.stock_qty is not None else None,
         "order_code": part.order_code,
         "notes": part.notes,
@@ -97,10 +108,14 @@ def _validate_part_in(data: PartIn) -> tuple[str, list[str]]:
     raise HTTPException(status_code=422, detail="source must be 'catalog' or 'private'")
 
 
-def _own_parts(db: OrmSession, user: User, owner_org_id=None):
+def _own_parts_filter(user: User, owner_org_id=None) -> tuple:
     owner_filter = (InventoryPart.owner_org_id == owner_org_id) if owner_org_id is not None \
         else (InventoryPart.owner_user_id == user.id)
-    return db.query(InventoryPart).filter(owner_filter, InventoryPart.deleted_at.is_(None))
+    return owner_filter, InventoryPart.deleted_at.is_(None)
+
+
+def _own_parts(db: OrmSession, user: User, owner_org_id=None):
+    return db.query(InventoryPart).filter(*_own_parts_filter(user, owner_org_id))
 
 
 def _write_access(db: OrmSession, user: User, part: InventoryPart, need_librarian: bool = False):
@@ -109,11 +124,11 @@ def _write_access(db: OrmSession, user: User, part: InventoryPart, need_libraria
     if part.owner_user_id == user.id:
         return
     if part.owner_org_id is not None:
-        membership = membership_of(db, user.id, part.owner_org_id)
+        role = role_in(db, user.id, part.owner_org_id)
         minimum = "librarian" if need_librarian else "member"
-        if membership is not None and ROLE_RANK[membership.role] >= ROLE_RANK[minimum]:
+        if role is not None and ROLE_RANK[role] >= ROLE_RANK[minimum]:
             return
-        if membership is not None:
+        if role is not None:
             raise HTTPException(status_code=403, detail=f"This action needs the '{minimum}' role or higher")
     raise HTTPException(status_code=404, detail="Part not found")
 
@@ -129,7 +144,7 @@ def _get_own_part(db: OrmSession, user: User, part_id: str) -> InventoryPart:
     if part is None:
         raise HTTPException(status_code=404, detail="Part not found")
     if part.owner_user_id != user.id and (
-            part.owner_org_id is None or membership_of(db, user.id, part.owner_org_id) is None):
+            part.owner_org_id is None or role_in(db, user.id, part.owner_org_id) is None):
         raise HTTPException(status_code=404, detail="Part not found")
     return part
 
@@ -144,6 +159,8 @@ def _check_quota(db: OrmSession, user: User, adding: int, owner_org_id=None):
 def _upsert_part(db: OrmSession, user: User, data: PartIn,
                  owner_user_id=None, owner_org_id=None, role=None) -> tuple[InventoryPart, list[str]]:
     name, schema_errors = _validate_part_in(data)
+    # Stored before the part row is added, so autoflush cannot write it twice.
+    blob_hash = store(db, data.mas) if data.mas is not None else None
     if owner_user_id is None and owner_org_id is None:
         owner_user_id = user.id
     existing = (_own_parts(db, user, owner_org_id)
@@ -170,7 +187,7 @@ def _upsert_part(db: OrmSession, user: User, data: PartIn,
         db.add(existing)
     existing.source = data.source
     existing.catalog_ref = name if data.source == "catalog" else None
-    existing.mas = data.mas
+    existing.blob_hash = blob_hash
     existing.mas_version = mas_spec_version() if data.source == "private" else None
     existing.stock_qty = data.stock_qty
     existing.order_code = data.order_code
@@ -180,10 +197,25 @@ def _upsert_part(db: OrmSession, user: User, data: PartIn,
 
 
 @router.get("")
-def list_parts(org: str | None = None, user: User = Depends(current_user), db: OrmSession = Depends(get_db)):
-    _, owner_org_id, _role = resolve_owner(db, user, org, minimum="viewer")
-    parts = _own_parts(db, user, owner_org_id).order_by(InventoryPart.part_type, InventoryPart.name).all()
-    return {"parts": [_payload(p) for p in parts]}
+async def list_parts(org: str | None = None, cursor: str | None = None, limit: int | None = None,
+                     fields: str | None = None,
+                     user: User = Depends(current_user_async), db: AsyncSession = Depends(get_async_db)):
+    """One page of parts by type and name; next_cursor is null on the last
+    page. Add mas to ?fields= for the full MAS records."""
+    _, owner_org_id, _role = await resolve_owner_async(db, user, org, minimum="viewer")
+    size = page_size(limit)
+    selected = parse_fields(fields, LIST_FIELDS, DEFAULT_LIST_FIELDS)
+    query = (select(InventoryPart)
+             .where(*_own_parts_filter(user, owner_org_id))
+             .options(joinedload(InventoryPart.blob) if "mas" in selected else raiseload(InventoryPart.blob)))
+    after = decode_cursor(cursor, 2)
+    if after is not None:
+        query = query.where(tuple_(InventoryPart.part_type, InventoryPart.name) > tuple_(*after))
+    parts = (await db.execute(query.order_by(InventoryPart.part_type, InventoryPart.name)
+                              .limit(size + 1))).scalars().all()
+    last = parts[size - 1] if len(parts) > size else None
+    return {"parts": [project(_payload(p, with_mas="mas" in selected), selected) for p in parts[:size]],
+            "next_cursor": encode_cursor([last.part_type, last.name]) if last else None}
 
 
 @router.post("")
@@ -216,7 +248,7 @@ def update_part(part_id: str, data: PartUpdateIn,
         if part.source != "private":
             raise HTTPException(status_code=422, detail="Only private parts carry a MAS record")
         schema_errors = validate_mas_part(part.part_type, data.mas)
-        part.mas = data.mas
+        part.blob_hash = store(db, data.mas)
         part.mas_version = mas_spec_version()
     if data.stock_qty is not None:
         part.stock_qty = data.stock_qty
@@ -283,6 +315,7 @@ def export_ndjson(part_type: str, org: str | None = None,
     _, owner_org_id, _role = resolve_owner(db, user, org, minimum="viewer")
     parts = (_own_parts(db, user, owner_org_id)
              .filter(InventoryPart.part_type == part_type, InventoryPart.source == "private")
+             .options(joinedload(InventoryPart.blob))
              .order_by(InventoryPart.name)
              .all())
     return "\n".join(json.dumps(p.mas) for p in parts if p.mas is not None)
@@ -299,18 +332,15 @@ def context_json(user: User = Depends(current_user), db: OrmSession = Depends(ge
 
     parts = list(_own_parts(db, user)
                  .filter(InventoryPart.lifecycle == "approved")
+                 .options(joinedload(InventoryPart.blob))
                  .all())
-    org_ids = [org_id for (org_id,) in
-               (db.query(Membership.org_id)
-                .filter(Membership.user_id == user.id,
-                        Membership.accepted_at.isnot(None),
-                        Membership.revoked_at.is_(None))
-                .all())]
+    org_ids = list(roles_of(db, user.id))
     if org_ids:
         parts += (db.query(InventoryPart)
                   .filter(InventoryPart.owner_org_id.in_(org_ids),
                           InventoryPart.deleted_at.is_(None),
                           InventoryPart.lifecycle == "approved")
+                  .options(joinedload(InventoryPart.blob))
                   .all())
     mounted_owner_ids = [owner_id for (owner_id,) in
                          (db.query(ShareLink.owner_user_id)
@@ -324,6 +354,7 @@ def context_json(user: User = Depends(current_user), db: OrmSession = Depends(ge
                   .filter(InventoryPart.owner_user_id.in_(mounted_owner_ids),
                           InventoryPart.deleted_at.is_(None),
                           InventoryPart.lifecycle == "approved")
+                  .options(joinedload(InventoryPart.blob))
                   .all())
     private = {key: [] for key in CONTEXT_KEYS.values()}
     catalog_refs = {key: [] for key in CONTEXT_KEYS.values()}
@@ -9,10 +9,11 @@ from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy import func
 from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.orm import joinedload
 
 from ..db import get_db
 from ..models import Design, DesignRevision, User, UserSettings
-from ..security import current_user, verify_password
+from ..security import current_user, forget_user_sessions, verify_password
 
 router = APIRouter(prefix="/me", tags=["me"])
 
@@ -68,14 +69,13 @@ def export_everything(user: User = Depends(current_user), db: OrmSession = Depen
         if settings_row is not None:
             archive.writestr("settings.json", json.dumps(settings_row.settings, indent=2))
 
-        designs = (db.query(Design)
+        designs = (db.query(Design, DesignRevision)
+                   .outerjoin(DesignRevision, (DesignRevision.design_id == Design.id)
+                              & (DesignRevision.revision == Design.latest_revision))
                    .filter(Design.owner_user_id == user.id, Design.deleted_at.is_(None))
+                   .options(joinedload(DesignRevision.blob))
                    .all())
-        for design in designs:
-            latest = (db.query(DesignRevision)
-                      .filter(DesignRevision.design_id == design.id)
-                      .order_by(DesignRevision.revision.desc())
-                      .first())
+        for design, latest in designs:
             if latest is None:
                 raise HTTPException(status_code=500,
                                     detail=f"Design {design.id} has no revisions — data integrity error")
@@ -99,4 +99,5 @@ def delete_account(data: DeleteAccountIn, user: User = Depends(current_user), db
     # (and their revisions), inventory, share links and mounts.
     db.delete(user)
     db.commit()
+    forget_user_sessions(user)
     return {"status": "account_deleted"}
@@ -16,7 +16,7 @@ from sqlalchemy.orm import Session as OrmSession
 from .. import emailer
 from ..db import get_db
 from ..models import Membership, Organization, User
-from ..orgs import ROLE_RANK, get_org, membership_of, parse_uuid, require_role
+from ..orgs import ROLE_RANK, forget_roles, get_org, membership_of, parse_uuid, require_role
 from ..ratelimit import limit
 from ..security import current_user
 
@@ -105,6 +105,7 @@ def create_org(data: OrgIn, user: User = Depends(current_user), db: OrmSession =
     db.add(Membership(org_id=org.id, user_id=user.id, role="owner",
                       invited_by=user.id, accepted_at=func.now()))
     db.commit()
+    forget_roles(db, user.id)
     db.refresh(org)
     return _org_payload(org, "owner")
 
@@ -118,6 +119,7 @@ def delete_org(org_id: str, user: User = Depends(current_user), db: OrmSession =
     require_role(db, user.id, key, "owner")
     org.deleted_at = func.now()
     db.commit()
+    forget_roles(db)   # every member's; deleting an org is rare
     return {"status": "deleted"}
 
 
@@ -188,6 +190,7 @@ def accept_invitation(membership_id: str, user: User = Depends(current_user), db
     membership.user_id = user.id
     membership.accepted_at = func.now()
     db.commit()
+    forget_roles(db, user.id)
     return {"status": "accepted", "org": _org_payload(org, membership.role)}
 
 
@@ -207,6 +210,8 @@ def change_role(org_id: str, membership_id: str, data: RoleIn,
         require_role(db, user.id, org_key, "owner")
     membership.role = data.role
     db.commit()
+    if membership.user_id is not None:   # a pending invitation grants no role yet
+        forget_roles(db, membership.user_id)
     return _member_payload(membership, db)
 
 
@@ -226,4 +231,6 @@ def remove_member(org_id: str, membership_id: str,
         raise HTTPException(status_code=409, detail="An organization needs at least one owner")
     membership.revoked_at = func.now()
     db.commit()
+    if membership.user_id is not None:   # a pending invitation grants no role yet
+        forget_roles(db, membership.user_id)
     return {"status": "removed"}
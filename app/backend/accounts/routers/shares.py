@@ -5,18 +5,25 @@
   MOUNT it, which folds those parts into their /inventory/context.json so the
   advisers can design with them ("public + mine + theirs").
 - Possession of the token IS the permission; owners can revoke at any time.
-  Public GETs are unauthenticated and cheap (single JSONB read).
+  Public GETs are unauthenticated and cheap (single JSONB read). Being the
+  most-hit and never-authenticated routes, they run on the async session
+  layer (db.get_async_db) and hold no threadpool thread while they wait.
 """
 import secrets
 import uuid
 
-from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
 from pydantic import BaseModel
-from sqlalchemy import func
+from sqlalchemy import func, literal_column, select, update
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.orm import joinedload, noload
 
-from ..db import get_db
-from ..models import Design, DesignRevision, InventoryMount, InventoryPart, ShareLink, User
+from ..db import get_async_db, get_db
+from ..etags import make_etag, not_modified, not_modified_response
+from ..models import Design, DesignRevision, InventoryMount, InventoryPart, MasBlob, ShareLink, User
+from ..revisions import chain_query, reconstruct
 from ..security import current_user
 
 router = APIRouter(tags=["shares"])
@@ -133,45 +140,82 @@ def _live_link(db: OrmSession, token: str, kind: str) -> ShareLink:
     return link
 
 
+async def _open_live_link(db: AsyncSession, token: str, kind: str) -> ShareLink:
+    """The live link for token, its visit counted: one UPDATE ... RETURNING
+    both checks the link and bumps the counter."""
+    link = (await db.execute(
+        update(ShareLink)
+        .where(ShareLink.token == token, ShareLink.kind == kind, ShareLink.revoked_at.is_(None))
+        .values(visit_count=ShareLink.visit_count + 1)
+        .returning(ShareLink))).scalar_one_or_none()
+    if link is None:
+        raise HTTPException(status_code=404, detail="This share link does not exist or was revoked")
+    await db.commit()
+    return link
+
+
 @router.get("/share/d/{token}")
-def open_shared_design(token: str, response: Response, db: OrmSession = Depends(get_db)):
-    link = _live_link(db, token, "design")
-    design = db.get(Design, link.design_id)
+async def open_shared_design(token: str, response: Response,
+                             if_none_match: str | None = Header(default=None, alias="If-None-Match"),
+                             db: AsyncSession = Depends(get_async_db)):
+    """Conditional: the ETag covers the design name and the revision's
+    mas_hash, so a 304 never reads the MAS document. Visits count either way."""
+    link = await _open_live_link(db, token, "design")
+    design = await db.get(Design, link.design_id)
     if design is None or design.deleted_at is not None:
         raise HTTPException(status_code=404, detail="The shared design no longer exists")
-    if link.pinned_revision is not None:
-        revision = db.get(DesignRevision, (design.id, link.pinned_revision))
-        response.headers["Cache-Control"] = "public, max-age=86400"
-    else:
-        revision = (db.query(DesignRevision)
-                    .filter(DesignRevision.design_id == design.id)
-                    .order_by(DesignRevision.revision.desc())
-                    .first())
-        response.headers["Cache-Control"] = "public, max-age=60"
+    pinned = link.pinned_revision is not None
+    revision = await db.get(DesignRevision, (design.id, link.pinned_revision if pinned else design.latest_revision),
+                            options=[noload(DesignRevision.blob)])
     if revision is None:
         raise HTTPException(status_code=404, detail="The shared design no longer exists")
+    cache_control = "public, max-age=86400" if pinned else "public, max-age=60"
+    etag = make_etag(design.id, design.name, revision.revision, revision.mas_hash)
+    if not_modified(if_none_match, etag):
+        return not_modified_response(etag, cache_control)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+    if revision.blob_hash is not None:
+        mas = (await db.get(MasBlob, revision.blob_hash)).mas
+    else:   # a pinned older revision, stored as a delta
+        mas = reconstruct(revision, (await db.execute(chain_query(revision))).scalars().all())
     return {
         "name": design.name,
         "revision": revision.revision,
         "mas_version": revision.mas_version,
         "saved_at": revision.saved_at.isoformat(),
-        "mas": revision.mas,
+        "mas": mas,
     }
 
 
 @router.get("/share/i/{token}")
-def open_shared_inventory(token: str, response: Response, db: OrmSession = Depends(get_db)):
-    link = _live_link(db, token, "inventory")
-    owner = db.get(User, link.owner_user_id) if link.owner_user_id is not None else None
+async def open_shared_inventory(token: str, response: Response,
+                                if_none_match: str | None = Header(default=None, alias="If-None-Match"),
+                                db: AsyncSession = Depends(get_async_db)):
+    """Conditional on a fingerprint of the shared parts' envelope columns
+    (every edit bumps updated_at; blob_hash identifies the MAS record)."""
+    link = await _open_live_link(db, token, "inventory")
+    owner = await db.get(User, link.owner_user_id) if link.owner_user_id is not None else None
     if owner is None or owner.deleted_at is not None:
         raise HTTPException(status_code=404, detail="The shared inventory no longer exists")
-    parts = (db.query(InventoryPart)
-             .filter(InventoryPart.owner_user_id == owner.id,
-                     InventoryPart.deleted_at.is_(None),
-                     InventoryPart.lifecycle == "approved")
-             .order_by(InventoryPart.part_type, InventoryPart.name)
-             .all())
-    response.headers["Cache-Control"] = "public, max-age=60"
+    shared = (InventoryPart.owner_user_id == owner.id,
+              InventoryPart.deleted_at.is_(None),
+              InventoryPart.lifecycle == "approved")
+    row_key = func.concat(InventoryPart.id, ":", InventoryPart.updated_at, ":", InventoryPart.blob_hash)
+    fingerprint = (await db.execute(
+        select(func.md5(func.string_agg(row_key, aggregate_order_by(literal_column("','"), InventoryPart.id))))
+        .where(*shared))).scalar()
+    cache_control = "public, max-age=60"
+    etag = make_etag(owner.id, owner.display_name, fingerprint)
+    if not_modified(if_none_match, etag):
+        return not_modified_response(etag, cache_control)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+    parts = (await db.execute(
+        select(InventoryPart)
+        .where(*shared)
+        .options(joinedload(InventoryPart.blob))
+        .order_by(InventoryPart.part_type, InventoryPart.name))).scalars().all()
     return {
         "owner": owner.display_name,
         "parts": [{
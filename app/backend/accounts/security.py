@@ -1,30 +1,55 @@
 """Password hashing, session tokens and the session cookie.
 
-- Argon2id via pwdlib (passlib is unmaintained).
+- Argon2id via pwdlib (passlib is unmaintained). At most OM_PASSWORD_WORKERS
+  hashes run at once, so a burst of logins cannot take the CPU and memory
+  every other request needs; once OM_PASSWORD_QUEUE_MAX are running or
+  waiting, further ones fail fast with 503. Hashes made with older parameters
+  are upgraded on the next successful login.
 - Sessions are server-side rows; the browser only holds an opaque random token
   in an HttpOnly cookie. The DB stores sha256(token), never the token itself.
 - Cookie is `__Host-`-prefixed + Secure in production (requires HTTPS, no
   Domain attribute); plain-named and non-Secure in development so
   http://localhost keeps working. Rolling ~1 year expiry.
+- Authenticated lookups are cached per process for OM_SESSION_CACHE_TTL
+  seconds (token hash -> detached user snapshot), so a burst of requests on
+  one session costs the two primary-key reads once. Logout, password changes
+  and account deletion drop the entries of this process at once; other
+  uvicorn workers may serve a cached entry until its TTL runs out, which is
+  why the TTL is short.
+- current_user_async is the same lookup on an AsyncSession, for handlers on
+  the async session layer (db.get_async_db).
 """
+import collections
 import datetime
 import hashlib
 import os
 import secrets
+import threading
+import time
 
 from fastapi import Depends, HTTPException, Request, Response
 from pwdlib import PasswordHash
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.orm import make_transient_to_detached
 
-from .db import get_db
+from .db import get_async_db, get_db
 from .models import AuthSession, User
 
 _password_hash = PasswordHash.recommended()
 
+PASSWORD_WORKERS = int(os.getenv("OM_PASSWORD_WORKERS", 2))
+PASSWORD_QUEUE_MAX = int(os.getenv("OM_PASSWORD_QUEUE_MAX", 16))
+PASSWORD_RETRY_AFTER = 2
+
 SESSION_LIFETIME = datetime.timedelta(days=365)
 # Extend the session row at most once a day to avoid a write per request.
 SESSION_TOUCH_INTERVAL = datetime.timedelta(hours=24)
 
+SESSION_CACHE_TTL = float(os.getenv("OM_SESSION_CACHE_TTL", 30))
+SESSION_CACHE_MAX_ENTRIES = 10000
+
 
 def _utcnow():
     return datetime.datetime.now(datetime.timezone.utc)
@@ -38,18 +63,143 @@ def cookie_name():
     return "__Host-om_session" if is_production() else "om_session"
 
 
+class _PasswordLimiter:
+    """Bounds Argon2 work. The hash runs on the caller's own thread (a sync
+    handler, already on the threadpool), at most `workers` at a time; at most
+    queue_max callers may be hashing or waiting for a slot, the rest are
+    rejected straight away."""
+
+    def __init__(self, workers: int, queue_max: int):
+        self.workers = workers
+        self.queue_max = queue_max
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(workers)
+        self._lock = threading.Lock()
+
+    def run(self, function, *args):
+        with self._lock:
+            if self.in_flight >= self.queue_max:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail="Server busy, try again in a moment",
+                                    headers={"Retry-After": str(PASSWORD_RETRY_AFTER)})
+            self.in_flight += 1
+        try:
+            with self._slots:
+                return function(*args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"workers": self.workers, "queue_max": self.queue_max, "in_flight": self.in_flight,
+                    "queued": max(0, self.in_flight - self.workers),
+                    "completed": self.completed, "rejected": self.rejected}
+
+
+_password_limiter = _PasswordLimiter(PASSWORD_WORKERS, PASSWORD_QUEUE_MAX)
+
+
+def password_pool_stats() -> dict:
+    return _password_limiter.stats()
+
+
 def hash_password(password: str) -> str:
-    return _password_hash.hash(password)
+    return _password_limiter.run(_password_hash.hash, password)
 
 
 def verify_password(password: str, password_hash: str) -> bool:
-    return _password_hash.verify(password, password_hash)
+    return _password_limiter.run(_password_hash.verify, password, password_hash)
+
+
+def verify_and_update_password(password: str, password_hash: str) -> tuple[bool, str | None]:
+    """(valid, new hash): the new hash is set when password_hash was made
+    with other parameters than the current ones and should be replaced."""
+    return _password_limiter.run(_password_hash.verify_and_update, password, password_hash)
 
 
 def _hash_token(token: str) -> str:
     return hashlib.sha256(token.encode("utf-8")).hexdigest()
 
 
+class _SessionCache:
+    """token_hash -> (user snapshot, cached until, session expiry), LRU-bounded,
+    with a user_id index for invalidating every session of a user."""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._by_user = collections.defaultdict(set)
+        self._lock = threading.Lock()
+
+    def get(self, token_hash: str, now: datetime.datetime):
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry is None:
+                return None
+            snapshot, cached_until, expires_at = entry
+            if time.monotonic() >= cached_until or expires_at < now:
+                self._drop(token_hash)
+                return None
+            self._entries.move_to_end(token_hash)
+            return snapshot
+
+    def put(self, token_hash: str, snapshot: User, expires_at: datetime.datetime):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._drop(token_hash)
+            self._entries[token_hash] = (snapshot, time.monotonic() + self.ttl, expires_at)
+            self._by_user[snapshot.id].add(token_hash)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, token_hash: str):
+        entry = self._entries.pop(token_hash, None)
+        if entry is not None:
+            tokens = self._by_user.get(entry[0].id)
+            if tokens is not None:
+                tokens.discard(token_hash)
+                if not tokens:
+                    del self._by_user[entry[0].id]
+
+    def forget_session(self, token_hash: str):
+        with self._lock:
+            self._drop(token_hash)
+
+    def forget_user(self, user_id):
+        with self._lock:
+            for token_hash in list(self._by_user.get(user_id, ())):
+                self._drop(token_hash)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+
+_session_cache = _SessionCache(SESSION_CACHE_TTL, SESSION_CACHE_MAX_ENTRIES)
+
+
+def forget_user_sessions(user: User):
+    """Drop the cached lookups of every session of user: call after anything
+    that changes the user row or ends its sessions."""
+    _session_cache.forget_user(user.id)
+
+
+def _snapshot(user: User) -> User:
+    """A detached copy of the loaded columns, safe to share between requests
+    and to merge into any session without a SELECT."""
+    snapshot = User(**{attribute.key: getattr(user, attribute.key)
+                       for attribute in inspect(User).column_attrs})
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
 def create_session(db: OrmSession, user: User, user_agent: str | None) -> str:
     token = secrets.token_urlsafe(32)
     db.add(AuthSession(
@@ -84,6 +234,7 @@ def destroy_session(db: OrmSession, request: Request):
     if token:
         db.query(AuthSession).filter(AuthSession.token_hash == _hash_token(token)).delete()
         db.commit()
+        _session_cache.forget_session(_hash_token(token))
 
 
 def destroy_other_sessions(db: OrmSession, user: User, request: Request):
@@ -94,6 +245,7 @@ def destroy_other_sessions(db: OrmSession, user: User, request: Request):
         query = query.filter(AuthSession.token_hash != _hash_token(token))
     query.delete()
     db.commit()
+    forget_user_sessions(user)
 
 
 def _lookup_user(request: Request, db: OrmSession):
@@ -101,19 +253,59 @@ def _lookup_user(request: Request, db: OrmSession):
     if not token:
         return None
     now = _utcnow()
-    session = db.get(AuthSession, _hash_token(token))
+    token_hash = _hash_token(token)
+    snapshot = _session_cache.get(token_hash, now)
+    if snapshot is not None:
+        # Attach a copy to this request's session without touching the DB.
+        return db.merge(snapshot, load=False)
+    session = db.get(AuthSession, token_hash)
     if session is None or session.expires_at < now:
         return None
     user = db.get(User, session.user_id)
-    if user is None or user.disabled_at is not None or user.deleted_at is not None:
+    if not _is_live(user):
         return None
-    if session.last_seen_at is None or now - session.last_seen_at > SESSION_TOUCH_INTERVAL:
-        session.last_seen_at = now
-        session.expires_at = now + SESSION_LIFETIME
+    if _touch(session, now):
         db.commit()
+    _session_cache.put(token_hash, _snapshot(user), session.expires_at)
+    return user
+
+
+async def _lookup_user_async(request: Request, db: AsyncSession):
+    """_lookup_user on an AsyncSession."""
+    token = request.cookies.get(cookie_name())
+    if not token:
+        return None
+    now = _utcnow()
+    token_hash = _hash_token(token)
+    snapshot = _session_cache.get(token_hash, now)
+    if snapshot is not None:
+        return await db.merge(snapshot, load=False)
+    session = await db.get(AuthSession, token_hash)
+    if session is None or session.expires_at < now:
+        return None
+    user = await db.get(User, session.user_id)
+    if not _is_live(user):
+        return None
+    if _touch(session, now):
+        await db.commit()
+    _session_cache.put(token_hash, _snapshot(user), session.expires_at)
     return user
 
 
+def _is_live(user: User | None) -> bool:
+    return user is not None and user.disabled_at is None and user.deleted_at is None
+
+
+def _touch(session: AuthSession, now) -> bool:
+    """Extend the session if it was last extended long enough ago; True when
+    it changed and needs a commit."""
+    if session.last_seen_at is not None and now - session.last_seen_at <= SESSION_TOUCH_INTERVAL:
+        return False
+    session.last_seen_at = now
+    session.expires_at = now + SESSION_LIFETIME
+    return True
+
+
 def current_user(request: Request, db: OrmSession = Depends(get_db)) -> User:
     user = _lookup_user(request, db)
     if user is None:
@@ -123,3 +315,10 @@ def current_user(request: Request, db: OrmSession = Depends(get_db)) -> User:
 
 def current_user_optional(request: Request, db: OrmSession = Depends(get_db)) -> User | None:
     return _lookup_user(request, db)
+
+
+async def current_user_async(request: Request, db: AsyncSession = Depends(get_async_db)) -> User:
+    user = await _lookup_user_async(request, db)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return user
@@ -0,0 +1,24 @@
+"""Canonical JSON and the content hashes derived from it.
+
+One definition for every place that identifies a document by its content:
+saved designs (mas_hash), telemetry design dedup, and the plot cache keys.
+Keys are sorted and whitespace is dropped, so two documents hash alike
+exactly when they are equal as JSON, whatever their dict order or the Python
+repr of their values.
+"""
+import hashlib
+import json
+
+
+def canonical_json(document) -> str:
+    return json.dumps(document, sort_keys=True, separators=(",", ":"))
+
+
+def canonical_hash(document) -> str:
+    return hashlib.sha256(canonical_json(document).encode("utf-8")).hexdigest()
+
+
+def canonical_json_and_hash(document) -> tuple[str, str]:
+    """Both at the cost of one serialization, for callers that store the text."""
+    text = canonical_json(document)
+    return text, hashlib.sha256(text.encode("utf-8")).hexdigest()
@@ -0,0 +1,108 @@
+"""Offline generator of the catalog plot pack.
+
+Walks every standard core shape in the PyOpenMagnetics catalog whose family
+the FreeCAD builder knows, and renders what the frontend asks for about it:
+the piece (STL and STEP), its technical drawing, and for each gapping given,
+the assembled core (STL and STEP) and its gapping drawing. Results are written
+by the plot tasks themselves into a standalone SQLite file, so the keys are
+exactly the ones the API looks up.
+
+    python3 app/backend/catalog_bundle.py --output /cache/catalog-pack.db
+
+Point OM_PLOT_CACHE_PACK at the file and the API serves those requests from it
+read-only (see plot_cache.py). Rerunning against an existing output only builds
+what is missing, so an interrupted run can simply be restarted.
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+DEFAULT_MATERIAL = "N97"
+# One ungapped core per shape unless --gappings says otherwise.
+DEFAULT_GAPPINGS = [[{"type": "residual", "length": 0.00001}]]
+
+
+def catalog_shapes(families):
+    import PyOpenMagnetics
+    for name in PyOpenMagnetics.get_core_shape_names(False):
+        shape = PyOpenMagnetics.find_core_shape_by_name(name)
+        if shape.get("family") in families:
+            yield shape
+
+
+def assembled_core(shape, gapping, material):
+    import PyOpenMagnetics
+    core = {"functionalDescription": {"type": "two-piece set",
+                                      "material": material,
+                                      "shape": shape,
+                                      "gapping": gapping,
+                                      "numberStacks": 1}}
+    return PyOpenMagnetics.calculate_core_data(core, False)
+
+
+def build(output, gappings, material, limit=None):
+    # The plot tasks write through plot_cache's module-level store, which reads
+    # its location at import time: point it at the pack before importing them.
+    os.environ["OM_PLOT_CACHE_URL"] = f"sqlite:///{os.path.abspath(output)}"
+    os.environ.pop("OM_PLOT_CACHE_PACK", None)
+    sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+    import plot_cache
+    import plotter
+
+    done = failed = 0
+    started = time.monotonic()
+    for index, shape in enumerate(catalog_shapes(plotter.shape_families())):
+        if limit is not None and index >= limit:
+            break
+        jobs = [
+            (plotter.task_generate_core_shape, shape, (True,)),
+            (plotter.task_generate_core_technical_drawing, shape, ()),
+        ]
+        for gapping in gappings:
+            try:
+                core = assembled_core(shape, gapping, material)
+            except Exception as exc:
+                print(f"{shape['name']}: cannot assemble core with gapping {gapping}: {exc}")
+                failed += 1
+                continue
+            jobs.append((plotter.task_generate_core_3d_model, core, (True,)))
+            jobs.append((plotter.task_generate_gapping_technical_drawing, core, ()))
+
+        for task, data, extra in jobs:
+            try:
+                # The tasks normalize their input in place.
+                result = task(copy.deepcopy(data), plotter.temp_folder, *extra)
+            except Exception as exc:
+                result = None
+                print(f"{shape['name']}: {task.name} raised {exc}")
+            if result is None:
+                failed += 1
+            else:
+                done += 1
+        print(f"{index + 1}: {shape['name']} ({done} plots, {failed} failed, {time.monotonic() - started:.0f} s)")
+
+    plot_cache.finalize()
+    return {"plots": done, "failed": failed, "seconds": round(time.monotonic() - started)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", required=True, help="pack file to create or complete")
+    parser.add_argument("--gappings", help="JSON file with a list of MAS gapping arrays to render per shape")
+    parser.add_argument("--material", default=DEFAULT_MATERIAL,
+                        help="material of the assembled cores (does not change the geometry)")
+    parser.add_argument("--limit", type=int, help="only the first N shapes, for a quick check")
+    args = parser.parse_args()
+
+    gappings = DEFAULT_GAPPINGS
+    if args.gappings:
+        with open(args.gappings) as handle:
+            gappings = json.load(handle)
+    print(build(args.output, gappings, args.material, args.limit))
+
+
+if __name__ == "__main__":
+    main()
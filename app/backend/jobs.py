@@ -0,0 +1,343 @@
+"""Submit/poll/stream API for the FreeCAD plot tasks.
+
+A FreeCAD build can take tens of seconds, so instead of holding the request
+open a client submits a job (202 + job id), then polls its status, fetches the
+result once it is done, or listens for one server-sent completion event.
+
+Job ids are Celery task ids. The status endpoints may be served by a different
+uvicorn worker than the one that accepted the job, so multi-worker deployments
+need a shared result backend (OM_CELERY_BACKEND, e.g. redis://); the default
+rpc:// backend only delivers results to the submitting process (a warning is
+logged at startup when it is used with several workers), and its reads are
+serialized because its reply consumer is not thread-safe. When Celery is
+disabled or the broker is unreachable, jobs run in a small local thread pool
+instead and are only visible to the process that accepted them.
+
+The legacy blocking endpoints in api.py await the same jobs through
+`compute()`, which never blocks the event loop.
+
+Each job kind goes to one of two Celery queues with its own priority: what a
+user is looking at (3D views, drawings) is interactive, STEP files are
+downloads. A queue holding OM_PLOT_QUEUE_MAX_DEPTH jobs admits no more: submit
+answers 503 with Retry-After instead of letting the backlog grow without
+bound. A job that fails or times out is revoked on its own; nobody else's
+queued work is touched.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import kombu
+from celery.result import AsyncResult
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from plot_cache import PlotCacheTable
+from plotter import app as celery_app
+from plotter import CELERY_BACKEND, DOWNLOADS_QUEUE, INTERACTIVE_QUEUE, cache_key, queue_depth, temp_folder
+from plotter import use_celery
+from plotter import task_generate_core_3d_model, task_generate_core_shape
+from plotter import task_generate_core_technical_drawing, task_generate_gapping_technical_drawing
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+# job kind -> (Celery task, extra positional arguments after (payload, temp_folder))
+JOB_KINDS = {
+    "core_shape": (task_generate_core_shape, (True,)),
+    "core_shape_stp": (task_generate_core_shape, (False,)),
+    "core_3d_model": (task_generate_core_3d_model, (True,)),
+    "core_3d_model_stp": (task_generate_core_3d_model, (False,)),
+    "core_technical_drawing": (task_generate_core_technical_drawing, ()),
+    "gapping_technical_drawing": (task_generate_gapping_technical_drawing, ()),
+}
+
+# job kind -> (queue, priority); higher priorities are picked first.
+JOB_ROUTES = {
+    "core_3d_model": (INTERACTIVE_QUEUE, 9),
+    "core_shape": (INTERACTIVE_QUEUE, 8),
+    "core_technical_drawing": (INTERACTIVE_QUEUE, 7),
+    "gapping_technical_drawing": (INTERACTIVE_QUEUE, 7),
+    "core_3d_model_stp": (DOWNLOADS_QUEUE, 3),
+    "core_shape_stp": (DOWNLOADS_QUEUE, 3),
+}
+
+MAX_QUEUE_DEPTH = int(os.getenv("OM_PLOT_QUEUE_MAX_DEPTH", 100))
+RETRY_AFTER = int(os.getenv("OM_PLOT_QUEUE_RETRY_AFTER", 10))
+# Asking the broker on every submit would double its traffic; a second-old
+# depth is good enough to decide admission.
+QUEUE_DEPTH_TTL = 1.0
+
+RPC_BACKEND = CELERY_BACKEND.startswith("rpc")
+FINISHED_STATES = ("SUCCESS", "FAILURE", "REVOKED")
+
+POLL_INTERVAL = 0.1
+EVENTS_TIMEOUT = 120
+EVENTS_KEEPALIVE = 15
+MAX_LOCAL_JOBS = 256
+
+_local_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="plot-job")
+_local_lock = threading.Lock()
+_local_jobs = collections.OrderedDict()  # job_id -> Future, oldest first
+_submitted = collections.OrderedDict()   # job_id -> AsyncResult submitted by this process
+_queue_depths = {}                       # queue -> (monotonic time read, depth)
+_rpc_lock = threading.Lock()
+
+
+def check_result_backend():
+    """Warn when job results cannot reach every uvicorn worker: rpc:// only
+    answers the process that submitted the job, so polls served by another
+    one would see it pending until compute() gives up and revokes it."""
+    workers = int(os.getenv("WEB_CONCURRENCY", 1))
+    if use_celery and RPC_BACKEND and workers > 1:
+        logger.warning("OM_CELERY_BACKEND is %s with %d workers: jobs polled from another worker stay "
+                       "pending. Set a shared result backend such as redis://.", CELERY_BACKEND, workers)
+
+
+def cached_plot(kind: str, payload):
+    """The cached output for this request, or None. Lets the API answer a hit
+    without a Celery round trip or any validation of the request."""
+    try:
+        key = cache_key(kind, payload)
+    except (AttributeError, TypeError):
+        return None  # malformed request: the task reports it properly
+    return PlotCacheTable().read_plot(key)
+
+
+def _remember(registry: collections.OrderedDict, job_id: str, handle):
+    with _local_lock:
+        registry[job_id] = handle
+        while len(registry) > MAX_LOCAL_JOBS:
+            registry.popitem(last=False)
+
+
+def _queue_full():
+    raise HTTPException(status_code=503, detail="Too many plots queued, retry shortly",
+                        headers={"Retry-After": str(RETRY_AFTER)})
+
+
+def _admit(queue: str):
+    """503 when the broker queue is at its depth limit. An unreachable broker
+    admits everything: submit() then falls back to the local pool."""
+    now = time.monotonic()
+    with _local_lock:
+        read_at, depth = _queue_depths.get(queue, (None, None))
+    if read_at is None or now - read_at >= QUEUE_DEPTH_TTL:
+        try:
+            depth = queue_depth(queue)
+        except Exception:
+            # Broker down, or the queue not declared yet because no worker
+            # has started: nothing is waiting in it either way. Not asked
+            # again until the TTL runs out.
+            depth = None
+        with _local_lock:
+            _queue_depths[queue] = (now, depth)
+    if depth is None:
+        return
+    if depth >= MAX_QUEUE_DEPTH:
+        _queue_full()
+    with _local_lock:
+        # Count this job until the next broker read includes it.
+        _queue_depths[queue] = (_queue_depths[queue][0], depth + 1)
+
+
+def _submit_local(task, args) -> str:
+    with _local_lock:
+        waiting = sum(1 for future in _local_jobs.values() if not future.done())
+    if waiting >= MAX_QUEUE_DEPTH:
+        _queue_full()
+    job_id = f"local-{uuid.uuid4().hex}"
+    _remember(_local_jobs, job_id, _local_executor.submit(task, *args))
+    return job_id
+
+
+def submit(kind: str, payload) -> str:
+    """Queue one plot job and return its id. Falls back to the local pool when
+    Celery is disabled or the broker is down. Talks to the broker (queue depth,
+    publishing), so async callers run it in the threadpool."""
+    if kind not in JOB_KINDS:
+        raise HTTPException(status_code=404, detail=f"Unknown job kind {kind!r}")
+    task, extra = JOB_KINDS[kind]
+    queue, priority = JOB_ROUTES[kind]
+    args = (payload, temp_folder) + extra
+    if not use_celery:
+        return _submit_local(task, args)
+    _admit(queue)
+    try:
+        result = task.apply_async(args, queue=queue, routing_key=queue, priority=priority)
+    except kombu.exceptions.OperationalError:
+        return _submit_local(task, args)
+    _remember(_submitted, result.id, result)
+    return result.id
+
+
+def status(job_id: str):
+    """(state, value) with state one of pending/running/done/failed. value is
+    the task result for done jobs and an error message for failed ones."""
+    if job_id.startswith("local-"):
+        with _local_lock:
+            future = _local_jobs.get(job_id)
+        if future is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if not future.done():
+            return ("running" if future.running() else "pending"), None
+        if future.exception() is not None:
+            return "failed", str(future.exception())
+        value = future.result()
+        return ("done", value) if value is not None else ("failed", "Wrong dimensions")
+
+    with _local_lock:
+        result = _submitted.get(job_id)
+    if result is None:
+        result = AsyncResult(job_id, app=celery_app)
+    state, value = _celery_state(result)
+    if state == "SUCCESS":
+        return ("done", value) if value is not None else ("failed", "Wrong dimensions")
+    if state in ("FAILURE", "REVOKED"):
+        return "failed", str(value)
+    if state in ("STARTED", "RETRY"):
+        return "running", None
+    return "pending", None
+
+
+def _celery_state(result):
+    """(state, result) of a Celery task; result only once it has finished.
+    The rpc:// backend reads replies off one channel of this process and is
+    not thread-safe, so with it threadpool callers take turns."""
+    with _rpc_lock if RPC_BACKEND else contextlib.nullcontext():
+        state = result.state
+        return state, (result.result if state in FINISHED_STATES else None)
+
+
+async def status_async(job_id: str):
+    """status() for async callers: reading a Celery state is a round trip to
+    the result backend, so it runs in the threadpool. Local jobs are answered
+    in place."""
+    if job_id.startswith("local-"):
+        return status(job_id)
+    return await run_in_threadpool(status, job_id)
+
+
+async def wait_for(job_id: str, timeout: float):
+    """Await a job without blocking the event loop. Returns (state, value);
+    state stays pending/running when the timeout expires first."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        state, value = await status_async(job_id)
+        if state in ("done", "failed") or loop.time() >= deadline:
+            return state, value
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+def revoke(job_id: str):
+    """Drop one job: cancelled if it has not started, its result ignored if
+    it has. Other jobs in the queue are untouched."""
+    if job_id.startswith("local-"):
+        with _local_lock:
+            future = _local_jobs.pop(job_id, None)
+        if future is not None:
+            future.cancel()
+        return
+    with _local_lock:
+        _submitted.pop(job_id, None)
+    try:
+        celery_app.control.revoke(job_id)
+    except kombu.exceptions.OperationalError:
+        pass
+
+
+async def compute(kind: str, payload, number_retries: int = 5, timeout: float = 10):
+    """What the legacy endpoints used to do with result.get(), as one job:
+    wait up to number_retries * timeout seconds for it, resubmitting only when
+    the connection to the broker drops. A failed build is not retried (the
+    same request fails the same way), and a job still unfinished at the end
+    is revoked. Returns the task result, or None."""
+    job_id = None
+    for retry in range(number_retries):
+        try:
+            if job_id is None:
+                job_id = await run_in_threadpool(submit, kind, payload)
+            state, value = await wait_for(job_id, timeout)
+        except ConnectionResetError:
+            job_id = None
+            continue
+        if state == "done":
+            return value
+        if state == "failed":
+            return None
+        print(f"Still waiting for {kind} job {job_id}")
+    if job_id is not None:
+        revoke(job_id)
+    return None
+
+
+def _status_payload(job_id: str, state: str, value) -> dict:
+    payload = {"job_id": job_id, "status": state}
+    if state == "failed":
+        payload["detail"] = value
+    return payload
+
+
+@router.post("/{kind}", status_code=202, include_in_schema=False)
+async def submit_job(kind: str, request: Request):
+    job_id = await run_in_threadpool(submit, kind, await request.json())
+    return {
+        "job_id": job_id,
+        "status": "pending",
+        "status_url": f"/jobs/{job_id}",
+        "result_url": f"/jobs/{job_id}/result",
+        "events_url": f"/jobs/{job_id}/events",
+    }
+
+
+@router.get("/{job_id}", include_in_schema=False)
+def job_status(job_id: str):
+    state, value = status(job_id)
+    return _status_payload(job_id, state, value)
+
+
+@router.get("/{job_id}/result", include_in_schema=False)
+def job_result(job_id: str):
+    state, value = status(job_id)
+    if state == "done":
+        return value
+    if state == "failed":
+        # Same contract as the blocking endpoints: a build that produced
+        # nothing means the dimensions were wrong.
+        raise HTTPException(status_code=418, detail=value or "Wrong dimensions")
+    return JSONResponse(status_code=202, content=_status_payload(job_id, state, value))
+
+
+@router.get("/{job_id}/events", include_in_schema=False)
+async def job_events(job_id: str):
+    """Server-sent events: keepalive comments while the job runs, then one
+    `done` or `failed` event. Clients fetch the result from result_url."""
+    await status_async(job_id)  # 404 before the stream starts
+
+    async def stream():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        last_sent = started
+        while loop.time() - started < EVENTS_TIMEOUT:
+            state, value = await status_async(job_id)
+            if state in ("done", "failed"):
+                yield f"event: {state}\ndata: {json.dumps(_status_payload(job_id, state, value))}\n\n"
+                return
+            if loop.time() - last_sent >= EVENTS_KEEPALIVE:
+                last_sent = loop.time()
+                yield ": keepalive\n\n"
+            await asyncio.sleep(POLL_INTERVAL * 5)
+        yield f"event: timeout\ndata: {json.dumps({'job_id': job_id})}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
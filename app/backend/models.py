@@ -2,14 +2,16 @@ import sqlalchemy
 from sqlalchemy.ext.automap import automap_base
 import os
 from pydantic import BaseModel
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, String
 import datetime
+import io
+import uuid
 from typing import Optional
-import json
-import hashlib
-from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.orm.exc import MultipleResultsFound
+
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+
+from .accounts.db import get_engine
+from .canonical import canonical_hash, canonical_json_and_hash
 
 
 class BugReport(BaseModel):
@@ -64,118 +66,192 @@ class BugReportsTable(Database):
         return bug_report_id
 
 
-class TelemetryTable(Database):
+telemetry_metadata = sqlalchemy.MetaData(schema="telemetry")
+
+# Bulk loads COPY into telemetry.events_staging (created by migration 0007),
+# then merge set-based into the real tables.
+TELEMETRY_STAGING_COLUMNS = ("batch_id", "ord", "session_id", "environment", "app_version", "event_type",
+                             "source", "stage", "mas_hash", "topology", "mas_version", "mas_data",
+                             "result_count", "error_message")
+
+TELEMETRY_MERGE = (
+    # Same semantics as record_many: first occurrence of a session or design
+    # in the batch wins, existing sessions get last_seen bumped.
+    """INSERT INTO telemetry.sessions (session_id, environment, app_version)
+       SELECT DISTINCT ON (session_id) session_id, environment, app_version
+       FROM telemetry.events_staging WHERE batch_id = :batch ORDER BY session_id, ord
+       ON CONFLICT (session_id) DO UPDATE SET last_seen = NOW()""",
+    """INSERT INTO telemetry.designs (mas_hash, topology, mas_version, mas_data)
+       SELECT DISTINCT ON (mas_hash) mas_hash, topology, mas_version, mas_data
+       FROM telemetry.events_staging WHERE batch_id = :batch AND mas_data IS NOT NULL ORDER BY mas_hash, ord
+       ON CONFLICT (mas_hash) DO NOTHING""",
+    """INSERT INTO telemetry.events (session_id, event_type, source, stage, design_id, result_count, error_message)
+       SELECT s.session_id, s.event_type, s.source, s.stage, d.design_id, s.result_count, s.error_message
+       FROM telemetry.events_staging s LEFT JOIN telemetry.designs d ON d.mas_hash = s.mas_hash
+       WHERE s.batch_id = :batch ORDER BY s.ord""",
+    "DELETE FROM telemetry.events_staging WHERE batch_id = :batch",
+)
+
+
+def _copy_text(value):
+    """One field in COPY's text format."""
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+# Only the columns the ingestion path writes. The core tables are managed
+# outside this repo; the hand-written migrations only partition events (0002)
+# and add the tables the loaders and rollups use (0007 onwards).
+telemetry_sessions = sqlalchemy.Table(
+    "sessions", telemetry_metadata,
+    sqlalchemy.Column("session_id", sqlalchemy.String, primary_key=True),
+    sqlalchemy.Column("environment", sqlalchemy.String),
+    sqlalchemy.Column("app_version", sqlalchemy.String),
+    sqlalchemy.Column("last_seen", sqlalchemy.DateTime(timezone=True)),
+)
+
+telemetry_designs = sqlalchemy.Table(
+    "designs", telemetry_metadata,
+    sqlalchemy.Column("design_id", sqlalchemy.BigInteger, primary_key=True),
+    sqlalchemy.Column("mas_hash", sqlalchemy.String, unique=True),
+    sqlalchemy.Column("topology", sqlalchemy.String),
+    sqlalchemy.Column("mas_version", sqlalchemy.String),
+    sqlalchemy.Column("mas_data", JSONB),
+)
+
+telemetry_events = sqlalchemy.Table(
+    "events", telemetry_metadata,
+    sqlalchemy.Column("event_id", sqlalchemy.BigInteger, primary_key=True),
+    sqlalchemy.Column("session_id", sqlalchemy.String),
+    sqlalchemy.Column("event_type", sqlalchemy.String),
+    sqlalchemy.Column("source", sqlalchemy.String),
+    sqlalchemy.Column("stage", sqlalchemy.String),
+    sqlalchemy.Column("design_id", sqlalchemy.BigInteger),
+    sqlalchemy.Column("result_count", sqlalchemy.Integer),
+    sqlalchemy.Column("error_message", sqlalchemy.String),
+)
+
+
+class TelemetryTable:
     """Normalised design telemetry as a small star schema in the `telemetry`
     Postgres schema: one `sessions` row per browser tab, deduplicated MAS
     payloads in `designs` (keyed by content hash), and a thin `events` stream
     that references both. Lets us analyse which topologies, inputs and magnetic
     designs people actually use, and tell intermediate working state apart from
-    finished designs via `events.stage` ('intermediate' | 'final')."""
+    finished designs via `events.stage` ('intermediate' | 'final').
 
-    def connect(self):
-        driver = "postgresql"
-        address = os.getenv('OM_DB_ADDRESS')
-        port = os.getenv('OM_DB_PORT')
-        name = os.getenv('OM_DB_NAME')
-        user = os.getenv('OM_DB_USER')
-        password = os.getenv('OM_DB_PASSWORD')
-        self.engine = sqlalchemy.create_engine(f"{driver}://{user}:{password}@{address}:{port}/{name}")
-
-    def disconnect(self):
-        self.engine.dispose()
+    Writes go through the pooled accounts engine, a batch at a time (see
+    telemetry_buffer.py for the batching): record_many issues one multi-row
+    statement per table; load_many, used by the API, COPYs the batch into an
+    unlogged staging table and merges it from there."""
 
     def record(self, session_id, event_type, source, stage=None, environment='production',
                app_version=None, mas_data=None, topology=None, mas_version=None,
                result_count=None, error_message=None):
-        self.connect()
-        try:
-            with self.engine.begin() as conn:
-                # 1. Upsert the session. first_seen/last_seen use server-side NOW()
-                #    so timestamps are always full-precision (date + time).
-                conn.execute(sqlalchemy.text(
-                    "INSERT INTO telemetry.sessions (session_id, environment, app_version) "
-                    "VALUES (:sid, :env, :ver) "
-                    "ON CONFLICT (session_id) DO UPDATE SET last_seen = NOW()"),
-                    {"sid": session_id, "env": environment, "ver": app_version})
-
-                # 2. Dedup-upsert the design payload (if any). Identical MAS across
-                #    several events stores ONE design row, referenced many times.
-                design_id = None
-                if mas_data is not None:
-                    canonical = json.dumps(mas_data, sort_keys=True, separators=(',', ':'))
-                    mas_hash = hashlib.sha256(canonical.encode('utf-8')).hexdigest()
-                    row = conn.execute(sqlalchemy.text(
-                        "INSERT INTO telemetry.designs (mas_hash, topology, mas_version, mas_data) "
-                        "VALUES (:hash, :topo, :mver, CAST(:mas AS JSONB)) "
-                        "ON CONFLICT (mas_hash) DO UPDATE SET mas_hash = EXCLUDED.mas_hash "
-                        "RETURNING design_id"),
-                        {"hash": mas_hash, "topo": topology, "mver": mas_version,
-                         "mas": json.dumps(mas_data)}).fetchone()
-                    design_id = row[0]
-
-                # 3. Append the event.
-                conn.execute(sqlalchemy.text(
-                    "INSERT INTO telemetry.events "
-                    "(session_id, event_type, source, stage, design_id, result_count, error_message) "
-                    "VALUES (:sid, :etype, :src, :stage, :did, :rc, :err)"),
-                    {"sid": session_id, "etype": event_type, "src": source, "stage": stage,
-                     "did": design_id, "rc": result_count, "err": error_message})
-        finally:
-            self.disconnect()
-
-
-class PlotCacheTable(Database):
-    def connect(self):
-        self.engine = sqlalchemy.create_engine("sqlite:////cache/cache.db", isolation_level="AUTOCOMMIT")
-
-        Base = declarative_base()
-
-        class PlotCache(Base):
-            __tablename__ = 'plot_cache'
-            hash = Column(String, primary_key=True)
-            data = Column(String)
-            created_at = Column(String)
-
-        # Create all tables in the engine
-        Base.metadata.create_all(self.engine)
+        self.record_many([{
+            "session_id": session_id, "event_type": event_type, "source": source, "stage": stage,
+            "environment": environment, "app_version": app_version, "mas_data": mas_data,
+            "topology": topology, "mas_version": mas_version, "result_count": result_count,
+            "error_message": error_message,
+        }])
 
-        metadata = sqlalchemy.MetaData()
-        metadata.reflect(self.engine, )
-        Base = automap_base(metadata=metadata)
-        Base.prepare()
+    def design_exists(self, mas_hash):
+        with get_engine().connect() as conn:
+            return conn.execute(sqlalchemy.select(sqlalchemy.literal(1))
+                                .where(telemetry_designs.c.mas_hash == mas_hash)).first() is not None
 
-        Session = sqlalchemy.orm.sessionmaker(bind=self.engine)
-        self.session = Session()
-        self.Table = Base.classes.plot_cache
+    def load_many(self, events):
+        """Bulk variant of record_many for large batches: COPY the events
+        into telemetry.events_staging, then merge them into sessions, designs
+        and events with three set-based statements, all in one transaction."""
+        if not events:
+            return
+        engine = get_engine()
+        batch_id = str(uuid.uuid4())
+        rows = io.StringIO()
+        for position, event in enumerate(events):
+            # An event may reference a design by mas_hash alone (the hash
+            # handshake of POST /telemetry); the API may also have serialized
+            # the document already (mas_document).
+            mas_hash = event.get("mas_hash")
+            mas_document = event.get("mas_document")
+            if event.get("mas_data") is not None and mas_document is None:
+                mas_document, mas_hash = canonical_json_and_hash(event["mas_data"])
+            fields = (batch_id, position, event["session_id"], event.get("environment", "production"),
+                      event.get("app_version"), event["event_type"], event["source"], event.get("stage"),
+                      mas_hash, event.get("topology"), event.get("mas_version"), mas_document,
+                      event.get("result_count"), event.get("error_message"))
+            rows.write("\t".join(_copy_text(field) for field in fields))
+            rows.write("\n")
+        rows.seek(0)
 
-    def insert_plot(self, hash, data):
-        try:
-            self.connect()
-        except sqlalchemy.exc.OperationalError:
-            return False
-        data = {
-            'hash': hash,
-            'data': data,
-            'created_at': datetime.datetime.now(),
-        }
-        row = self.Table(**data)
-        self.session.add(row)
-        self.session.flush()
-        self.session.commit()
-        self.disconnect()
-        return True
-
-    def read_plot(self, hash):
-        try:
-            self.connect()
-        except sqlalchemy.exc.OperationalError:
-            return None
-        query = self.session.query(self.Table).filter(self.Table.hash == hash)
-        try:
-            data = query.one().data
-        except MultipleResultsFound:
-            data = None
-        except NoResultFound:
-            data = None
-        self.disconnect()
-        return data
+        with engine.begin() as conn:
+            cursor = conn.connection.cursor()
+            try:
+                cursor.copy_expert(f"COPY telemetry.events_staging ({', '.join(TELEMETRY_STAGING_COLUMNS)}) "
+                                   "FROM STDIN", rows)
+            finally:
+                cursor.close()
+            for statement in TELEMETRY_MERGE:
+                conn.execute(sqlalchemy.text(statement), {"batch": batch_id})
+
+    def record_many(self, events):
+        """Insert a batch of events (dicts with the keyword arguments of
+        record()) in one transaction."""
+        if not events:
+            return
+        # ON CONFLICT may not touch one row twice in a statement, so sessions
+        # and designs are deduplicated here; the first occurrence wins, as it
+        # did when events were written one by one.
+        sessions = {}
+        designs = {}
+        hashes = []
+        for event in events:
+            sessions.setdefault(event["session_id"], {
+                "session_id": event["session_id"],
+                "environment": event.get("environment", "production"),
+                "app_version": event.get("app_version"),
+            })
+            mas_hash = event.get("mas_hash")
+            if event.get("mas_data") is not None:
+                mas_hash = event.get("mas_hash") or canonical_hash(event["mas_data"])
+                designs.setdefault(mas_hash, {
+                    "mas_hash": mas_hash,
+                    "topology": event.get("topology"),
+                    "mas_version": event.get("mas_version"),
+                    "mas_data": event["mas_data"],
+                })
+            hashes.append(mas_hash)
+
+        with get_engine().begin() as conn:
+            # 1. Upsert the sessions. first_seen/last_seen use server-side NOW()
+            #    so timestamps are always full-precision (date + time).
+            statement = postgresql_insert(telemetry_sessions).values(list(sessions.values()))
+            conn.execute(statement.on_conflict_do_update(
+                index_elements=["session_id"], set_={"last_seen": sqlalchemy.func.now()}))
+
+            # 2. Dedup-upsert the design payloads. Identical MAS across several
+            #    events stores ONE design row, referenced many times.
+            design_ids = {}
+            if designs:
+                statement = postgresql_insert(telemetry_designs).values(list(designs.values()))
+                statement = statement.on_conflict_do_update(
+                    index_elements=["mas_hash"], set_={"mas_hash": statement.excluded.mas_hash})
+                rows = conn.execute(statement.returning(telemetry_designs.c.mas_hash,
+                                                        telemetry_designs.c.design_id))
+                design_ids = {row.mas_hash: row.design_id for row in rows}
+            referenced = {mas_hash for mas_hash in hashes if mas_hash is not None and mas_hash not in design_ids}
+            if referenced:
+                rows = conn.execute(sqlalchemy.select(telemetry_designs.c.mas_hash, telemetry_designs.c.design_id)
+                                    .where(telemetry_designs.c.mas_hash.in_(referenced)))
+                design_ids.update({row.mas_hash: row.design_id for row in rows})
+
+            # 3. Append the events.
+            conn.execute(postgresql_insert(telemetry_events).values([
+                {"session_id": event["session_id"], "event_type": event["event_type"],
+                 "source": event["source"], "stage": event.get("stage"),
+                 "design_id": design_ids.get(mas_hash), "result_count": event.get("result_count"),
+                 "error_message": event.get("error_message")}
+                for event, mas_hash in zip(events, hashes)]))
@@ -0,0 +1,383 @@
+"""Two-tier cache for generated plots (STL/STEP models, technical drawings).
+
+Tier 1 is a per-process LRU bounded by payload bytes, so repeated lookups of
+the same model never leave the worker. Tier 2 is the SQLite file shared by
+every worker on the host (/cache/cache.db by default, OM_PLOT_CACHE_URL to
+override). The SQLite engine is created once per process — after fork, so the
+Celery prefork children never share a connection with their parent — and the
+table is declared statically: no per-call engine, create_all or reflection.
+
+Both tiers keep hit/miss/eviction counters; `stats()` returns them.
+
+The SQLite file is bounded by `compact()` (run periodically by the Celery beat
+task in plotter.py): rows older than OM_PLOT_CACHE_MAX_AGE_DAYS go first, then
+least-recently-accessed rows until the payloads fit OM_PLOT_CACHE_MAX_BYTES,
+then VACUUM returns the freed pages to the filesystem. Access times are
+buffered in memory and written in batches, so a cache hit costs no write.
+
+Payloads are raw bytes tagged with a content type (model/stl, model/step,
+application/json for drawing views), compressed on disk with zstd when the
+optional `zstandard` package is installed and zlib otherwise. The memory tier
+holds them decompressed so a hit costs nothing but a dict lookup. Rows written
+by older versions (base64 / repr text) are dropped when the file is upgraded.
+
+A read-only catalog pack (OM_PLOT_CACHE_PACK, built offline by
+catalog_bundle.py) can sit between the two tiers. It holds every standard
+catalog shape already rendered, in the same table layout, and is never written
+to or compacted, so catalog requests cost no FreeCAD work and no cache writes.
+
+If the SQLite file cannot be opened the cache degrades to memory only, as the
+old PlotCacheTable did (a read miss, an insert that returns False).
+"""
+import collections
+import datetime
+import os
+import threading
+import time
+import zlib
+from typing import NamedTuple
+
+import sqlalchemy
+from sqlalchemy import Column, Float, Integer, LargeBinary, MetaData, String, Table
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+try:
+    import zstandard
+except ImportError:  # optional: zlib is always available
+    zstandard = None
+
+DEFAULT_URL = "sqlite:////cache/cache.db"
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_MAX_AGE_DAYS = 90
+# Compaction shrinks to this fraction of max_bytes so it does not run again
+# after the very next insert.
+COMPACT_LOW_WATERMARK = 0.9
+ACCESS_FLUSH_ROWS = 200
+ACCESS_FLUSH_SECONDS = 30
+
+CONTENT_TYPES = {
+    "stl": "model/stl",
+    "step": "model/step",
+    "json": "application/json",
+}
+
+metadata = MetaData()
+
+plot_cache = Table(
+    "plot_cache", metadata,
+    Column("hash", String, primary_key=True),
+    Column("payload", LargeBinary),
+    Column("content_type", String),
+    Column("encoding", String),                  # 'zstd' | 'zlib'
+    Column("created_at", String),
+    Column("last_access", Float, index=True),    # epoch seconds
+    Column("size", Integer),                     # bytes of payload (compressed)
+)
+
+# Columns added after the first cache files were written; ALTERed in on open.
+_ADDED_COLUMNS = {
+    "payload": "BLOB",
+    "content_type": "VARCHAR",
+    "encoding": "VARCHAR",
+    "last_access": "FLOAT",
+    "size": "INTEGER",
+}
+
+
+class CachedPlot(NamedTuple):
+    content_type: str
+    body: bytes
+
+
+def _compress(body: bytes):
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(body), "zstd"
+    return zlib.compress(body, 6), "zlib"
+
+
+def _decompress(payload: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Plot cache row is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return zlib.decompress(payload)
+
+
+class MemoryLRU:
+    """Least-recently-used map bounded by the total size of its values."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size: int):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class SQLitePlotStore:
+    """The shared on-disk tier: one pooled engine per process. With
+    readonly=True the file is opened as-is and never written (the pack)."""
+
+    def __init__(self, url: str, readonly: bool = False):
+        self.url = url
+        self.readonly = readonly
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.expired = 0
+        self.evicted = 0
+        self._engine = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._pending_access = {}
+        self._last_access_flush = time.monotonic()
+
+    def engine(self):
+        with self._lock:
+            if self._engine is None or self._pid != os.getpid():
+                if self.readonly:
+                    self._engine = self._readonly_engine()
+                    self._pid = os.getpid()
+                    return self._engine
+                engine = sqlalchemy.create_engine(self.url, connect_args={"check_same_thread": False, "timeout": 30})
+
+                @sqlalchemy.event.listens_for(engine, "connect")
+                def _set_pragmas(dbapi_connection, connection_record):
+                    # WAL lets the API and every Celery worker read while one writes.
+                    cursor = dbapi_connection.cursor()
+                    cursor.execute("PRAGMA journal_mode=WAL")
+                    cursor.close()
+
+                metadata.create_all(engine)
+                self._upgrade_schema(engine)
+                self._engine = engine
+                self._pid = os.getpid()
+                self._pending_access = {}
+                self._last_access_flush = time.monotonic()
+            return self._engine
+
+    def _readonly_engine(self):
+        path = sqlalchemy.engine.make_url(self.url).database
+        if not os.path.exists(path):
+            raise sqlalchemy.exc.OperationalError(f"open {path}", {}, FileNotFoundError(path))
+        return sqlalchemy.create_engine(f"sqlite:///file:{path}?mode=ro&uri=true",
+                                        connect_args={"check_same_thread": False})
+
+    @staticmethod
+    def _upgrade_schema(engine):
+        """Bring cache files written by older versions up to the current table.
+        Their text rows cannot be served as binary payloads, so they go."""
+        with engine.begin() as conn:
+            columns = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(plot_cache)")}
+            for name, ddl_type in _ADDED_COLUMNS.items():
+                if name not in columns:
+                    conn.exec_driver_sql(f"ALTER TABLE plot_cache ADD COLUMN {name} {ddl_type}")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_plot_cache_last_access ON plot_cache (last_access)")
+            if "payload" not in columns:
+                conn.exec_driver_sql("DELETE FROM plot_cache WHERE payload IS NULL")
+
+    def touch(self, key):
+        """Record an access; written to disk in batches by flush_access()."""
+        if self.readonly:
+            return
+        with self._lock:
+            self._pending_access[key] = time.time()
+            due = (len(self._pending_access) >= ACCESS_FLUSH_ROWS
+                   or time.monotonic() - self._last_access_flush >= ACCESS_FLUSH_SECONDS)
+        if due:
+            self.flush_access()
+
+    def flush_access(self):
+        with self._lock:
+            pending, self._pending_access = self._pending_access, {}
+            self._last_access_flush = time.monotonic()
+        if not pending:
+            return
+        statement = (plot_cache.update()
+                     .where(plot_cache.c.hash == sqlalchemy.bindparam("key"))
+                     .values(last_access=sqlalchemy.bindparam("at")))
+        try:
+            with self.engine().begin() as conn:
+                conn.execute(statement, [{"key": key, "at": at} for key, at in pending.items()])
+        except sqlalchemy.exc.OperationalError:
+            self.errors += 1
+
+    def get(self, key) -> CachedPlot | None:
+        try:
+            with self.engine().connect() as conn:
+                row = conn.execute(sqlalchemy.select(plot_cache.c.payload, plot_cache.c.content_type,
+                                                     plot_cache.c.encoding)
+                                   .where(plot_cache.c.hash == key)).first()
+        except sqlalchemy.exc.OperationalError:
+            self.errors += 1
+            return None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.touch(key)
+        return CachedPlot(row.content_type, _decompress(row.payload, row.encoding))
+
+    def put(self, key, plot: CachedPlot) -> bool:
+        if self.readonly:
+            return False
+        now = time.time()
+        payload, encoding = _compress(plot.body)
+        columns = {"payload": payload, "content_type": plot.content_type, "encoding": encoding,
+                   "last_access": now, "size": len(payload)}
+        statement = (sqlite_insert(plot_cache)
+                     .values(hash=key, created_at=str(datetime.datetime.now()), **columns)
+                     .on_conflict_do_update(index_elements=[plot_cache.c.hash], set_=columns))
+        try:
+            with self.engine().begin() as conn:
+                conn.execute(statement)
+        except sqlalchemy.exc.OperationalError:
+            self.errors += 1
+            return False
+        return True
+
+    def compact(self, max_bytes: int, max_age_days: float) -> dict:
+        """Drop expired rows, then least-recently-accessed rows until the
+        payloads fit in max_bytes, then VACUUM if anything was deleted."""
+        self.flush_access()
+        engine = self.engine()
+        cutoff = str(datetime.datetime.now() - datetime.timedelta(days=max_age_days))
+        with engine.begin() as conn:
+            expired = conn.execute(plot_cache.delete().where(plot_cache.c.created_at < cutoff)).rowcount
+            total = conn.execute(sqlalchemy.select(sqlalchemy.func.coalesce(
+                sqlalchemy.func.sum(plot_cache.c.size), 0))).scalar()
+            evicted = 0
+            if total > max_bytes:
+                target = int(max_bytes * COMPACT_LOW_WATERMARK)
+                victims = []
+                rows = conn.execute(sqlalchemy.select(plot_cache.c.hash, plot_cache.c.size)
+                                    .order_by(sqlalchemy.func.coalesce(plot_cache.c.last_access, 0))).all()
+                for row in rows:
+                    if total <= target:
+                        break
+                    victims.append(row.hash)
+                    total -= row.size or 0
+                for start in range(0, len(victims), 500):
+                    conn.execute(plot_cache.delete().where(plot_cache.c.hash.in_(victims[start:start + 500])))
+                evicted = len(victims)
+        vacuumed = False
+        if expired or evicted:
+            try:
+                with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                    conn.exec_driver_sql("VACUUM")
+                vacuumed = True
+            except sqlalchemy.exc.OperationalError:
+                # Another worker holds a transaction; the next run retries.
+                self.errors += 1
+        self.expired += expired
+        self.evicted += evicted
+        return {"expired": expired, "evicted": evicted, "bytes": total, "vacuumed": vacuumed}
+
+    def finalize(self):
+        """Make the file safe to ship and open read-only: fold the WAL back
+        into the main file and leave it in rollback-journal mode."""
+        self.flush_access()
+        with self.engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("VACUUM")
+            conn.exec_driver_sql("PRAGMA journal_mode=DELETE")
+        self.engine().dispose()
+        self._engine = None
+
+    def stats(self) -> dict:
+        return {"url": self.url, "hits": self.hits, "misses": self.misses, "errors": self.errors,
+                "expired": self.expired, "evicted": self.evicted}
+
+
+_memory = MemoryLRU(int(os.getenv("OM_PLOT_CACHE_MEMORY_BYTES", DEFAULT_MEMORY_BYTES)))
+_store = SQLitePlotStore(os.getenv("OM_PLOT_CACHE_URL", DEFAULT_URL))
+_pack = (SQLitePlotStore(f"sqlite:///{os.getenv('OM_PLOT_CACHE_PACK')}", readonly=True)
+         if os.getenv("OM_PLOT_CACHE_PACK") else None)
+
+
+def load_pack() -> dict | None:
+    """Open the catalog pack now rather than on the first request; called at
+    API startup. Returns the number of plots in it, None without a pack."""
+    if _pack is None:
+        return None
+    try:
+        with _pack.engine().connect() as conn:
+            plots = conn.execute(sqlalchemy.select(sqlalchemy.func.count()).select_from(plot_cache)).scalar()
+    except sqlalchemy.exc.OperationalError:
+        _pack.errors += 1
+        return {"url": _pack.url, "plots": 0, "available": False}
+    return {"url": _pack.url, "plots": plots, "available": True}
+
+
+def stats() -> dict:
+    result = {"memory": _memory.stats(), "sqlite": _store.stats()}
+    if _pack is not None:
+        result["pack"] = _pack.stats()
+    return result
+
+
+def compact() -> dict:
+    return _store.compact(int(os.getenv("OM_PLOT_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+                          float(os.getenv("OM_PLOT_CACHE_MAX_AGE_DAYS", DEFAULT_MAX_AGE_DAYS)))
+
+
+def finalize():
+    """Close the SQLite tier as a finished file (see SQLitePlotStore.finalize);
+    used by catalog_bundle.py once the pack is built."""
+    _store.finalize()
+
+
+class PlotCacheTable:
+    """Entry point for the plot tasks; instances are free to create, all
+    state lives in the module-level tiers above."""
+
+    def read_plot(self, hash) -> CachedPlot | None:
+        plot = _memory.get(hash)
+        if plot is not None:
+            _store.touch(hash)
+            return plot
+        if _pack is not None:
+            plot = _pack.get(hash)
+            if plot is not None:
+                _memory.put(hash, plot, len(plot.body))
+                return plot
+        plot = _store.get(hash)
+        if plot is not None:
+            _memory.put(hash, plot, len(plot.body))
+        return plot
+
+    def insert_plot(self, hash, content_type: str, body: bytes):
+        plot = CachedPlot(content_type, body)
+        _memory.put(hash, plot, len(body))
+        return _store.put(hash, plot)
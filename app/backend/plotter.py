@@ -1,143 +1,337 @@
-import copy
-import sys
-import os
-import hashlib
-import time
-import ast
-import base64
-sys.path.append(os.path.abspath(os.path.dirname(__file__)))
-from mas_models import MagneticCore, CoreShape
-from celery import Celery
-# sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../MVB/src/OpenMagneticsVirtualBuilder')))
-from OpenMagneticsVirtualBuilder.builder import Builder as ShapeBuilder  # noqa: E402
-from models import PlotCacheTable
-
-app = Celery('plots', backend='rpc://', broker='pyamqp://guest@localhost//')
-
-
-def purge_queue():
-    print("Purging queue")
-    app.control.purge()
-
-
-def clean_dimensions(core):
-    # Make sure no unwanted dimension gets in
-    families = ShapeBuilder("FreeCAD").get_families()
-    if "familySubtype" in core['functionalDescription']['shape'] and core['functionalDescription']['shape']['familySubtype'] is not None:
-        dimensions = families[core['functionalDescription']['shape']['family']][int(core['functionalDescription']['shape']['familySubtype'])]
-    else:
-        dimensions = families[core['functionalDescription']['shape']['family']][1]
-    aux = copy.deepcopy(core['functionalDescription']['shape']['dimensions'])
-    for key, value in core['functionalDescription']['shape']['dimensions'].items():
-        if key not in dimensions:
-            aux.pop(key)
-    core['functionalDescription']['shape']['dimensions'] = aux
-    return core
-
-
-@app.task
-def task_generate_core_3d_model(core, temp_folder, stl_or_not_step=True):
-    if 'familySubtype' in core['functionalDescription']['shape']:
-        core['functionalDescription']['shape']['familySubtype'] = str(core['functionalDescription']['shape']['familySubtype'])
-
-    core = MagneticCore(**core)
-    core = core.dict()
-
-    core = clean_dimensions(core)
-    if not isinstance(core['functionalDescription']['material'], str):
-        core['functionalDescription']['material'] = core['functionalDescription']['material']['name']
-
-    # pprint.pprint(core)
-    aux = {
-        "core": core,
-    }
-    hash_value = hashlib.sha256(str(aux).encode()).hexdigest()
-    cache = PlotCacheTable()
-
-    cached_datum = cache.read_plot(hash_value)
-    if cached_datum is not None:
-        print("Hit in cache!")
-        return cached_datum
-
-    step_path, stl_path = ShapeBuilder("FreeCAD").get_core(project_name=hash_value,
-                                                           geometrical_description=core['geometricalDescription'],
-                                                           output_path=f"{temp_folder}/cores")
-    path = stl_path if stl_or_not_step else step_path
-
-    print(path)
-    if path is None:
-        return None
-
-    with open(path, "rb") as stl:
-        data = stl.read()
-        data = base64.b64encode(data).decode('utf-8')
-        cache.insert_plot(hash_value, data)
-        return data
-
-
-@app.task
-def task_generate_core_technical_drawing(data, temp_folder):
-    if 'familySubtype' in data:
-        data['familySubtype'] = str(data['familySubtype'])
-
-    coreShape = CoreShape(**data)
-    coreShape = coreShape.dict()
-    aux = {
-        "coreShape": coreShape,
-    }
-    hash_value = hashlib.sha256(str(aux).encode()).hexdigest()
-    cache = PlotCacheTable()
-
-    cached_datum = cache.read_plot(hash_value)
-    if cached_datum is not None:
-        print("Hit in cache!")
-        return ast.literal_eval(cached_datum)
-
-    core_builder = ShapeBuilder("FreeCAD").factory(coreShape)
-    core_builder.set_output_path(f"{temp_folder}/")
-    colors = {
-        "projection_color": "#d4d4d4",
-        "dimension_color": "#d4d4d4"
-    }
-    views = core_builder.get_piece_technical_drawing(coreShape, colors)
-
-    if views['top_view'] is None or views['front_view'] is None:
-        return None
-    else:
-        cache.insert_plot(hash_value, str(views))
-        return views
-
-
-@app.task
-def task_generate_gapping_technical_drawing(data, temp_folder):
-    if 'familySubtype' in data['functionalDescription']['shape']:
-        data['functionalDescription']['shape']['familySubtype'] = str(data['functionalDescription']['shape']['familySubtype'])
-
-    core = MagneticCore(**data)
-    core = core.dict()
-    aux = {
-        "core": core,
-    }
-    hash_value = hashlib.sha256(str(aux).encode()).hexdigest()
-    cache = PlotCacheTable()
-
-    cached_datum = cache.read_plot(hash_value)
-    if cached_datum is not None:
-        print("Hit in cache!")
-        return ast.literal_eval(cached_datum)
-
-    colors = {
-        "projection_color": "#d4d4d4",
-        "dimension_color": "#d4d4d4"
-    }
-
-    views = ShapeBuilder("FreeCAD").get_core_gapping_technical_drawing(project_name=core['functionalDescription']['shape']['name'],
-                                                                       core_data=core,
-                                                                       colors=colors,
-                                                                       save_files=False)
-
-    if views['top_view'] is None or views['front_view'] is None:
-        return None
-    else:
-        cache.insert_plot(hash_value, str(views))
-        return views
+import copy
+import functools
+import sys
+import os
+import time
+import ast
+import base64
+import json
+import shutil
+import tempfile
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from mas_models import MagneticCore, CoreShape
+from celery import Celery
+from kombu import Queue
+from celery.signals import worker_process_init
+# sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../MVB/src/OpenMagneticsVirtualBuilder')))
+from OpenMagneticsVirtualBuilder.builder import Builder as ShapeBuilder  # noqa: E402
+import plot_cache
+from plot_cache import PlotCacheTable
+from singleflight import single_flight
+from canonical import canonical_hash
+
+temp_folder = "/opt/openmagnetics/temp"
+use_celery = ast.literal_eval(os.getenv('USE_CELERY', "True"))
+
+# rpc:// only delivers results to the process that sent the task; the job API
+# (jobs.py) polls from any uvicorn worker, so production sets a shared backend
+# (jobs.check_result_backend warns at startup when it does not).
+CELERY_BACKEND = os.getenv('OM_CELERY_BACKEND', 'rpc://')
+app = Celery('plots',
+             backend=CELERY_BACKEND,
+             broker=os.getenv('OM_CELERY_BROKER', 'pyamqp://guest@localhost//'))
+app.conf.task_track_started = True
+# Each prefork child keeps FreeCAD and the builder warm between tasks, and is
+# replaced after OM_PLOT_WORKER_MAX_TASKS builds so leaked FreeCAD documents
+# cannot grow it forever. Builds are long, so children take one at a time.
+app.conf.worker_max_tasks_per_child = int(os.getenv('OM_PLOT_WORKER_MAX_TASKS', 50))
+app.conf.worker_prefetch_multiplier = 1
+# Two queues so STEP downloads never sit in front of a 3D view someone is
+# waiting on; jobs.py routes each job kind and sets its priority. Run a worker
+# on both queues, plus `-Q plots.interactive` workers for more view capacity.
+INTERACTIVE_QUEUE = "plots.interactive"
+DOWNLOADS_QUEUE = "plots.downloads"
+MAX_PRIORITY = 9
+app.conf.task_queues = (
+    Queue(INTERACTIVE_QUEUE, routing_key=INTERACTIVE_QUEUE, queue_arguments={"x-max-priority": MAX_PRIORITY}),
+    Queue(DOWNLOADS_QUEUE, routing_key=DOWNLOADS_QUEUE, queue_arguments={"x-max-priority": MAX_PRIORITY}),
+)
+app.conf.task_default_queue = DOWNLOADS_QUEUE
+app.conf.task_queue_max_priority = MAX_PRIORITY
+app.conf.task_default_priority = 5
+# With late acks and a prefetch of one a worker holds no message beyond the
+# one it is building, so the next pick is always the highest priority waiting.
+app.conf.task_acks_late = True
+if os.getenv('OM_PLOT_WORKER_MAX_MEMORY_KB'):
+    app.conf.worker_max_memory_per_child = int(os.getenv('OM_PLOT_WORKER_MAX_MEMORY_KB'))
+# Needs `celery worker -B` (or a separate `celery beat`) to actually run.
+app.conf.beat_schedule = {
+    "compact-plot-cache": {
+        "task": "plotter.task_compact_plot_cache",
+        "schedule": float(os.getenv('OM_PLOT_CACHE_COMPACT_INTERVAL', 3600)),
+    },
+}
+
+
+def queue_depth(queue: str) -> int:
+    """Messages waiting in a broker queue (not counting the ones workers
+    already hold). Raises kombu's OperationalError when the broker is down."""
+    with app.connection_for_read() as connection:
+        return connection.default_channel.queue_declare(queue=queue, passive=True).message_count
+
+
+@functools.lru_cache(maxsize=1)
+def shape_builder():
+    """The FreeCAD builder of this process, created once and reused."""
+    return ShapeBuilder("FreeCAD")
+
+
+@functools.lru_cache(maxsize=1)
+def shape_families():
+    """Dimension keys per shape family and subtype; static for a given
+    builder version, so computed once per process."""
+    return shape_builder().get_families()
+
+
+@worker_process_init.connect
+def prewarm_worker(**kwargs):
+    # Pay FreeCAD imports and the families table before the first task does.
+    shape_families()
+
+
+def clean_dimensions(core):
+    # Make sure no unwanted dimension gets in
+    families = shape_families()
+    if "familySubtype" in core['functionalDescription']['shape'] and core['functionalDescription']['shape']['familySubtype'] is not None:
+        dimensions = families[core['functionalDescription']['shape']['family']][int(core['functionalDescription']['shape']['familySubtype'])]
+    else:
+        dimensions = families[core['functionalDescription']['shape']['family']][1]
+    aux = copy.deepcopy(core['functionalDescription']['shape']['dimensions'])
+    for key, value in core['functionalDescription']['shape']['dimensions'].items():
+        if key not in dimensions:
+            aux.pop(key)
+    core['functionalDescription']['shape']['dimensions'] = aux
+    return core
+
+
+# Shape metadata that never changes a drawing (names, aliases, catalog type).
+SHAPE_GEOMETRY_FIELDS = ("family", "familySubtype", "dimensions", "magneticCircuit")
+MODEL_EXTENSIONS = {"core_3d_model": "stl", "core_3d_model_stp": "step",
+                    "core_shape": "stl", "core_shape_stp": "step"}
+
+
+def _normalize(value):
+    """Make equal geometries hash alike: drop nulls, 10 == 10.0, and
+    familySubtype 1 == "1" (the tasks always stringify it)."""
+    if isinstance(value, dict):
+        return {key: (str(item) if key == "familySubtype" else _normalize(item))
+                for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    if isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def _shape_geometry(shape):
+    if not isinstance(shape, dict):
+        return shape
+    return {key: shape.get(key) for key in SHAPE_GEOMETRY_FIELDS}
+
+
+def geometry_hash(kind, data):
+    """Cache hash of a raw plot request, from the fields the build reads.
+    Derived before any pydantic model is built, so hits skip validation.
+    STL and STEP of one core share the hash (one build makes both)."""
+    if kind in ("core_3d_model", "core_3d_model_stp"):
+        relevant = {"plot": "core_3d_model",
+                    "geometricalDescription": data.get("geometricalDescription")}
+    elif kind in ("core_shape", "core_shape_stp"):
+        relevant = {"plot": "core_shape", "shape": _shape_geometry(data)}
+    elif kind == "core_technical_drawing":
+        relevant = {"plot": kind, "shape": _shape_geometry(data)}
+    elif kind == "gapping_technical_drawing":
+        functional = dict(data.get("functionalDescription") or {})
+        functional.pop("material", None)
+        functional["shape"] = _shape_geometry(functional.get("shape"))
+        relevant = {"plot": kind,
+                    "functionalDescription": functional,
+                    "geometricalDescription": data.get("geometricalDescription"),
+                    "processedDescription": data.get("processedDescription")}
+    else:
+        raise ValueError(f"Unknown plot kind {kind!r}")
+    return canonical_hash(_normalize(relevant))
+
+
+def cache_key(kind, data):
+    hash_value = geometry_hash(kind, data)
+    if kind in MODEL_EXTENSIONS:
+        return f"{hash_value}.{MODEL_EXTENSIONS[kind]}"
+    return hash_value
+
+
+@app.task
+def task_compact_plot_cache():
+    result = plot_cache.compact()
+    print(f"Plot cache compacted: {result}")
+    return result
+
+
+@app.task
+def task_generate_core_3d_model(core, temp_folder, stl_or_not_step=True):
+    extension = "stl" if stl_or_not_step else "step"
+    hash_value = geometry_hash("core_3d_model", core)
+    cache = PlotCacheTable()
+
+    cached_datum = cache.read_plot(f"{hash_value}.{extension}")
+    if cached_datum is not None:
+        print("Hit in cache!")
+        return base64.b64encode(cached_datum.body).decode('utf-8')
+
+    if 'familySubtype' in core['functionalDescription']['shape']:
+        core['functionalDescription']['shape']['familySubtype'] = str(core['functionalDescription']['shape']['familySubtype'])
+
+    core = MagneticCore(**core)
+    core = core.dict()
+
+    core = clean_dimensions(core)
+    if not isinstance(core['functionalDescription']['material'], str):
+        core['functionalDescription']['material'] = core['functionalDescription']['material']['name']
+
+    with single_flight(hash_value, f"{temp_folder}/locks"):
+        cached_datum = cache.read_plot(f"{hash_value}.{extension}")
+        if cached_datum is not None:
+            print("Hit in cache after waiting for an identical build!")
+            return base64.b64encode(cached_datum.body).decode('utf-8')
+
+        step_path, stl_path = shape_builder().get_core(project_name=hash_value,
+                                                       geometrical_description=core['geometricalDescription'],
+                                                       output_path=f"{temp_folder}/cores")
+        path = stl_path if stl_or_not_step else step_path
+
+        print(path)
+        if path is None:
+            return None
+
+        # One build writes both files; cache both so the other format is free.
+        data = None
+        for built_extension, built_path in (("stl", stl_path), ("step", step_path)):
+            if built_path is None:
+                continue
+            with open(built_path, "rb") as model:
+                body = model.read()
+            cache.insert_plot(f"{hash_value}.{built_extension}", plot_cache.CONTENT_TYPES[built_extension], body)
+            if built_extension == extension:
+                data = base64.b64encode(body).decode('utf-8')
+        return data
+
+
+@app.task
+def task_generate_core_shape(data, temp_folder, stl_or_not_step=True):
+    """A single core piece. Each build gets its own output directory, so
+    concurrent builds never overwrite each other's files."""
+    extension = "stl" if stl_or_not_step else "step"
+    hash_value = geometry_hash("core_shape", data)
+    cache = PlotCacheTable()
+
+    cached_datum = cache.read_plot(f"{hash_value}.{extension}")
+    if cached_datum is not None:
+        print("Hit in cache!")
+        return base64.b64encode(cached_datum.body).decode('utf-8')
+
+    coreShape = CoreShape(**data)
+    coreShape = coreShape.dict()
+
+    with single_flight(hash_value, f"{temp_folder}/locks"):
+        cached_datum = cache.read_plot(f"{hash_value}.{extension}")
+        if cached_datum is not None:
+            print("Hit in cache after waiting for an identical build!")
+            return base64.b64encode(cached_datum.body).decode('utf-8')
+
+        os.makedirs(f"{temp_folder}/shapes", exist_ok=True)
+        output_path = tempfile.mkdtemp(prefix="shape_", dir=f"{temp_folder}/shapes")
+        try:
+            core_builder = shape_builder().factory(coreShape)
+            core_builder.set_output_path(output_path)
+            step_path, stl_path = core_builder.get_piece(coreShape)
+            if step_path is None:
+                return None
+
+            data = None
+            for built_extension, built_path in (("stl", stl_path), ("step", step_path)):
+                if built_path is None:
+                    continue
+                with open(built_path, "rb") as model:
+                    body = model.read()
+                cache.insert_plot(f"{hash_value}.{built_extension}", plot_cache.CONTENT_TYPES[built_extension], body)
+                if built_extension == extension:
+                    data = base64.b64encode(body).decode('utf-8')
+            return data
+        finally:
+            shutil.rmtree(output_path, ignore_errors=True)
+
+
+@app.task
+def task_generate_core_technical_drawing(data, temp_folder):
+    hash_value = geometry_hash("core_technical_drawing", data)
+    cache = PlotCacheTable()
+
+    cached_datum = cache.read_plot(hash_value)
+    if cached_datum is not None:
+        print("Hit in cache!")
+        return json.loads(cached_datum.body)
+
+    if 'familySubtype' in data:
+        data['familySubtype'] = str(data['familySubtype'])
+
+    coreShape = CoreShape(**data)
+    coreShape = coreShape.dict()
+
+    with single_flight(hash_value, f"{temp_folder}/locks"):
+        cached_datum = cache.read_plot(hash_value)
+        if cached_datum is not None:
+            print("Hit in cache after waiting for an identical build!")
+            return json.loads(cached_datum.body)
+
+        core_builder = shape_builder().factory(coreShape)
+        core_builder.set_output_path(f"{temp_folder}/")
+        colors = {
+            "projection_color": "#d4d4d4",
+            "dimension_color": "#d4d4d4"
+        }
+        views = core_builder.get_piece_technical_drawing(coreShape, colors)
+
+        if views['top_view'] is None or views['front_view'] is None:
+            return None
+        else:
+            cache.insert_plot(hash_value, plot_cache.CONTENT_TYPES["json"], json.dumps(views).encode('utf-8'))
+            return views
+
+
+@app.task
+def task_generate_gapping_technical_drawing(data, temp_folder):
+    hash_value = geometry_hash("gapping_technical_drawing", data)
+    cache = PlotCacheTable()
+
+    cached_datum = cache.read_plot(hash_value)
+    if cached_datum is not None:
+        print("Hit in cache!")
+        return json.loads(cached_datum.body)
+
+    if 'familySubtype' in data['functionalDescription']['shape']:
+        data['functionalDescription']['shape']['familySubtype'] = str(data['functionalDescription']['shape']['familySubtype'])
+
+    core = MagneticCore(**data)
+    core = core.dict()
+
+    with single_flight(hash_value, f"{temp_folder}/locks"):
+        cached_datum = cache.read_plot(hash_value)
+        if cached_datum is not None:
+            print("Hit in cache after waiting for an identical build!")
+            return json.loads(cached_datum.body)
+
+        colors = {
+            "projection_color": "#d4d4d4",
+            "dimension_color": "#d4d4d4"
+        }
+
+        views = shape_builder().get_core_gapping_technical_drawing(project_name=core['functionalDescription']['shape']['name'],
+                                                                   core_data=core,
+                                                                   colors=colors,
+                                                                   save_files=False)
+
+        if views['top_view'] is None or views['front_view'] is None:
+            return None
+        else:
+            cache.insert_plot(hash_value, plot_cache.CONTENT_TYPES["json"], json.dumps(views).encode('utf-8'))
+            return views
@@ -0,0 +1,31 @@
+"""Single-flight guard for FreeCAD builds keyed by the plot cache hash.
+
+When several users open the same catalog core at once, every request computes
+the same hash and, without a guard, each one launches its own build before
+any of them reaches the plot cache. With the guard the first caller builds
+and the others wait for it, then find its result in the cache.
+
+Celery runs tasks in separate prefork processes, so the guard is an exclusive
+flock(). flock locks belong to the open file description, so they also
+exclude threads of one process (the local job pool). Locks are striped over a
+fixed set of files so the lock directory never grows with the cache.
+"""
+import contextlib
+import fcntl
+import os
+
+LOCK_STRIPES_HEX_DIGITS = 3  # 4096 lock files at most
+
+
+@contextlib.contextmanager
+def single_flight(hash_value: str, lock_dir: str):
+    """Hold the build lock for hash_value. Callers re-read the cache inside
+    the block: whoever held the lock before them may have filled it."""
+    os.makedirs(lock_dir, exist_ok=True)
+    path = os.path.join(lock_dir, f"build-{hash_value[:LOCK_STRIPES_HEX_DIGITS]}.lock")
+    with open(path, "a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
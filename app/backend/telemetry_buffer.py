@@ -0,0 +1,196 @@
+"""In-process buffer between POST /telemetry and the database.
+
+Events are queued by the request handler and written by one background thread
+in batches: whenever OM_TELEMETRY_BATCH_ROWS events are waiting, or
+OM_TELEMETRY_FLUSH_MS after the first of them arrived, whichever comes first.
+A batch is one transaction: a COPY into a staging table and three set-based
+merge statements (TelemetryTable.load_many), instead of a connection and three
+round trips per event.
+
+The queue holds at most OM_TELEMETRY_QUEUE_MAX events. Telemetry is best
+effort: under overload, or while the database is down, new events are dropped
+and counted rather than queued without bound; `stats()` reports the counters.
+A batch the sink rejects is written again one event at a time, so an event
+one client got wrong costs that event, not everyone's batch.
+Events still queued when the process exits are lost unless close() runs first
+(the API calls it on shutdown).
+
+KnownHashes is the server half of the MAS hash handshake: the set of design
+hashes this process has recently seen stored, so an event that only names its
+design's hash can be accepted without asking the client for the document. A
+hash only counts as stored once its batch has committed: the API adds it from
+the buffer's on_written callback.
+"""
+import collections
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_ROWS = 500
+DEFAULT_FLUSH_MS = 1000
+DEFAULT_QUEUE_MAX = 10000
+DEFAULT_KNOWN_HASHES = 100000
+
+
+class TelemetryBuffer:
+
+    def __init__(self, sink, batch_rows: int = DEFAULT_BATCH_ROWS, flush_ms: int = DEFAULT_FLUSH_MS,
+                 queue_max: int = DEFAULT_QUEUE_MAX, on_written=None):
+        """sink(batch) writes one batch; on_written(batch), when given, runs
+        after each batch the sink wrote without raising."""
+        self.sink = sink
+        self.on_written = on_written
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_ms / 1000
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.retried = 0
+        self.callback_errors = 0
+        self._queue = queue.Queue(maxsize=queue_max)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closing = threading.Event()
+
+    def put(self, event) -> bool:
+        """Queue one event; False (and counted) when the queue is full."""
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.queued += 1
+        return True
+
+    def _ensure_thread(self):
+        with self._lock:
+            # After a fork the thread of the parent does not exist in the child.
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._closing.clear()
+                self._thread = threading.Thread(target=self._run, name="telemetry-flush", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        """Block for the first event, then collect more until the batch is
+        full or the flush interval since that first event has passed."""
+        try:
+            batch = [self._queue.get(timeout=self.flush_seconds)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._closing.is_set():
+                try:
+                    while len(batch) < self.batch_rows:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            self.sink(batch)
+        except Exception:
+            if len(batch) > 1:
+                logger.warning("Telemetry batch of %d events failed, writing them one at a time", len(batch))
+                with self._lock:
+                    self.retried += 1
+                for event in batch:
+                    self._write([event])
+                return
+            logger.exception("Telemetry event lost")
+            with self._lock:
+                self.failed += 1
+            return
+        with self._lock:
+            self.written += len(batch)
+            self.batches += 1
+        if self.on_written is not None:
+            # The flush thread must outlive a broken callback: if it died,
+            # the queue would fill and every later event be refused.
+            try:
+                self.on_written(batch)
+            except Exception:
+                logger.exception("Telemetry on_written callback failed")
+                with self._lock:
+                    self.callback_errors += 1
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+            elif self._closing.is_set():
+                return
+
+    def close(self, timeout: float = 5):
+        """Write out what is queued and stop the thread."""
+        with self._lock:
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread is None:
+            return
+        self._closing.set()
+        thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"queued": self.queued, "written": self.written, "dropped": self.dropped,
+                    "failed": self.failed, "batches": self.batches, "retried": self.retried,
+                    "callback_errors": self.callback_errors,
+                    "waiting": self._queue.qsize()}
+
+
+class KnownHashes:
+    """Bounded LRU set of MAS hashes known to be in telemetry.designs."""
+
+    def __init__(self, max_entries: int = DEFAULT_KNOWN_HASHES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._hashes = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, mas_hash) -> bool:
+        with self._lock:
+            if mas_hash in self._hashes:
+                self._hashes.move_to_end(mas_hash)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def add(self, mas_hash):
+        with self._lock:
+            self._hashes[mas_hash] = None
+            self._hashes.move_to_end(mas_hash)
+            while len(self._hashes) > self.max_entries:
+                self._hashes.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._hashes), "hits": self.hits, "misses": self.misses}
+
+
+def from_env(sink, on_written=None) -> TelemetryBuffer:
+    return TelemetryBuffer(sink,
+                           batch_rows=int(os.getenv("OM_TELEMETRY_BATCH_ROWS", DEFAULT_BATCH_ROWS)),
+                           flush_ms=int(os.getenv("OM_TELEMETRY_FLUSH_MS", DEFAULT_FLUSH_MS)),
+                           queue_max=int(os.getenv("OM_TELEMETRY_QUEUE_MAX", DEFAULT_QUEUE_MAX)),
+                           on_written=on_written)
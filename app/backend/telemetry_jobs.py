@@ -0,0 +1,257 @@
+"""Incrementally maintained rollups of the telemetry event stream.
+
+Dashboards read `telemetry.events_hourly` and `telemetry.events_daily`: event
+and error counts per time bucket and event_type, source, stage, topology,
+environment and app_version. A background thread folds new events into them
+every OM_TELEMETRY_ROLLUP_INTERVAL seconds, so no analysis query ever scans
+`telemetry.events`.
+
+Progress is an event_id watermark in `telemetry.rollup_watermarks`. Event ids
+are handed out before their transaction commits, so an id can become visible
+after a larger one; the job therefore stops at events older than
+ROLLUP_LAG_SECONDS, by which time every batch writer has committed. Each run
+is one transaction (rollup rows and watermark move together) under a Postgres
+advisory lock, so with several uvicorn workers exactly one does the work.
+
+These tables are created by migration 0008, events.created_at (the event
+time the buckets use) by 0002.
+
+Once migration 0002 has partitioned telemetry.events by month, the same thread
+does the partition upkeep once a day: it creates the partitions of the next
+OM_TELEMETRY_PARTITIONS_AHEAD months, and, when OM_TELEMETRY_RETENTION_MONTHS
+is set, removes partitions that ended more than that many months ago. Their
+rows are first written as gzipped CSV to OM_TELEMETRY_ARCHIVE_DIR when that is
+set. Removal is DETACH + DROP: no bulk DELETE, no table bloat. Rolled-up counts
+are kept forever.
+"""
+import datetime
+import gzip
+import logging
+import os
+import threading
+import time
+
+import sqlalchemy
+
+from .accounts.db import get_engine
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_LAG_SECONDS = 60
+# Arbitrary, but fixed: every process must agree on it.
+ROLLUP_LOCK_KEY = 0x6F6D_726F_6C6C  # "omroll"
+PARTITION_LOCK_KEY = 0x6F6D_7061_7274  # "ompart"
+MAINTENANCE_INTERVAL = 24 * 3600
+GRANULARITIES = {"hourly": "hour", "daily": "day"}
+
+# Missing dimensions roll up under '' (primary key columns cannot be NULL).
+ROLLUP_INSERT = """
+INSERT INTO telemetry.events_{granularity}
+    (bucket, event_type, source, stage, topology, environment, app_version, events, errors)
+SELECT date_trunc('{unit}', e.created_at), COALESCE(e.event_type, ''), COALESCE(e.source, ''),
+       COALESCE(e.stage, ''), COALESCE(d.topology, ''), COALESCE(s.environment, ''),
+       COALESCE(s.app_version, ''), count(*), count(e.error_message)
+FROM telemetry.events e
+LEFT JOIN telemetry.sessions s ON s.session_id = e.session_id
+LEFT JOIN telemetry.designs d ON d.design_id = e.design_id
+WHERE e.event_id > :low AND e.event_id <= :high
+GROUP BY 1, 2, 3, 4, 5, 6, 7
+ON CONFLICT (bucket, event_type, source, stage, topology, environment, app_version)
+DO UPDATE SET events = events_{granularity}.events + EXCLUDED.events,
+              errors = events_{granularity}.errors + EXCLUDED.errors
+"""
+
+
+def roll_up(name: str = "events") -> dict | None:
+    """Fold the events past the watermark into the rollups. Returns what was
+    done, or None when another process holds the lock."""
+    with get_engine().begin() as conn:
+        if not conn.execute(sqlalchemy.text("SELECT pg_try_advisory_xact_lock(:key)"),
+                            {"key": ROLLUP_LOCK_KEY}).scalar():
+            return None
+        return _roll_up(conn, name)
+
+
+def _roll_up(conn, name: str) -> dict:
+    """One roll_up() step on conn, inside the caller's transaction."""
+    conn.execute(sqlalchemy.text(
+        "INSERT INTO telemetry.rollup_watermarks (name, last_event_id) VALUES (:name, 0) "
+        "ON CONFLICT (name) DO NOTHING"), {"name": name})
+    low = conn.execute(sqlalchemy.text(
+        "SELECT last_event_id FROM telemetry.rollup_watermarks WHERE name = :name"),
+        {"name": name}).scalar()
+    high = conn.execute(sqlalchemy.text(
+        "SELECT max(event_id) FROM telemetry.events "
+        "WHERE event_id > :low AND created_at < NOW() - make_interval(secs => :lag)"),
+        {"low": low, "lag": ROLLUP_LAG_SECONDS}).scalar()
+    if high is None:
+        return {"events_from": low, "events_to": low}
+    for granularity, unit in GRANULARITIES.items():
+        conn.execute(sqlalchemy.text(ROLLUP_INSERT.format(granularity=granularity, unit=unit)),
+                     {"low": low, "high": high})
+    conn.execute(sqlalchemy.text(
+        "UPDATE telemetry.rollup_watermarks SET last_event_id = :high, updated_at = NOW() "
+        "WHERE name = :name"), {"high": high, "name": name})
+    return {"events_from": low, "events_to": high}
+
+
+def read_rollup(granularity: str, since=None, until=None, environment=None) -> list[dict]:
+    with get_engine().connect() as conn:
+        rows = conn.execute(sqlalchemy.text(
+            f"SELECT bucket, event_type, source, stage, topology, environment, app_version, events, errors "
+            f"FROM telemetry.events_{granularity} "
+            "WHERE (CAST(:since AS TIMESTAMPTZ) IS NULL OR bucket >= :since) "
+            "AND (CAST(:until AS TIMESTAMPTZ) IS NULL OR bucket < :until) "
+            "AND (CAST(:environment AS TEXT) IS NULL OR environment = :environment) "
+            "ORDER BY bucket, event_type, source"),
+            {"since": since, "until": until, "environment": environment})
+        return [dict(row._mapping) for row in rows]
+
+
+def _month(day: datetime.date, offset: int) -> datetime.date:
+    index = day.year * 12 + day.month - 1 + offset
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def _is_partitioned(conn) -> bool:
+    return conn.execute(sqlalchemy.text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('telemetry.events')")).first() is not None
+
+
+# Partitions of :parent whose range overlaps [:start, :end). A MINVALUE lower
+# bound has no quoted value and counts as -infinity.
+OVERLAPPING_PARTITIONS = r"""
+SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+CROSS JOIN LATERAL (SELECT pg_get_expr(c.relpartbound, c.oid) AS bound) b
+WHERE i.inhparent = CAST(:parent AS regclass)
+  AND CAST(substring(b.bound FROM 'TO \('([^']+)'\)') AS TIMESTAMPTZ) > CAST(:start AS TIMESTAMPTZ)
+  AND COALESCE(CAST(substring(b.bound FROM 'FROM \('([^']+)'\)') AS TIMESTAMPTZ), '-infinity')
+      < CAST(:end AS TIMESTAMPTZ)
+"""
+
+
+def ensure_partitions(months_ahead: int) -> list[str]:
+    """Create the monthly partitions from this month to months_ahead months
+    out (same naming as migration 0002), skipping months an existing partition
+    already covers: the legacy one of 0002 reaches into the month it ran in.
+    Returns the ones created."""
+    created = []
+    with get_engine().begin() as conn:
+        if not conn.execute(sqlalchemy.text("SELECT pg_try_advisory_xact_lock(:key)"),
+                            {"key": PARTITION_LOCK_KEY}).scalar():
+            return created
+        if not _is_partitioned(conn):
+            return created
+        this_month = _month(datetime.datetime.now(datetime.timezone.utc).date(), 0)
+        for offset in range(months_ahead + 1):
+            start, end = _month(this_month, offset), _month(this_month, offset + 1)
+            name = f"events_y{start.year}m{start.month:02d}"
+            if conn.execute(sqlalchemy.text(OVERLAPPING_PARTITIONS),
+                            {"parent": "telemetry.events", "start": f"{start.isoformat()} 00:00:00+00",
+                             "end": f"{end.isoformat()} 00:00:00+00"}).first() is not None:
+                continue
+            conn.execute(sqlalchemy.text(
+                f"CREATE TABLE telemetry.{name} PARTITION OF telemetry.events "
+                f"FOR VALUES FROM ('{start.isoformat()} 00:00:00+00') TO ('{end.isoformat()} 00:00:00+00')"))
+            created.append(name)
+    return created
+
+
+# Partitions of :parent whose upper bound is at or before the cutoff; the
+# DEFAULT partition and the legacy one's MINVALUE lower bound do not matter.
+EXPIRED_PARTITIONS = r"""
+SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = CAST(:parent AS regclass)
+  AND CAST(substring(pg_get_expr(c.relpartbound, c.oid) FROM 'TO \('([^']+)'\)') AS TIMESTAMPTZ)
+      <= date_trunc('month', NOW()) - make_interval(months => :keep)
+ORDER BY 1
+"""
+
+
+def _archive(connection, name: str, archive_dir: str) -> str:
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"telemetry.{name}.csv.gz")
+    cursor = connection.connection.cursor()
+    try:
+        with gzip.open(f"{path}.part", "wb") as handle:
+            cursor.copy_expert(f"COPY telemetry.{name} TO STDOUT WITH (FORMAT csv, HEADER)", handle)
+    finally:
+        cursor.close()
+    os.replace(f"{path}.part", path)
+    return path
+
+
+def apply_retention(keep_months: int, archive_dir: str | None) -> list[str]:
+    """Archive (optionally) and drop the partitions that ended keep_months
+    or more months before this one. Returns the dropped partitions."""
+    dropped = []
+    with get_engine().connect() as conn:
+        if not conn.execute(sqlalchemy.text("SELECT pg_try_advisory_lock(:key)"),
+                            {"key": PARTITION_LOCK_KEY}).scalar():
+            return dropped
+        try:
+            if not _is_partitioned(conn):
+                conn.commit()
+                return dropped
+            names = conn.execute(sqlalchemy.text(EXPIRED_PARTITIONS),
+                                 {"keep": keep_months, "parent": "telemetry.events"}).scalars().all()
+            conn.commit()
+            for name in names:
+                # Archive first: if that fails the partition is still in place.
+                if archive_dir:
+                    logger.info("Archived %s to %s", name, _archive(conn, name, archive_dir))
+                    conn.commit()
+                conn.execute(sqlalchemy.text(f"ALTER TABLE telemetry.events DETACH PARTITION telemetry.{name}"))
+                conn.execute(sqlalchemy.text(f"DROP TABLE telemetry.{name}"))
+                conn.commit()
+                dropped.append(name)
+        finally:
+            conn.rollback()
+            conn.execute(sqlalchemy.text("SELECT pg_advisory_unlock(:key)"), {"key": PARTITION_LOCK_KEY})
+            conn.commit()
+    return dropped
+
+
+def maintain_partitions():
+    ensure_partitions(int(os.getenv("OM_TELEMETRY_PARTITIONS_AHEAD", 3)))
+    if os.getenv("OM_TELEMETRY_RETENTION_MONTHS"):
+        apply_retention(int(os.getenv("OM_TELEMETRY_RETENTION_MONTHS")), os.getenv("OM_TELEMETRY_ARCHIVE_DIR"))
+
+
+class RollupThread(threading.Thread):
+    """Runs roll_up() every interval seconds, and maintain_partitions() once
+    at start and then daily, until stop()."""
+
+    def __init__(self, interval: float):
+        super().__init__(name="telemetry-rollup", daemon=True)
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._next_maintenance = time.monotonic()
+
+    def run(self):
+        while True:
+            if time.monotonic() >= self._next_maintenance:
+                self._next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL
+                try:
+                    maintain_partitions()
+                except Exception:
+                    logger.exception("Telemetry partition maintenance failed")
+            if self._stopped.wait(self.interval):
+                return
+            try:
+                roll_up()
+            except Exception:
+                # The next run starts again from the unchanged watermark.
+                logger.exception("Telemetry rollup failed")
+
+    def stop(self):
+        self._stopped.set()
+
+
+def start_rollups() -> RollupThread | None:
+    interval = float(os.getenv("OM_TELEMETRY_ROLLUP_INTERVAL", 60))
+    if interval <= 0:
+        return None
+    thread = RollupThread(interval)
+    thread.start()
+    return thread
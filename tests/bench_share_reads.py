@@ -0,0 +1,65 @@
+"""Load test for the public share reads (GET /share/d/{token}).
+
+Keeps `--concurrency` requests in flight against a running backend for
+`--seconds`, then prints requests/s and latency percentiles. Run it against
+the same design before and after a change (same uvicorn worker count, same
+OM_DB_POOL_SIZE) and compare requests/s at equal p99:
+
+    venv/bin/python tests/bench_share_reads.py --url http://localhost:8000 \\
+        --token <share token> --concurrency 64 --seconds 30
+
+Not collected by pytest. Create the token by sharing any saved design
+(POST /designs/{id}/share).
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def worker(client, path, deadline, latencies, failures):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            response = await client.get(path)
+            ok = response.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - started)
+        else:
+            failures.append(1)
+
+
+async def run(url, token, concurrency, seconds):
+    latencies, failures = [], []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        deadline = time.perf_counter() + seconds
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client, f"/share/d/{token}", deadline, latencies, failures)
+                               for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    if not latencies:
+        print(f"no successful requests ({len(failures)} failed)")
+        return
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(f"{len(latencies) / elapsed:.0f} req/s over {elapsed:.1f} s, {len(failures)} failed, "
+          f"p50 {percentiles[49] * 1000:.1f} ms, p95 {percentiles[94] * 1000:.1f} ms, "
+          f"p99 {percentiles[98] * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=30)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.token, args.concurrency, args.seconds))
+
+
+if __name__ == "__main__":
+    main()
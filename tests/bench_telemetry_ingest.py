@@ -0,0 +1,87 @@
+"""Throughput benchmark of the telemetry write paths.
+
+Compares, on the same synthetic events, one TelemetryTable.record() per event
+(the old per-event path), record_many() (multi-row upserts per batch) and
+load_many() (COPY into the staging table + set-based merge). Events look like
+real traffic: a few hundred sessions, MAS payloads repeated across events.
+
+Like test_telemetry.py it writes to the real database, tags every row
+`environment = 'development'` and deletes everything it created. It is not
+collected by pytest; run it directly (OM_DB_* env vars set):
+
+    venv/bin/python tests/bench_telemetry_ingest.py --events 5000 --batch 500
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+import sqlalchemy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.backend.accounts.db import get_engine  # noqa: E402
+from app.backend.models import TelemetryTable  # noqa: E402
+
+
+def synthetic_events(count, nonce, sessions=200, designs=50, mas_padding=20000):
+    session_ids = [str(uuid.uuid4()) for _ in range(sessions)]
+    payloads = [{"inputs": {"designRequirements": {"topology": "Flyback"}},
+                 "magnetic": {"_test_nonce": nonce, "variant": index, "padding": "x" * mas_padding}}
+                for index in range(designs)]
+    return [{"session_id": session_ids[index % sessions], "event_type": "bench", "source": "bench",
+             "stage": "intermediate" if index % 3 else "final", "environment": "development",
+             "mas_data": payloads[index % designs] if index % 2 else None, "topology": "Flyback"}
+            for index in range(count)], session_ids
+
+
+def cleanup(session_ids, nonce):
+    with get_engine().begin() as conn:
+        conn.execute(sqlalchemy.text("DELETE FROM telemetry.events WHERE session_id = ANY(:sids)"),
+                     {"sids": session_ids})
+        conn.execute(sqlalchemy.text("DELETE FROM telemetry.designs WHERE mas_data->'magnetic'->>'_test_nonce' = :n"),
+                     {"n": nonce})
+        conn.execute(sqlalchemy.text("DELETE FROM telemetry.sessions WHERE session_id = ANY(:sids)"),
+                     {"sids": session_ids})
+
+
+def run(name, write, events, batch):
+    nonce = str(uuid.uuid4())
+    events, session_ids = synthetic_events(events, nonce)
+    started = time.perf_counter()
+    try:
+        write(events, batch)
+        elapsed = time.perf_counter() - started
+    finally:
+        cleanup(session_ids, nonce)
+    print(f"{name:>12}: {len(events) / elapsed:10.0f} events/s ({elapsed:.2f} s for {len(events)})")
+
+
+def per_event(events, batch):
+    table = TelemetryTable()
+    for event in events:
+        table.record(**event)
+
+
+def batched(method):
+    def write(events, batch):
+        for start in range(0, len(events), batch):
+            method(events[start:start + batch])
+    return write
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args()
+
+    table = TelemetryTable()
+    run("record", per_event, args.events, args.batch)
+    run("record_many", batched(table.record_many), args.events, args.batch)
+    run("load_many", batched(table.load_many), args.events, args.batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -119,10 +119,17 @@ def test_designs_crud_revisions_and_conflict(client, account, mas_document):
     assert len(listing) == 1 and listing[0]["name"] == "Test transformer"
 
     # get returns the document byte-identical
-    fetched = client.get(f"/designs/{design['id']}").json()
+    response = client.get(f"/designs/{design['id']}")
+    fetched = response.json()
     assert fetched["mas"] == mas_document
     assert fetched["mas_version"]
 
+    # conditional get: same ETag is a bodyless 304
+    etag = response.headers["etag"]
+    response = client.get(f"/designs/{design['id']}", headers={"If-None-Match": etag})
+    assert response.status_code == 304 and response.content == b""
+    assert response.headers["etag"] == etag
+
     # identical save is a no-op (with correct If-Match)
     response = client.put(f"/designs/{design['id']}",
                           headers={"If-Match": "1"}, json={"mas": mas_document})
@@ -156,6 +163,16 @@ def test_designs_crud_revisions_and_conflict(client, account, mas_document):
     # rename without mas needs no If-Match
     response = client.put(f"/designs/{design['id']}", json={"name": "Renamed transformer"})
     assert response.status_code == 200 and response.json()["name"] == "Renamed transformer"
+    assert client.get(f"/designs/{design['id']}", headers={"If-None-Match": etag}).status_code == 200
+
+    # the listing carries the denormalized revision count and pages by cursor
+    other = client.post("/designs", json={"name": "Second design", "mas": mas_document}).json()
+    first = client.get("/designs?limit=1").json()
+    assert [d["name"] for d in first["designs"]] == ["Second design"]
+    second = client.get(f"/designs?limit=1&cursor={first['next_cursor']}").json()
+    assert second["designs"][0]["revisions"] == 2 and second["next_cursor"] is None
+    assert client.get("/designs?fields=name").json()["designs"][0] == {"id": other["id"], "name": "Second design"}
+    assert client.delete(f"/designs/{other['id']}").status_code == 200
 
     # delete hides it
     assert client.delete(f"/designs/{design['id']}").status_code == 200
@@ -230,3 +247,21 @@ def test_password_reset_without_smtp_is_503(client):
         pytest.skip("SMTP is configured in this environment")
     response = client.post("/auth/request_password_reset", json={"email": "whoever@example.com"})
     assert response.status_code == 503
+
+
+def test_identical_documents_share_one_blob(client, account, mas_document):
+    import sqlalchemy
+    from app.backend.accounts.db import get_engine
+    from app.backend.canonical import canonical_hash
+
+    document = json.loads(json.dumps(mas_document))
+    document["magnetic"]["manufacturerInfo"] = {"name": "pytest", "reference": uuid.uuid4().hex}
+    first = client.post("/designs", json={"name": "Copy A", "mas": document}).json()
+    second = client.post("/designs", json={"name": "Copy B", "mas": document}).json()
+    assert client.get(f"/designs/{first['id']}").json()["mas"] == document
+    assert client.get(f"/designs/{second['id']}").json()["mas"] == document
+
+    with get_engine().connect() as conn:
+        refcount = conn.execute(sqlalchemy.text("SELECT refcount FROM accounts.mas_blobs WHERE mas_hash = :h"),
+                                {"h": canonical_hash(document)}).scalar_one()
+    assert refcount == 2
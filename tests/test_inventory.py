@@ -67,9 +67,22 @@ def test_inventory_crud_catalog_and_private(client, account):
     assert private_part["name"] == wire["name"]
     assert private_part["schema_errors"] == []
 
-    # listing shows both
-    parts = client.get("/inventory").json()["parts"]
-    assert len(parts) == 2
+    # listing shows both, without the MAS records unless asked for
+    listing = client.get("/inventory").json()
+    parts = listing["parts"]
+    assert len(parts) == 2 and listing["next_cursor"] is None
+    assert "mas" not in parts[0]
+    with_mas = client.get("/inventory?fields=name,mas").json()["parts"]
+    assert next(p for p in with_mas if p["name"] == wire["name"])["mas"] == wire
+    assert set(with_mas[0]) == {"id", "name", "mas"}
+    assert client.get("/inventory?fields=nope").status_code == 422
+
+    # keyset pages by (part_type, name)
+    first = client.get("/inventory?limit=1").json()
+    second = client.get(f"/inventory?limit=1&cursor={first['next_cursor']}").json()
+    assert [p["id"] for p in first["parts"] + second["parts"]] == [p["id"] for p in parts]
+    assert second["next_cursor"] is None
+    assert client.get("/inventory?cursor=garbage").status_code == 422
 
     # upsert by (part_type, name): same wire again updates, no duplicate
     response = client.post("/inventory", json={
@@ -0,0 +1,118 @@
+"""Tests for the plot job API (jobs.py). No broker or FreeCAD build runs:
+submission and Celery state reads are replaced per test, the way a broker
+would answer.
+"""
+import asyncio
+import concurrent.futures
+import pathlib
+import sys
+import time
+
+import kombu
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "app" / "backend"))
+
+import jobs  # noqa: E402
+
+
+def test_compute_revokes_a_job_that_times_out(monkeypatch):
+    submitted, revoked = [], []
+    monkeypatch.setattr(jobs, "submit", lambda kind, payload: submitted.append(kind) or "job-1")
+    monkeypatch.setattr(jobs, "status", lambda job_id: ("running", None))
+    monkeypatch.setattr(jobs, "revoke", revoked.append)
+
+    assert asyncio.run(jobs.compute("core_shape", {}, number_retries=2, timeout=0.05)) is None
+    # Submitted once, waited on twice, then dropped on its own.
+    assert submitted == ["core_shape"] and revoked == ["job-1"]
+
+
+def test_compute_returns_finished_jobs_without_revoking(monkeypatch):
+    revoked = []
+    monkeypatch.setattr(jobs, "submit", lambda kind, payload: "job-2")
+    monkeypatch.setattr(jobs, "status", lambda job_id: ("done", "model"))
+    monkeypatch.setattr(jobs, "revoke", revoked.append)
+
+    assert asyncio.run(jobs.compute("core_shape", {}, timeout=0.05)) == "model"
+    assert revoked == []
+
+
+def _broker_depths(monkeypatch, depth):
+    reads = []
+    monkeypatch.setattr(jobs, "queue_depth", lambda queue: reads.append(queue) or depth)
+    monkeypatch.setattr(jobs, "_queue_depths", {})
+    monkeypatch.setattr(jobs, "MAX_QUEUE_DEPTH", 2)
+    return reads
+
+
+def test_full_queue_rejects_with_retry_after(monkeypatch):
+    reads = _broker_depths(monkeypatch, 1)
+    jobs._admit(jobs.INTERACTIVE_QUEUE)        # 1 waiting: admitted, counted as 2
+    with pytest.raises(HTTPException) as rejected:
+        jobs._admit(jobs.INTERACTIVE_QUEUE)
+    assert rejected.value.status_code == 503
+    assert rejected.value.headers["Retry-After"] == str(jobs.RETRY_AFTER)
+    # Both decisions came from one broker read; the other queue is separate.
+    assert reads == [jobs.INTERACTIVE_QUEUE]
+    jobs._admit(jobs.DOWNLOADS_QUEUE)
+    assert reads == [jobs.INTERACTIVE_QUEUE, jobs.DOWNLOADS_QUEUE]
+
+
+def test_queue_depth_is_reread_after_its_ttl(monkeypatch):
+    reads = _broker_depths(monkeypatch, 0)
+    jobs._admit(jobs.INTERACTIVE_QUEUE)
+    jobs._admit(jobs.INTERACTIVE_QUEUE)
+    assert len(reads) == 1
+    read_at, depth = jobs._queue_depths[jobs.INTERACTIVE_QUEUE]
+    jobs._queue_depths[jobs.INTERACTIVE_QUEUE] = (read_at - jobs.QUEUE_DEPTH_TTL, depth)
+    jobs._admit(jobs.INTERACTIVE_QUEUE)        # stale: asks the broker again
+    assert len(reads) == 2 and jobs._queue_depths[jobs.INTERACTIVE_QUEUE][1] == 1
+
+
+def test_unreachable_broker_admits(monkeypatch):
+    _broker_depths(monkeypatch, 0)
+
+    def down(queue):
+        raise kombu.exceptions.OperationalError("connection refused")
+    monkeypatch.setattr(jobs, "queue_depth", down)
+    for _ in range(3):
+        jobs._admit(jobs.DOWNLOADS_QUEUE)
+
+
+class _RpcResult:
+    """A Celery result that fails the test when read by two threads at once."""
+
+    def __init__(self):
+        self.readers = 0
+
+    @property
+    def state(self):
+        self.readers += 1
+        try:
+            assert self.readers == 1, "concurrent rpc:// reads"
+            time.sleep(0.01)
+            return "SUCCESS"
+        finally:
+            self.readers -= 1
+
+    result = "model"
+
+
+def test_rpc_backend_reads_are_serialized(monkeypatch):
+    monkeypatch.setattr(jobs, "RPC_BACKEND", True)
+    result = _RpcResult()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+        states = list(pool.map(lambda _: jobs._celery_state(result), range(8)))
+    assert states == [("SUCCESS", "model")] * 8
+
+
+def test_rpc_backend_with_several_workers_warns(monkeypatch, caplog):
+    monkeypatch.setattr(jobs, "RPC_BACKEND", True)
+    monkeypatch.setattr(jobs, "use_celery", True)
+    monkeypatch.setenv("WEB_CONCURRENCY", "1")
+    jobs.check_result_backend()
+    assert not caplog.records
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    jobs.check_result_backend()
+    assert "shared result backend" in caplog.text
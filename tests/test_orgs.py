@@ -136,3 +136,32 @@ def test_org_inventory_lifecycle(acme):
     part2 = owner.post(f"/inventory?org={org_id}",
                        json={"part_type": "core", "source": "catalog", "catalog_ref": "Stock core"}).json()
     assert part2["lifecycle"] == "approved"
+
+
+def test_role_changes_apply_at_once(acme, mas_document):
+    """Roles are cached per process; every membership change must drop them."""
+    owner, viewer, org_id = acme["owner"], acme["viewer"], acme["org_id"]
+    assert viewer.post(f"/designs?org={org_id}", json={"name": "x", "mas": mas_document}).status_code == 403
+
+    members = owner.get(f"/orgs/{org_id}/members").json()["members"]
+    viewer_id = next(m["id"] for m in members if m["role"] == "viewer")
+    assert owner.patch(f"/orgs/{org_id}/members/{viewer_id}", json={"role": "member"}).status_code == 200
+    assert viewer.post(f"/designs?org={org_id}", json={"name": "x", "mas": mas_document}).status_code == 200
+
+    assert owner.delete(f"/orgs/{org_id}/members/{viewer_id}").status_code == 200
+    assert viewer.get(f"/designs?org={org_id}").status_code == 404
+
+
+def test_pending_invitations_leave_other_cached_roles_alone(acme):
+    from app.backend.accounts import orgs
+
+    owner, member, org_id = acme["owner"], acme["member"], acme["org_id"]
+    member_id = uuid.UUID(member.get("/auth/me").json()["id"])
+    assert member.get(f"/designs?org={org_id}").status_code == 200   # caches the member's roles
+    assert orgs._role_cache.get(member_id) is not None
+
+    email = f"pytest-org-pending-{uuid.uuid4().hex[:10]}@example.com"
+    invitation = owner.post(f"/orgs/{org_id}/invitations", json={"email": email, "role": "viewer"}).json()
+    assert owner.patch(f"/orgs/{org_id}/members/{invitation['id']}", json={"role": "member"}).status_code == 200
+    assert owner.delete(f"/orgs/{org_id}/members/{invitation['id']}").status_code == 200
+    assert orgs._role_cache.get(member_id) is not None
@@ -0,0 +1,59 @@
+"""Tests for the Argon2 concurrency limit in security.py. No database, no
+hashing: the limited function is a stand-in that waits to be released."""
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.backend.accounts.security import _PasswordLimiter
+
+
+def _wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_at_most_workers_hash_at_once_and_the_rest_are_rejected():
+    limiter = _PasswordLimiter(workers=2, queue_max=3)
+    release = threading.Event()
+    running = []
+    peak = []
+
+    def work(n):
+        running.append(n)
+        peak.append(len(running))
+        release.wait(5)
+        running.remove(n)
+        return n
+
+    results = []
+    threads = [threading.Thread(target=lambda n=n: results.append(limiter.run(work, n))) for n in range(3)]
+    for thread in threads:
+        thread.start()
+    _wait_for(lambda: limiter.stats()["in_flight"] == 3 and len(running) == 2)
+    assert limiter.stats()["queued"] == 1
+
+    with pytest.raises(HTTPException) as rejected:
+        limiter.run(work, 99)
+    assert rejected.value.status_code == 503 and rejected.value.headers["Retry-After"]
+
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert sorted(results) == [0, 1, 2] and max(peak) == 2
+    assert limiter.stats() == {"workers": 2, "queue_max": 3, "in_flight": 0, "queued": 0,
+                               "completed": 3, "rejected": 1}
+
+
+def test_a_failed_hash_frees_its_slot():
+    limiter = _PasswordLimiter(workers=1, queue_max=1)
+
+    def broken():
+        raise ValueError("bad hash")
+
+    with pytest.raises(ValueError):
+        limiter.run(broken)
+    assert limiter.run(lambda: "ok") == "ok"
@@ -0,0 +1,94 @@
+"""Tests for the two-tier plot cache. Unlike the account suites these need no
+database server: the on-disk tier is a throwaway SQLite file.
+"""
+from app.backend.plot_cache import CachedPlot, MemoryLRU, SQLitePlotStore
+
+
+def test_memory_lru_evicts_by_bytes():
+    lru = MemoryLRU(max_bytes=10)
+    lru.put("a", "xxxx", 4)
+    lru.put("b", "yyyy", 4)
+    assert lru.get("a") == "xxxx"          # a is now most recent
+    lru.put("c", "zzzz", 4)                # 12 bytes > 10: evicts b
+    assert lru.get("b") is None
+    assert lru.get("a") == "xxxx" and lru.get("c") == "zzzz"
+    stats = lru.stats()
+    assert stats["bytes"] == 8 and stats["evictions"] == 1
+    assert stats["hits"] == 3 and stats["misses"] == 1
+
+    lru.put("huge", "x" * 11, 11)          # larger than the whole cache: ignored
+    assert lru.get("huge") is None and lru.stats()["entries"] == 2
+
+
+def test_sqlite_store_roundtrip_and_upsert(tmp_path):
+    store = SQLitePlotStore(f"sqlite:///{tmp_path / 'cache.db'}")
+    assert store.get("missing") is None
+    assert store.put("key", CachedPlot("model/stl", b"first"))
+    assert store.put("key", CachedPlot("model/stl", b"second"))   # same hash again must not raise
+    assert store.get("key") == CachedPlot("model/stl", b"second")
+    assert store.stats()["hits"] == 1 and store.stats()["misses"] == 1
+    assert store.engine() is store.engine()
+
+
+def test_sqlite_store_compresses_payloads(tmp_path):
+    store = SQLitePlotStore(f"sqlite:///{tmp_path / 'cache.db'}")
+    body = b"solid core\n" + b"facet normal 0 0 1\n" * 10000
+    store.put("key", CachedPlot("model/stl", body))
+    with store.engine().connect() as conn:
+        size = conn.exec_driver_sql("SELECT size FROM plot_cache WHERE hash = 'key'").scalar()
+    assert size < len(body) / 4
+    assert store.get("key").body == body
+
+
+def test_sqlite_store_unavailable_degrades_to_miss(tmp_path):
+    store = SQLitePlotStore(f"sqlite:///{tmp_path / 'missing-dir' / 'cache.db'}")
+    assert store.get("key") is None
+    assert store.put("key", CachedPlot("model/stl", b"value")) is False
+    assert store.stats()["errors"] == 2
+
+
+def test_sqlite_store_compaction(tmp_path):
+    store = SQLitePlotStore(f"sqlite:///{tmp_path / 'cache.db'}")
+    for index in range(5):
+        store.put(f"key{index}", CachedPlot("application/json", bytes(range(100))))
+    with store.engine().begin() as conn:
+        conn.exec_driver_sql("UPDATE plot_cache SET created_at = '2000-01-01 00:00:00' WHERE hash = 'key0'")
+        conn.exec_driver_sql("UPDATE plot_cache SET last_access = 1 WHERE hash = 'key1'")
+        size = conn.exec_driver_sql("SELECT size FROM plot_cache WHERE hash = 'key1'").scalar()
+    store.get("key2")  # access buffered, flushed by compact()
+
+    result = store.compact(max_bytes=int(size * 2.5), max_age_days=30)
+    assert result["expired"] == 1                      # key0 is too old
+    assert result["evicted"] == 2 and result["bytes"] == size * 2
+    assert store.get("key1") is None                   # least recently accessed goes first
+    assert store.get("key2") is not None
+    assert result["vacuumed"]
+
+
+def test_sqlite_store_drops_rows_of_old_cache_files(tmp_path):
+    import sqlite3
+    path = tmp_path / "cache.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE plot_cache (hash VARCHAR PRIMARY KEY, data VARCHAR, created_at VARCHAR)")
+        conn.execute("INSERT INTO plot_cache VALUES ('old', 'YWJj', '2026-01-01 00:00:00')")
+    store = SQLitePlotStore(f"sqlite:///{path}")
+    assert store.get("old") is None
+    assert store.put("new", CachedPlot("model/step", b"abc"))
+    assert store.get("new").body == b"abc"
+
+
+def test_pack_store_is_read_only(tmp_path):
+    path = tmp_path / "pack.db"
+    writer = SQLitePlotStore(f"sqlite:///{path}")
+    writer.put("catalog", CachedPlot("model/stl", b"etd49"))
+    writer.finalize()
+    assert not (tmp_path / "pack.db-wal").exists()
+
+    pack = SQLitePlotStore(f"sqlite:///{path}", readonly=True)
+    assert pack.get("catalog") == CachedPlot("model/stl", b"etd49")
+    assert pack.put("custom", CachedPlot("model/stl", b"x")) is False
+    assert pack.get("custom") is None
+
+    missing = SQLitePlotStore(f"sqlite:///{tmp_path / 'missing.db'}", readonly=True)
+    assert missing.get("catalog") is None and missing.stats()["errors"] == 1
+    assert not (tmp_path / "missing.db").exists()
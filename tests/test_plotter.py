@@ -0,0 +1,96 @@
+"""Tests for the plot tasks' cache keys and build directories. No FreeCAD
+build runs: the builder is replaced where a test needs one.
+"""
+import pathlib
+import sys
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "app" / "backend"))
+
+import plotter  # noqa: E402
+
+
+def _shape(**overrides):
+    shape = {"name": "E 42/21/15", "aliases": ["E42"], "type": "standard", "family": "e",
+             "familySubtype": "1", "dimensions": {"A": 0.042, "B": 0.021, "C": 0.015}}
+    shape.update(overrides)
+    return shape
+
+
+def test_equivalent_shapes_share_a_cache_key():
+    key = plotter.cache_key("core_shape", _shape())
+    # Names and catalog metadata, nulls, key order and int/str subtypes do not matter.
+    assert plotter.cache_key("core_shape", _shape(name="Custom", aliases=[], type="custom")) == key
+    assert plotter.cache_key("core_shape", _shape(familySubtype=1, magneticCircuit=None)) == key
+    assert plotter.cache_key("core_shape", dict(reversed(list(_shape().items())))) == key
+    assert plotter.cache_key("core_shape", _shape(dimensions={"C": 0.015, "B": 0.021, "A": 0.042})) == key
+    assert plotter.cache_key("core_technical_drawing", _shape(dimensions={"A": 1, "B": 2})) == \
+        plotter.cache_key("core_technical_drawing", _shape(dimensions={"A": 1.0, "B": 2.0}))
+
+
+def test_different_geometries_get_different_cache_keys():
+    key = plotter.cache_key("core_shape", _shape())
+    assert plotter.cache_key("core_shape", _shape(dimensions={"A": 0.043, "B": 0.021, "C": 0.015})) != key
+    assert plotter.cache_key("core_shape", _shape(family="etd")) != key
+    assert plotter.cache_key("core_technical_drawing", _shape()) != key
+    # One build makes both formats: same hash, different key.
+    step = plotter.cache_key("core_shape_stp", _shape())
+    assert step != key and step.split(".")[0] == key.split(".")[0]
+
+
+class _NoCache:
+    def __init__(self):
+        self.inserted = {}
+
+    def read_plot(self, key):
+        return None
+
+    def insert_plot(self, key, content_type, body):
+        self.inserted[key] = body
+
+
+class _Builder:
+    """Writes into the output path it is given, then optionally fails."""
+
+    def __init__(self, fail):
+        self.fail = fail
+        self.output_paths = []
+
+    def factory(self, shape):
+        return self
+
+    def set_output_path(self, path):
+        self.output_paths.append(path)
+
+    def get_piece(self, shape):
+        stl = pathlib.Path(self.output_paths[-1]) / "piece.stl"
+        stl.write_bytes(b"solid piece")
+        if self.fail:
+            raise RuntimeError("FreeCAD crashed")
+        stl.with_suffix(".step").write_bytes(b"ISO-10303-21;")
+        return str(stl.with_suffix(".step")), str(stl)
+
+
+def _build_shape(monkeypatch, tmp_path, builder):
+    monkeypatch.setattr(plotter, "PlotCacheTable", _NoCache)
+    monkeypatch.setattr(plotter, "shape_builder", lambda: builder)
+    return plotter.task_generate_core_shape(_shape(), str(tmp_path))
+
+
+def test_core_shape_build_directory_is_removed_on_failure(monkeypatch, tmp_path):
+    builder = _Builder(fail=True)
+    with pytest.raises(RuntimeError):
+        _build_shape(monkeypatch, tmp_path, builder)
+    assert len(builder.output_paths) == 1
+    assert not pathlib.Path(builder.output_paths[0]).exists()
+    assert list((tmp_path / "shapes").iterdir()) == []
+
+
+def test_core_shape_builds_get_their_own_directory(monkeypatch, tmp_path):
+    builder = _Builder(fail=False)
+    assert _build_shape(monkeypatch, tmp_path, builder) is not None
+    assert _build_shape(monkeypatch, tmp_path, builder) is not None
+    first, second = builder.output_paths
+    assert first != second and pathlib.Path(first).parent == tmp_path / "shapes"
+    assert list((tmp_path / "shapes").iterdir()) == []
@@ -0,0 +1,49 @@
+"""Tests for the rate limiter backends. No database, explicit clock."""
+import pytest
+
+from app.backend.accounts.ratelimit import MemoryBackend, SQLiteBackend
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBackend()
+    return SQLiteBackend(str(tmp_path / "ratelimit.db"))
+
+
+def test_limit_holds_within_window_and_reports_retry_after(backend):
+    assert all(backend.hit(("ip", "login"), 3, 60, now=600.0)[0] for _ in range(3))
+    allowed, retry_after = backend.hit(("ip", "login"), 3, 60, now=610.0)
+    assert not allowed
+    assert 0 < retry_after <= 51
+    assert backend.hit(("other-ip", "login"), 3, 60, now=610.0)[0]
+
+
+def test_window_slides_instead_of_resetting(backend):
+    for _ in range(4):
+        assert backend.hit("key", 4, 60, now=650.0)[0]
+    # Just past the boundary the previous window still weighs 59/60: a fixed
+    # window would allow 4 more here.
+    assert backend.hit("key", 4, 60, now=661.0)[0]
+    assert not backend.hit("key", 4, 60, now=661.0)[0]
+    # Half-way through, half of its 4 requests still count.
+    assert backend.hit("key", 4, 60, now=690.0)[0]
+    assert not backend.hit("key", 4, 60, now=690.0)[0]
+
+
+def test_shared_sqlite_store_limits_across_instances(tmp_path):
+    path = str(tmp_path / "ratelimit.db")
+    first, second = SQLiteBackend(path), SQLiteBackend(path)
+    assert first.hit("key", 2, 60, now=600.0)[0]
+    assert second.hit("key", 2, 60, now=600.0)[0]
+    assert not first.hit("key", 2, 60, now=601.0)[0]
+
+
+def test_memory_keys_expire_individually():
+    backend = MemoryBackend()
+    backend.hit("old", 5, 10, now=100.0)
+    backend.hit("recent", 5, 10, now=115.0)
+    assert len(backend) == 2
+    backend.hit("recent", 5, 10, now=121.0)   # "old" expired at 120
+    assert len(backend) == 1
+    assert backend.hit("old", 1, 10, now=121.0)[0]
@@ -0,0 +1,69 @@
+"""Tests for the revision delta encoding. No database: rows are built in memory."""
+import copy
+import random
+import uuid
+
+from app.backend.accounts.models import DesignRevision, MasBlob
+from app.backend.accounts.revisions import SNAPSHOT_EVERY, apply_patch, compress_previous, diff, reconstruct
+
+
+def _document(seed):
+    rng = random.Random(seed)
+    return {
+        "inputs": {"designRequirements": {"name": "trafo", "turnsRatios": [{"nominal": 2.0}]},
+                   "operatingPoints": [{"excitationsPerWinding": [{"frequency": 100000,
+                                                                   "current": {"waveform": {"data": [
+                                                                       rng.random() for _ in range(50)]}}}]}]},
+        "magnetic": {"coil": {"functionalDescription": [{"name": "primary", "numberTurns": rng.randint(1, 60)}]},
+                     "manufacturerInfo": {"name": "a/b~c", "reference": None, "flag": True}},
+    }
+
+
+def test_diff_and_apply_roundtrip_edge_cases():
+    source = {"a": 1, "b": [1, 2, 3], "c": {"x": True}, "esc/ape~": "v"}
+    target = {"a": 1.0, "b": [1, 3], "c": {"x": 1}, "new": [None], "esc/ape~": "w"}
+    patch = diff(source, target)
+    patched = apply_patch(source, patch)
+    assert patched == target and type(patched["a"]) is float and type(patched["c"]["x"]) is int
+    assert source["b"] == [1, 2, 3]   # the input is not modified
+    assert diff(target, target) == []
+    assert apply_patch([1], diff([1], {"k": 1})) == {"k": 1}
+
+
+def test_random_edits_roundtrip():
+    rng = random.Random(7)
+    document = _document(0)
+    for _ in range(100):
+        edited = copy.deepcopy(document)
+        data = edited["inputs"]["operatingPoints"][0]["excitationsPerWinding"][0]["current"]["waveform"]["data"]
+        data[rng.randrange(len(data))] = rng.random()
+        if rng.random() < 0.3:
+            data.append(rng.random())
+        windings = edited["magnetic"]["coil"]["functionalDescription"]
+        if rng.random() < 0.3 and len(windings) < 3:
+            windings.insert(0, {"name": f"w{len(windings)}"})
+        elif rng.random() < 0.3 and len(windings) > 1:
+            windings.pop()
+        assert apply_patch(document, diff(document, edited)) == edited
+        document = edited
+
+
+def test_reverse_delta_chain_reconstructs_every_revision():
+    design_id = uuid.uuid4()
+    documents, rows = [], []
+    for number in range(1, 24):
+        document = _document(0)
+        document["magnetic"]["coil"]["functionalDescription"][0]["numberTurns"] = number
+        if rows:
+            compress_previous(rows[-1], document)
+        rows.append(DesignRevision(design_id=design_id, revision=number, blob=MasBlob(mas=document)))
+        documents.append(document)
+
+    full = [row.revision for row in rows if row.mas is not None]
+    assert full == [SNAPSHOT_EVERY, 2 * SNAPSHOT_EVERY, 23]
+    for row, document in zip(rows, documents):
+        newer = [candidate for candidate in rows if candidate.revision > row.revision]
+        stop = next((candidate.revision for candidate in newer if candidate.mas is not None), None)
+        chain = sorted((candidate for candidate in newer if candidate.revision <= stop),
+                       key=lambda candidate: -candidate.revision) if stop else []
+        assert reconstruct(row, chain) == document
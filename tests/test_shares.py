@@ -73,6 +73,8 @@ def test_design_share_lifecycle(alice, mas_document):
     assert shared.json()["name"] == "Shared trafo"
     assert shared.json()["mas"] == mas_document
     assert "max-age" in shared.headers.get("cache-control", "")
+    revalidated = anonymous.get(f"/share/d/{token}", headers={"If-None-Match": shared.headers["etag"]})
+    assert revalidated.status_code == 304 and "max-age" in revalidated.headers["cache-control"]
 
     # visit counter moved
     listed = alice.get("/me/shares").json()["shares"]
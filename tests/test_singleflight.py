@@ -0,0 +1,41 @@
+"""Tests for the single-flight build guard; a throwaway lock directory is all
+they need.
+"""
+import threading
+import time
+
+from app.backend.singleflight import single_flight
+
+
+def test_concurrent_identical_builds_run_once(tmp_path):
+    cache, builds = {}, []
+    start = threading.Barrier(2)
+
+    def build(hash_value):
+        start.wait()
+        if hash_value in cache:
+            return cache[hash_value]
+        with single_flight(hash_value, str(tmp_path / "locks")):
+            if hash_value not in cache:   # the re-read the callers must do
+                builds.append(hash_value)
+                time.sleep(0.2)
+                cache[hash_value] = f"model of {hash_value}"
+        return cache[hash_value]
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(build("abc123"))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert builds == ["abc123"]
+    assert results == ["model of abc123"] * 2
+
+
+def test_locks_are_striped_by_hash_prefix(tmp_path):
+    lock_dir = tmp_path / "locks"
+    for hash_value in ("abc111", "abc222", "def333"):
+        with single_flight(hash_value, str(lock_dir)):
+            pass
+    assert sorted(path.name for path in lock_dir.iterdir()) == ["build-abc.lock", "build-def.lock"]
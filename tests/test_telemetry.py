@@ -2,7 +2,7 @@
 
 Exercises the real HTTP path end to end:
 
-    POST /telemetry  ->  BackgroundTask  ->  telemetry.{sessions,designs,events}
+    POST /telemetry  ->  TelemetryBuffer (batched)  ->  telemetry.{sessions,designs,events}
 
 and asserts the rows land in the (production) Postgres DB. Every row this test
 writes is tagged `environment = 'development'` so it is trivially filtered out
@@ -27,6 +27,7 @@ import os
 import json
 import time
 import uuid
+import urllib.error
 import urllib.request
 
 import sqlalchemy
@@ -47,12 +48,16 @@ def _engine():
 
 
 def _post(payload):
+    return _post_json(payload)[0]
+
+
+def _post_json(payload):
     body = json.dumps(payload).encode("utf-8")
     req = urllib.request.Request(
         TELEMETRY_URL, data=body, headers={"Content-Type": "application/json"}
     )
     with urllib.request.urlopen(req, timeout=10) as resp:
-        return resp.status
+        return resp.status, json.loads(resp.read())
 
 
 def test_telemetry_records_in_db():
@@ -84,7 +89,7 @@ def test_telemetry_records_in_db():
             status = _post(payload)
             assert status == 200, f"POST /telemetry returned {status}"
 
-        # Background tasks are async; poll until all three events land (or time out).
+        # Events are written in batches; poll until all three land (or time out).
         rows = []
         for _ in range(20):  # up to ~10s
             with engine.connect() as conn:
@@ -134,6 +139,67 @@ def test_telemetry_records_in_db():
         engine.dispose()
 
 
+def test_telemetry_mas_hash_handshake():
+    import sys
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+    from app.backend.canonical import canonical_hash
+
+    engine = _engine()
+    session_id = str(uuid.uuid4())
+    mas = {"inputs": {"designRequirements": {"topology": "Buck"}},
+           "magnetic": {"_test_nonce": session_id}}
+    mas_hash = canonical_hash(mas)
+    base = {"session_id": session_id, "environment": "development", "source": "handshake",
+            "stage": "final", "topology": "Buck"}
+    try:
+        # Unknown design: the server asks for the document and records nothing.
+        assert _post_json(dict(base, event_type="first", mas_hash=mas_hash)) == (200, {"mas_needed": True})
+        assert _post_json(dict(base, event_type="first", mas_hash=mas_hash, mas_data=mas)) == \
+            (200, {"mas_needed": False})
+        # Known once its batch has committed: then the hash alone is enough.
+        for _ in range(20):
+            answer = _post_json(dict(base, event_type="second", mas_hash=mas_hash))
+            if answer != (200, {"mas_needed": True}):
+                break
+            time.sleep(0.5)
+        assert answer == (200, {"mas_needed": False})
+
+        rows = []
+        for _ in range(20):
+            with engine.connect() as conn:
+                rows = conn.execute(sqlalchemy.text(
+                    "SELECT e.event_type, d.mas_hash FROM telemetry.events e "
+                    "LEFT JOIN telemetry.designs d USING (design_id) "
+                    "WHERE e.session_id = :sid ORDER BY e.event_id"), {"sid": session_id}).fetchall()
+            if len(rows) >= 2:
+                break
+            time.sleep(0.5)
+        assert [(r.event_type, r.mas_hash) for r in rows] == [("first", mas_hash), ("second", mas_hash)]
+    finally:
+        with engine.begin() as conn:
+            conn.execute(sqlalchemy.text(
+                "DELETE FROM telemetry.events WHERE session_id = :sid"), {"sid": session_id})
+            conn.execute(sqlalchemy.text(
+                "DELETE FROM telemetry.designs WHERE mas_data->'magnetic'->>'_test_nonce' = :n"),
+                {"n": session_id})
+            conn.execute(sqlalchemy.text(
+                "DELETE FROM telemetry.sessions WHERE session_id = :sid"), {"sid": session_id})
+        engine.dispose()
+
+
+def test_telemetry_rejects_malformed_fields():
+    base = {"session_id": str(uuid.uuid4()), "environment": "development", "event_type": "malformed",
+            "source": "pytest"}
+    for bad in ({"result_count": "abc"}, {"result_count": 3.5}, {"result_count": True},
+                {"session_id": {"nested": 1}}, {"event_type": ["list"]}, {"mas_data": {"name": "a\x00b"}}):
+        try:
+            _post(dict(base, **bad))
+        except urllib.error.HTTPError as error:
+            assert error.code == 422, (bad, error.code)
+        else:
+            raise AssertionError(f"{bad} was accepted")
+
+
 if __name__ == "__main__":
     import sys
     try:
@@ -0,0 +1,109 @@
+"""Tests for the telemetry batching buffer. No database: the sink is a list."""
+import threading
+import time
+
+from app.backend.telemetry_buffer import KnownHashes, TelemetryBuffer
+
+
+def test_buffer_flushes_full_batches_and_on_interval():
+    batches = []
+    buffer = TelemetryBuffer(batches.append, batch_rows=3, flush_ms=200, queue_max=100)
+    for index in range(4):
+        assert buffer.put({"n": index})
+    deadline = time.monotonic() + 5
+    while buffer.stats()["written"] < 4 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert [len(batch) for batch in batches] == [3, 1]   # full batch, then the interval flush
+    assert buffer.stats()["batches"] == 2
+    buffer.close()
+
+
+def test_buffer_drops_and_counts_under_overload():
+    release = threading.Event()
+    written = []
+
+    def slow_sink(batch):
+        release.wait(5)
+        written.extend(batch)
+
+    buffer = TelemetryBuffer(slow_sink, batch_rows=1, flush_ms=50, queue_max=2)
+    accepted = [buffer.put({"n": index}) for index in range(10)]
+    assert accepted.count(False) == buffer.stats()["dropped"] > 0
+    release.set()
+    buffer.close()
+    assert len(written) == accepted.count(True)
+
+
+def test_failed_batches_are_counted_not_raised():
+    def broken_sink(batch):
+        raise RuntimeError("database down")
+
+    buffer = TelemetryBuffer(broken_sink, batch_rows=10, flush_ms=50)
+    buffer.put({"n": 1})
+    buffer.put({"n": 2})
+    buffer.close()
+    assert buffer.stats()["failed"] == 2 and buffer.stats()["written"] == 0
+
+
+def test_a_bad_event_only_loses_itself():
+    written = []
+
+    def sink(batch):
+        if any(event.get("bad") for event in batch):
+            raise ValueError("invalid input syntax for type integer")
+        written.extend(batch)
+
+    buffer = TelemetryBuffer(sink, batch_rows=3, flush_ms=200)
+    for event in ({"n": 1}, {"n": 2, "bad": True}, {"n": 3}):
+        buffer.put(event)
+    buffer.close()
+    assert written == [{"n": 1}, {"n": 3}]
+    stats = buffer.stats()
+    assert (stats["written"], stats["failed"], stats["retried"], stats["batches"]) == (2, 1, 1, 2)
+
+
+def test_a_failing_callback_does_not_stop_the_flush_thread():
+    written = []
+
+    def on_written(batch):
+        raise KeyError("mas_hash")
+
+    buffer = TelemetryBuffer(written.extend, batch_rows=1, flush_ms=50, on_written=on_written)
+    buffer.put({"n": 1})
+    deadline = time.monotonic() + 5
+    while buffer.stats()["callback_errors"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    buffer.put({"n": 2})
+    buffer.close()
+    assert written == [{"n": 1}, {"n": 2}]
+    assert buffer.stats()["written"] == 2 and buffer.stats()["callback_errors"] == 2
+
+
+def test_known_hashes_is_a_bounded_lru():
+    known = KnownHashes(max_entries=2)
+    known.add("a")
+    known.add("b")
+    assert "a" in known                    # a is now most recent
+    known.add("c")                         # evicts b
+    assert "b" not in known
+    assert "a" in known and "c" in known
+    assert known.stats() == {"entries": 2, "hits": 3, "misses": 1}
+
+
+def test_on_written_only_sees_committed_batches():
+    committed = []
+    fail = threading.Event()
+
+    def sink(batch):
+        if fail.is_set():
+            raise RuntimeError("database down")
+
+    buffer = TelemetryBuffer(sink, batch_rows=1, flush_ms=50, on_written=committed.extend)
+    buffer.put({"n": 1})
+    deadline = time.monotonic() + 5
+    while buffer.stats()["written"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    fail.set()
+    buffer.put({"n": 2})
+    buffer.close()
+    assert committed == [{"n": 1}] and buffer.stats()["failed"] == 1
@@ -0,0 +1,116 @@
+"""Tests for the telemetry rollups and partition upkeep (telemetry_jobs.py).
+
+_month needs nothing. The others run against the real database (OM_DB_*
+environment variables, migrations applied) inside a transaction that is
+rolled back, so they leave neither events nor rollup counts behind.
+"""
+import datetime
+import uuid
+
+import pytest
+import sqlalchemy
+
+from app.backend import telemetry_jobs
+from app.backend.accounts.db import get_engine
+
+
+def test_month_offsets_cross_year_boundaries():
+    month = telemetry_jobs._month
+    assert month(datetime.date(2026, 10, 17), 0) == datetime.date(2026, 10, 1)
+    assert month(datetime.date(2026, 10, 17), 3) == datetime.date(2027, 1, 1)
+    assert month(datetime.date(2026, 12, 31), 1) == datetime.date(2027, 1, 1)
+    assert month(datetime.date(2026, 1, 1), -1) == datetime.date(2025, 12, 1)
+    assert month(datetime.date(2026, 3, 31), -14) == datetime.date(2025, 1, 1)
+
+
+@pytest.fixture()
+def conn():
+    connection = get_engine().connect()
+    transaction = connection.begin()
+    yield connection
+    transaction.rollback()
+    connection.close()
+
+
+def test_roll_up_advances_the_watermark_past_settled_events(conn):
+    name = f"pytest-{uuid.uuid4().hex[:10]}"
+    event_type = f"pytest-rollup-{uuid.uuid4().hex[:10]}"
+    session_id = str(uuid.uuid4())
+    conn.execute(sqlalchemy.text(
+        "INSERT INTO telemetry.rollup_watermarks (name, last_event_id) "
+        "SELECT :name, COALESCE(max(event_id), 0) FROM telemetry.events"), {"name": name})
+    conn.execute(sqlalchemy.text(
+        "INSERT INTO telemetry.sessions (session_id, environment) VALUES (:sid, 'development')"),
+        {"sid": session_id})
+    settled = conn.execute(sqlalchemy.text(
+        "INSERT INTO telemetry.events (session_id, event_type, source, error_message, created_at) "
+        "VALUES (:sid, :type, 'pytest', NULL, NOW() - interval '5 minutes'), "
+        "       (:sid, :type, 'pytest', NULL, NOW() - interval '5 minutes'), "
+        "       (:sid, :type, 'pytest', 'boom', NOW() - interval '5 minutes') "
+        "RETURNING event_id"), {"sid": session_id, "type": event_type}).scalars().all()
+    # Too recent: its writer may not have committed everything before it.
+    conn.execute(sqlalchemy.text(
+        "INSERT INTO telemetry.events (session_id, event_type, source) VALUES (:sid, :type, 'pytest')"),
+        {"sid": session_id, "type": event_type})
+
+    done = telemetry_jobs._roll_up(conn, name)
+    assert done["events_to"] == max(settled) > done["events_from"]
+    assert conn.execute(sqlalchemy.text(
+        "SELECT last_event_id FROM telemetry.rollup_watermarks WHERE name = :name"),
+        {"name": name}).scalar() == max(settled)
+    for granularity in telemetry_jobs.GRANULARITIES:
+        counts = conn.execute(sqlalchemy.text(
+            f"SELECT sum(events), sum(errors) FROM telemetry.events_{granularity} WHERE event_type = :type"),
+            {"type": event_type}).one()
+        assert tuple(counts) == (3, 1)
+
+    # Nothing new has settled: the watermark stays put.
+    assert telemetry_jobs._roll_up(conn, name) == {"events_from": max(settled), "events_to": max(settled)}
+
+
+def _partitioned(conn, partitions):
+    """A temporary stand-in for telemetry.events with the given partitions
+    (name -> FOR VALUES clause, or DEFAULT)."""
+    conn.execute(sqlalchemy.text(
+        "CREATE TEMP TABLE pytest_events (created_at TIMESTAMPTZ NOT NULL) PARTITION BY RANGE (created_at)"))
+    for partition, bound in partitions.items():
+        bound = bound if bound == "DEFAULT" else f"FOR VALUES {bound}"
+        conn.execute(sqlalchemy.text(f"CREATE TEMP TABLE {partition} PARTITION OF pytest_events {bound}"))
+
+
+def test_expired_partitions_are_found_by_their_upper_bound(conn):
+    this_month = telemetry_jobs._month(datetime.date.today(), 0)
+    next_month = telemetry_jobs._month(this_month, 1)
+    _partitioned(conn, {
+        "pytest_legacy": "FROM (MINVALUE) TO ('2020-01-01 00:00:00+00')",
+        "pytest_y2020m01": "FROM ('2020-01-01 00:00:00+00') TO ('2020-02-01 00:00:00+00')",
+        "pytest_current": f"FROM ('{this_month} 00:00:00+00') TO ('{next_month} 00:00:00+00')",
+        "pytest_default": "DEFAULT",
+    })
+
+    def expired(keep):
+        return conn.execute(sqlalchemy.text(telemetry_jobs.EXPIRED_PARTITIONS),
+                            {"keep": keep, "parent": "pytest_events"}).scalars().all()
+
+    assert expired(0) == ["pytest_legacy", "pytest_y2020m01"]
+    assert expired(1200) == []
+
+
+def test_months_covered_by_the_legacy_partition_are_skipped(conn):
+    # As migration 0002 leaves it: legacy reaches the first of next month.
+    next_month = telemetry_jobs._month(datetime.date.today(), 1)
+    after = telemetry_jobs._month(next_month, 1)
+    _partitioned(conn, {
+        "pytest_legacy": f"FROM (MINVALUE) TO ('{next_month} 00:00:00+00')",
+        "pytest_next": f"FROM ('{next_month} 00:00:00+00') TO ('{after} 00:00:00+00')",
+        "pytest_default": "DEFAULT",
+    })
+
+    def overlapping(start, end):
+        return conn.execute(sqlalchemy.text(telemetry_jobs.OVERLAPPING_PARTITIONS),
+                            {"parent": "pytest_events", "start": f"{start} 00:00:00+00",
+                             "end": f"{end} 00:00:00+00"}).scalars().all()
+
+    assert overlapping(telemetry_jobs._month(next_month, -1), next_month) == ["pytest_legacy"]
+    assert overlapping(next_month, after) == ["pytest_next"]
+    assert overlapping(after, telemetry_jobs._month(after, 1)) == []